@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+u""" Benchmarks of ``postal_address`` hot paths.
+
+Each benchmark runs a fixed workload, drawn from a seeded random generator, and
+reports the best time per operation over several repeats::
+
+    $ python ./benchmarks/run.py --output results.json
+
+Results can be compared to a baseline produced by a previous run. The command
+fails if any benchmark is slower than its baseline by more than a threshold::
+
+    $ python ./benchmarks/run.py --compare baseline.json --threshold 0.25
+
+Benchmarks suffixed by ``[cold]`` clear caches of the measured function before
+each operation.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import argparse
+import json
+import platform
+import random
+import sys
+import timeit
+from collections import OrderedDict
+
+from postal_address import __version__
+from postal_address.address import (
+    Address,
+    InvalidAddress,
+    faker_instance,
+    faker_locales,
+    random_address
+)
+from postal_address.territory import (
+    country_aliases,
+    normalize_territory_code,
+    supported_country_codes,
+    supported_subdivision_codes,
+    territory_children_codes,
+    territory_parents
+)
+
+# Seed of all workloads.
+SEED = 1
+
+# Number of items of each workload.
+WORKLOAD_SIZE = 100
+
+# Minimal duration of each timed run, in seconds, to smooth out noise.
+MIN_RUN_TIME = 0.1
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """ Register a benchmark.
+
+    The decorated function takes a seeded ``random.Random`` instance, and
+    returns a ``(function, operations)`` tuple, of which ``function`` runs
+    ``operations`` operations of the benchmark.
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def sample(rng, population, size=WORKLOAD_SIZE):
+    """ Draw a reproducible sample of items, with replacement. """
+    population = sorted(population)
+    return [rng.choice(population) for _ in range(size)]
+
+
+def address_fields(rng, with_subdivision):
+    """ Build a workload of address fields. """
+    if with_subdivision:
+        territories = {'subdivision_code': sample(
+            rng, supported_subdivision_codes())}
+    else:
+        territories = {'country_code': sample(
+            rng, supported_country_codes())}
+    workload = []
+    for index in range(WORKLOAD_SIZE):
+        fields = {
+            'line1': '  {} rue de la  Paix '.format(index),
+            'postal_code': ' {:05d}-a '.format(rng.randint(0, 99999)),
+            'city_name': 'Paris'}
+        for field_id, codes in territories.items():
+            fields[field_id] = codes[index].lower()
+        workload.append(fields)
+    return workload
+
+
+def addresses(rng, with_subdivision):
+    """ Build a workload of normalized addresses. """
+    return [
+        Address(strict=False, **fields)
+        for fields in address_fields(rng, with_subdivision)]
+
+
+def reset(address, slot):
+    """ Drop the cached normalization state or derived values of an address.
+    """
+    object.__setattr__(address, slot, None)
+
+
+@benchmark('Address() with country')
+def bench_address_country(rng):
+    workload = address_fields(rng, with_subdivision=False)
+    return (
+        lambda: [Address(strict=False, **fields) for fields in workload],
+        len(workload))
+
+
+@benchmark('Address() with subdivision')
+def bench_address_subdivision(rng):
+    workload = address_fields(rng, with_subdivision=True)
+    return (
+        lambda: [Address(strict=False, **fields) for fields in workload],
+        len(workload))
+
+
+def bench_normalize(rng, with_subdivision):
+    workload = addresses(rng, with_subdivision)
+
+    def run():
+        for address in workload:
+            # Force a full normalization.
+            reset(address, '_changes')
+            address.normalize(strict=False)
+    return run, len(workload)
+
+
+@benchmark('Address.normalize() with country')
+def bench_normalize_country(rng):
+    return bench_normalize(rng, with_subdivision=False)
+
+
+@benchmark('Address.normalize() with subdivision')
+def bench_normalize_subdivision(rng):
+    return bench_normalize(rng, with_subdivision=True)
+
+
+@benchmark('Address.normalize() after line2 change')
+def bench_renormalize(rng):
+    workload = addresses(rng, with_subdivision=True)
+
+    def run():
+        for address in workload:
+            address.line2 = 'Building A' if address.line2 else 'Building B'
+            address.normalize()
+    return run, len(workload)
+
+
+@benchmark('Address.validate()')
+def bench_validate(rng):
+    workload = addresses(rng, with_subdivision=True)
+
+    def run():
+        for address in workload:
+            # Drop cached checks, so each call runs a full validation.
+            reset(address, '_derived')
+            try:
+                address.validate()
+            except InvalidAddress:
+                pass
+    return run, len(workload)
+
+
+@benchmark('Address.render()')
+def bench_render(rng):
+    workload = addresses(rng, with_subdivision=True)
+
+    def run():
+        for address in workload:
+            reset(address, '_derived')
+            address.render()
+    return run, len(workload)
+
+
+@benchmark('normalize_territory_code()')
+def bench_normalize_territory_code(rng):
+    codes = sorted(supported_country_codes())
+    workload = sample(rng, codes + sorted(supported_subdivision_codes()) + [
+        code.lower() for code in codes])
+
+    def run():
+        for code in workload:
+            normalize_territory_code(code, resolve_top_country=True)
+    return run, len(workload)
+
+
+def bench_cold(function, workload):
+    """ Call a cached function on a workload, with caches cleared first. """
+    def run():
+        for args in workload:
+            function.cache_clear()
+            function(*args)
+    return run, len(workload)
+
+
+@benchmark('territory_children_codes() of countries [cold]')
+def bench_children_countries(rng):
+    return bench_cold(territory_children_codes, [
+        (code, ) for code in sample(rng, ['FR', 'GB', 'US', 'CN', 'IT'])])
+
+
+@benchmark('territory_children_codes() of subdivisions [cold]')
+def bench_children_subdivisions(rng):
+    return bench_cold(territory_children_codes, [
+        (code, ) for code in sample(
+            rng, ['GB-ENG', 'GB-SCT', 'FR-IDF', 'ES-AN', 'IT-25'])])
+
+
+@benchmark('territory_parents() [cold]')
+def bench_parents(rng):
+    return bench_cold(territory_parents, [
+        (code, ) for code in sample(rng, supported_subdivision_codes())])
+
+
+@benchmark('country_aliases() [cold]')
+def bench_country_aliases(rng):
+    return bench_cold(country_aliases, [
+        (code, ) for code in sample(rng, supported_country_codes())])
+
+
+@benchmark('random_address()')
+def bench_random_address(rng):
+    # Fill the pool of Faker instances.
+    fakes = [faker_instance(locale) for locale in faker_locales()]
+    seed = rng.getrandbits(32)
+
+    def run():
+        # Pooled Faker instances don't draw from the random module, seed them
+        # too so each run generates the same addresses.
+        random.seed(seed)
+        for fake in fakes:
+            fake.seed_instance(seed)
+        return [random_address() for _ in range(WORKLOAD_SIZE)]
+    return run, WORKLOAD_SIZE
+
+
+def run_benchmarks(names=None, repeat=5):
+    """ Run benchmarks and return their best time per operation, by name. """
+    results = OrderedDict()
+    for name, setup in BENCHMARKS.items():
+        if names and not any(pattern in name for pattern in names):
+            continue
+        function, operations = setup(random.Random(SEED))
+        timer = timeit.Timer(function)
+        # Warm up, and calibrate the number of calls per run.
+        number = 1
+        while timer.timeit(number) < MIN_RUN_TIME:
+            number *= 2
+        timings = timer.repeat(repeat=repeat, number=number)
+        results[name] = min(timings) / number / operations
+        print("{:<55} {:>10.2f} µs".format(name, results[name] * 1e6))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Compare results to a baseline.
+
+    :return: The list of names of benchmarks slower than their baseline by
+        more than ``threshold``, a ratio.
+    """
+    regressions = []
+    print()
+    print("{:<55} {:>10} {:>10} {:>8}".format(
+        "Benchmark", "Baseline", "Current", "Ratio"))
+    for name, timing in results.items():
+        if name not in baseline:
+            continue
+        ratio = timing / baseline[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print("{:<55} {:>10.2f} {:>10.2f} {:>8.2f}{}".format(
+            name, baseline[name] * 1e6, timing * 1e6, ratio, flag))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '-o', '--output', help="Save results to a JSON file.")
+    parser.add_argument(
+        '-c', '--compare', metavar='BASELINE',
+        help="Compare results to a JSON file produced by --output.")
+    parser.add_argument(
+        '-t', '--threshold', type=float, default=0.25,
+        help="Tolerated slowdown ratio over the baseline. Defaults to 0.25.")
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help="Number of runs of each benchmark. Defaults to 5.")
+    parser.add_argument(
+        'names', nargs='*',
+        help="Only run benchmarks whose name contains one of these strings.")
+    options = parser.parse_args(args)
+
+    results = run_benchmarks(options.names, options.repeat)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(OrderedDict([
+                ('version', __version__),
+                ('python', platform.python_version()),
+                ('implementation', platform.python_implementation()),
+                ('seed', SEED),
+                ('results', results)]), output, indent=2)
+
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, options.threshold)
+        if regressions:
+            print("\n{} benchmark(s) regressed by more than {:.0%}.".format(
+                len(regressions), options.threshold), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,23 +23,103 @@ from __future__ import (
 
 import random
 import re
+import threading
+from collections import OrderedDict, namedtuple
+from functools import wraps
 
-import faker
-from boltons.strutils import slugify
-from pycountry import countries, subdivisions
-
-from . import PY2, PY3
+from . import PY2, PY3, instrumentation, territory
+from .cache import cached_lookup
+from .snapshot import territory_snapshot
 from .territory import (
     country_from_subdivision,
     default_subdivision_code,
     normalize_territory_code,
+    supported_subdivision_codes,
     territory_children_codes,
-    territory_parents
+    territory_parent_index,
+    territory_parents_codes
 )
 
 if PY3:
     basestring = (str, bytes)
 
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+try:
+    from types import MappingProxyType
+except ImportError:
+    # Python 2 has no read-only dictionary proxy. Copies keep the order of
+    # subdivision records.
+    MappingProxyType = OrderedDict
+
+# Shared by all addresses without subdivision metadata.
+NO_METADATA = MappingProxyType({})
+
+# Key of pickled states listing metadata to restore from the subdivision
+# record.
+SUBDIVISION_METADATA = '_subdivision_metadata'
+
+# Shared by all addresses without field changes since their last
+# normalization.
+NO_CHANGES = frozenset()
+
+# Key of derived values holding the generation of alias mappings they were
+# computed from. Not a string, to never clash with method names.
+DERIVED_GENERATION = object()
+
+# Bytes to delete from ASCII-encoded postal codes: all but uppercase
+# alphanumerics, spaces and hyphens.
+POSTAL_CODE_DELETIONS = bytes(bytearray(
+    byte for byte in range(256)
+    if not re.match(r'[A-Z0-9 -]', chr(byte))))
+
+# Fallback for postal codes with non-ASCII characters.
+POSTAL_CODE_INVALID_CHARS = re.compile(r'[^A-Z0-9 -]')
+
+# Serializes the use of pooled seeded Faker instances, which are reseeded for
+# each chunk of random addresses.
+SEEDED_FAKER_LOCK = threading.Lock()
+
+
+def derived_value(copy=None):
+    """ Decorator caching the result of an ``Address`` method on the instance.
+
+    Cached values are dropped as soon as a field or the metadata of the
+    address change, or territory aliases are registered.
+
+    :param copy: Callable applied to results before returning them, to
+        protect cached mutable values from being altered by callers.
+    """
+    def decorator(method):
+        name = method.__name__
+
+        @wraps(method)
+        def wrapper(self):
+            derived = self._derived
+            generation = territory.ALIASES_GENERATION
+            if derived is None or derived[DERIVED_GENERATION] != generation:
+                derived = {DERIVED_GENERATION: generation}
+                object.__setattr__(self, '_derived', derived)
+            try:
+                value = derived[name]
+            except KeyError:
+                value = derived[name] = method(self)
+            if copy is not None:
+                return copy(value)
+            return value
+        return wrapper
+    return decorator
+
+
+def copy_statuses(statuses):
+    """ Copy a ``(required_fields, invalid_fields, inconsistent_fields)``
+    tuple. """
+    required_fields, invalid_fields, inconsistent_fields = statuses
+    return set(required_fields), dict(invalid_fields), set(inconsistent_fields)
+
 
 class InvalidAddress(ValueError):
     """ Custom exception providing details about address failing validation.
@@ -118,6 +198,25 @@ class Address(object):
         'line1', 'postal_code', 'city_name', 'country_code'])
     assert REQUIRED_FIELDS.issubset(BASE_FIELD_IDS)
 
+    # Fields on which territory normalization depends: codes themselves, and
+    # fields subdivisions are allowed to impose values on.
+    TERRITORY_DEPENDENCIES = frozenset([
+        'country_code', 'subdivision_code']).union(
+            SUBDIVISION_METADATA_WHITELIST)
+
+    # Base fields are stored in fixed slots, and subdivision-derived metadata
+    # are held by reference in a separate mapping, which is never updated
+    # in-place. Instances have no ``__dict__``, which keeps them compact.
+    # Values derived from fields, like validity, are cached in ``_derived``
+    # until the address is modified or territory aliases are registered.
+    # Fields modified since the last normalization are tracked in
+    # ``_changes``, which is ``None`` if the address needs a full
+    # normalization.
+    __slots__ = (
+        'line1', 'line2', 'postal_code', 'city_name', 'country_code',
+        'subdivision_code', '_metadata', '_derived', '_changes',
+        '__weakref__')
+
     def __init__(self, strict=True, **kwargs):
         """ Set address' individual fields and normalize them.
 
@@ -130,8 +229,12 @@ class Address(object):
                 "{!r} fields are not allowed to be set freely.".format(
                     unknown_fields))
 
-        # Normalized field's IDs and values of the address are stored here.
-        self._fields = dict.fromkeys(self.BASE_FIELD_IDS)
+        # Initialize all fields.
+        for field_id in self.BASE_FIELD_IDS:
+            object.__setattr__(self, field_id, None)
+        object.__setattr__(self, '_metadata', NO_METADATA)
+        object.__setattr__(self, '_derived', None)
+        object.__setattr__(self, '_changes', None)
 
         # Load provided fields.
         for field_id, field_value in kwargs.items():
@@ -169,10 +272,15 @@ class Address(object):
         return string
 
     def __getattr__(self, name):
-        """ Expose fields as attributes. """
-        if name in self._fields:
-            return self._fields[name]
-        raise AttributeError
+        """ Expose subdivision metadata as attributes.
+
+        Base fields are served directly by their slots.
+        """
+        # Internal attributes are never metadata. This also protects against
+        # infinite recursion on partially initialized instances.
+        if not name.startswith('_') and name in self._metadata:
+            return self._metadata[name]
+        raise AttributeError(name)
 
     def __setattr__(self, name, value):
         """ Allow update of address fields as attributes. """
@@ -181,18 +289,56 @@ class Address(object):
             return
         super(Address, self).__setattr__(name, value)
 
+    def __getstate__(self):
+        """ Export fields and metadata for pickling.
+
+        Metadata derived from the subdivision reference pycountry objects,
+        which cannot be pickled. Only their keys are exported, and values are
+        restored from the subdivision record on unpickling.
+        """
+        state = {
+            field_id: getattr(self, field_id)
+            for field_id in self.BASE_FIELD_IDS}
+        metadata = self._metadata
+        if metadata and \
+                self.subdivision_code in supported_subdivision_codes():
+            record_metadata = subdivision_record(
+                self.subdivision_code).metadata
+            if metadata is record_metadata or all(
+                    record_metadata.get(key) is value
+                    for key, value in metadata.items()):
+                state[SUBDIVISION_METADATA] = sorted(metadata)
+                return state
+        state.update(metadata)
+        return state
+
+    def __setstate__(self, state):
+        """ Restore fields and metadata from pickling. """
+        for field_id in self.BASE_FIELD_IDS:
+            object.__setattr__(self, field_id, state.pop(field_id, None))
+        metadata_keys = state.pop(SUBDIVISION_METADATA, None)
+        if metadata_keys is not None:
+            state = subdivision_record(self.subdivision_code).metadata
+            if len(metadata_keys) != len(state):
+                state = {key: state[key] for key in metadata_keys}
+        object.__setattr__(self, '_metadata', state)
+        object.__setattr__(self, '_derived', None)
+        object.__setattr__(self, '_changes', None)
+
     # Let an address be accessed like a dict of its fields IDs & values.
-    # This is a proxy to the internal _fields dict.
+    # This is a proxy to base field slots and subdivision metadata.
 
     def __len__(self):
         """ Return the number of fields. """
-        return len(self._fields)
+        return len(self.BASE_FIELD_IDS) + len(self._metadata)
 
     def __getitem__(self, key):
         """ Return the value of a field. """
         if not isinstance(key, basestring):
             raise TypeError
-        return self._fields[key]
+        if key in self.BASE_FIELD_IDS:
+            return object.__getattribute__(self, key)
+        return self._metadata[key]
 
     def __setitem__(self, key, value):
         """ Set a field's value.
@@ -205,31 +351,44 @@ class Address(object):
             raise TypeError
         if key not in self.BASE_FIELD_IDS:
             raise KeyError
-        self._fields[key] = value
+        if value != object.__getattribute__(self, key):
+            object.__setattr__(self, key, value)
+            object.__setattr__(self, '_derived', None)
+            changes = self._changes
+            if changes is not None:
+                object.__setattr__(self, '_changes', changes.union([key]))
 
     def __delitem__(self, key):
         """ Remove a field. """
         if key in self.BASE_FIELD_IDS:
-            self._fields[key] = None
+            self[key] = None
         else:
-            del self._fields[key]
+            # Metadata might be shared with other addresses: copy on write.
+            metadata = dict(self._metadata)
+            del metadata[key]
+            object.__setattr__(self, '_metadata', metadata)
+            object.__setattr__(self, '_derived', None)
+            # Renormalization restores metadata.
+            object.__setattr__(self, '_changes', None)
 
     def __iter__(self):
         """ Iterate over field IDs. """
-        for field_id in self._fields:
+        for field_id in self.BASE_FIELD_IDS:
+            yield field_id
+        for field_id in self._metadata:
             yield field_id
 
     def keys(self):
         """ Return a list of field IDs. """
-        return self._fields.keys()
+        return list(self)
 
     def values(self):
         """ Return a list of field values. """
-        return self._fields.values()
+        return [self[field_id] for field_id in self]
 
     def items(self):
         """ Return a list of field IDs & values. """
-        return self._fields.items()
+        return [(field_id, self[field_id]) for field_id in self]
 
     def render(self, separator='\n'):
         """ Render a human-friendly address block.
@@ -243,52 +402,15 @@ class Address(object):
           not overlap with the city, state or country name.
         * The last line feature country's common name.
         """
-        lines = []
-
-        if self.line1:
-            lines.append(self.line1)
-
-        if self.line2:
-            lines.append(self.line2)
-
-        # Build the third line.
-        line3_elements = []
-        if self.city_name:
-            line3_elements.append(self.city_name)
-        if hasattr(self, 'state_name'):
-            # XXX It might not be a good idea to deduplicate state and city.
-            # See: https://en.wikipedia.org/wiki
-            # /List_of_U.S._cities_named_after_their_state
-            line3_elements.append(self.state_name)
-        # Separate city and state by a comma.
-        line3_elements = [', '.join(line3_elements)]
-        if self.postal_code:
-            line3_elements.insert(0, self.postal_code)
-        # Separate the leading zip code and the rest by a dash.
-        line3 = ' - '.join(line3_elements)
-        if line3:
-            lines.append(line3)
-
-        # Compare the vanilla subdivision name to properties that are based on
-        # it and used in the current ``render()`` method to produce a printable
-        # address. If none overlap, then print an additional line with the
-        # subdivision name as-is to provide extra, non-redundant, territory
-        # precision.
-        subdiv_based_properties = [
-            'city_name', 'state_name', 'country_name']
-        subdiv_based_values = [
-            getattr(self, prop_id) for prop_id in subdiv_based_properties
-            if hasattr(self, prop_id)]
-        if self.subdivision_name and \
-                self.subdivision_name not in subdiv_based_values:
-            lines.append(self.subdivision_name)
-
-        # Place the country line at the end.
-        if self.country_name:
-            lines.append(self.country_name)
-
-        # Render the address block with the provided separator.
-        return separator.join(lines)
+        return render_block(
+            line1=self.line1,
+            line2=self.line2,
+            postal_code=self.postal_code,
+            city_name=self.city_name,
+            state_name=self._metadata.get('state_name'),
+            subdivision_name=self.subdivision_name,
+            country_name=self.country_name,
+            separator=separator)
 
     def normalize(self, strict=True):
         """ Normalize address fields.
@@ -302,49 +424,69 @@ class Address(object):
 
         You need to call back the ``validate()`` method afterwards to properly
         check that the fully-qualified address is ready for consumption.
+
+        Normalization is incremental: only the steps depending on fields
+        changed since the last successful normalization are performed. Others
+        would leave the address untouched anyway.
         """
+        watch = instrumentation.RECORDER
+        if watch is not None:
+            watch = watch.stopwatch()
+
+        changes = self._changes
+        if changes is None:
+            changes = self.BASE_FIELD_IDS
+        elif not changes:
+            if watch:
+                watch.finish('normalize')
+            return
+
         # Strip postal codes of any characters but alphanumerics, spaces and
         # hyphens.
-        if self.postal_code:
-            self.postal_code = self.postal_code.upper()
-            # Remove unrecognized characters.
-            self.postal_code = re.compile(
-                r'[^A-Z0-9 -]').sub('', self.postal_code)
-            # Reduce sequences of mixed hyphens and spaces to single hyphen.
-            self.postal_code = re.compile(
-                r'[^A-Z0-9]*-+[^A-Z0-9]*').sub('-', self.postal_code)
-            # Edge case: remove leading and trailing hyphens and spaces.
-            self.postal_code = self.postal_code.strip('-')
-
-        # Normalize spaces.
-        for field_id, field_value in self.items():
+        if 'postal_code' in changes and self.postal_code:
+            self.postal_code = normalize_postal_code(self.postal_code)
+        if watch:
+            watch.lap('normalize.postal_code')
+
+        # Normalize spaces of base fields. Subdivision metadata are left
+        # untouched.
+        for field_id in changes:
+            field_value = self[field_id]
             if isinstance(field_value, basestring):
-                try:
-                    self[field_id] = ' '.join(field_value.split())
-                except KeyError:
-                    # Invalid field_id, usually all the 'subdivision_metadata'
-                    pass
+                self[field_id] = ' '.join(field_value.split())
 
         # Reset empty and blank strings.
-        empty_fields = [f_id for f_id, f_value in self.items() if not f_value]
-        for field_id in empty_fields:
-            del self[field_id]
+        for field_id in changes:
+            if not self[field_id]:
+                del self[field_id]
+        if watch:
+            watch.lap('normalize.whitespace')
 
         # Swap lines if the first is empty.
         if self.line2 and not self.line1:
             self.line1, self.line2 = self.line2, self.line1
+        if watch:
+            watch.lap('normalize.lines')
+
+        if not self.TERRITORY_DEPENDENCIES.intersection(changes):
+            object.__setattr__(self, '_changes', NO_CHANGES)
+            if watch:
+                watch.finish('normalize')
+            return
 
         # Normalize territory codes. Unrecognized territory codes are reset
         # to None.
         for territory_id in ['country_code', 'subdivision_code']:
             territory_code = getattr(self, territory_id)
-            if territory_code:
+            if territory_code and territory_id in changes:
                 try:
                     code = normalize_territory_code(
                         territory_code, resolve_aliases=False)
                 except ValueError:
                     code = None
                 setattr(self, territory_id, code)
+        if watch:
+            watch.lap('normalize.territory_codes')
 
         # Try to set default subdivision from country if not set.
         if self.country_code and not self.subdivision_code:
@@ -353,52 +495,50 @@ class Address(object):
             # properly re-guessed below.
             if self.subdivision_code:
                 self.country_code = None
+        if watch:
+            watch.lap('normalize.default_subdivision')
 
         # Automatically populate address fields with metadata extracted from
-        # all subdivision parents.
+        # all subdivision parents. Metadata of any previous subdivision are
+        # discarded.
+        metadata = NO_METADATA
         if self.subdivision_code:
-            parent_metadata = {
-                # All subdivisions have a parent country.
-                'country_code': country_from_subdivision(
-                    self.subdivision_code)}
-
-            # Add metadata of each subdivision parent.
-            for parent_subdiv in territory_parents(
-                    self.subdivision_code, include_country=False):
-                parent_metadata.update(subdivision_metadata(parent_subdiv))
+            record = subdivision_record(self.subdivision_code)
+            if watch:
+                watch.lap('normalize.subdivision_record')
 
             # Parent metadata are not allowed to overwrite address fields
             # if not blank, unless strict mode is de-activated.
             if strict:
-                for field_id, new_value in parent_metadata.items():
-                    # New metadata are not allowed to be blank.
-                    assert new_value
-                    current_value = self._fields.get(field_id)
-                    if current_value and field_id in self.BASE_FIELD_IDS:
-
-                        # Build the list of substitute values that are
-                        # equivalent to our new normalized target.
-                        alias_values = {new_value}
-                        if field_id == 'country_code':
-                            # Allow normalization if the current country code
-                            # is the direct parent of a subdivision which also
-                            # have its own country code.
-                            alias_values.add(subdivisions.get(
-                                code=self.subdivision_code).country_code)
-
-                        # Change of current value is allowed if it is a direct
-                        # substitute to our new normalized value.
-                        if current_value not in alias_values:
-                            raise InvalidAddress(
-                                inconsistent_fields={tuple(sorted((
-                                    field_id, 'subdivision_code')))},
-                                extra_msg="{} subdivision is trying to replace"
-                                " {}={!r} field by {}={!r}".format(
-                                    self.subdivision_code,
-                                    field_id, current_value,
-                                    field_id, new_value))
-
-            self._fields.update(parent_metadata)
+                conflict = subdivision_conflict(record, self)
+                if conflict:
+                    error = InvalidAddress(
+                        inconsistent_fields={tuple(sorted((
+                            conflict[0], 'subdivision_code')))},
+                        extra_msg="{} subdivision is trying to replace "
+                        "{}={!r} field by {}={!r}".format(
+                            self.subdivision_code,
+                            conflict[0], conflict[1],
+                            conflict[0], conflict[2]))
+                    if watch:
+                        watch.finish('normalize', error)
+                    raise error
+
+            # Base fields go to their slots, while other metadata are shared
+            # by reference.
+            for field_id, new_value in record.fields.items():
+                self[field_id] = new_value
+            metadata = record.metadata
+
+        if metadata is not self._metadata:
+            object.__setattr__(self, '_metadata', metadata)
+            object.__setattr__(self, '_derived', None)
+        if watch:
+            watch.lap('normalize.metadata')
+
+        object.__setattr__(self, '_changes', NO_CHANGES)
+        if watch:
+            watch.finish('normalize')
 
     def validate(self):
         """ Check fields consistency and requirements in one go.
@@ -407,27 +547,63 @@ class Address(object):
         raise an exception at the end, for the whole address object. Our custom
         exception will provide a detailed status of bad fields.
         """
-
-        required_fields = self.check_required_fields()
-        invalid_fields = self.check_invalid_fields(required_fields)
-        inconsistent_fields = self.check_inconsistent_fields(required_fields,
-                                                             invalid_fields)
+        required_fields, invalid_fields, inconsistent_fields = \
+            self.check_fields()
 
         # Raise our custom exception if any value is wrong.
         if required_fields or invalid_fields or inconsistent_fields:
             raise InvalidAddress(
                 required_fields, invalid_fields, inconsistent_fields)
 
+    def check_fields(self):
+        """ Same checks as ``validate()``, without raising any exception.
+
+        Checks are only run again once the address is modified. Each call
+        still counts as a validation for instrumentation, cached or not.
+
+        :return: A ``(required_fields, invalid_fields, inconsistent_fields)``
+            tuple, all empty if the address is valid.
+        """
+        watch = instrumentation.RECORDER
+        if watch is None:
+            return self.field_statuses()
+
+        watch = watch.stopwatch()
+        required_fields, invalid_fields, inconsistent_fields = statuses = \
+            self.field_statuses()
+        error = None
+        if required_fields or invalid_fields or inconsistent_fields:
+            error = InvalidAddress(
+                required_fields, invalid_fields, inconsistent_fields)
+        watch.finish('validate', error)
+        return statuses
+
+    @derived_value(copy=copy_statuses)
+    def field_statuses(self):
+        """ Run all checks of ``check_fields()``, and cache their results
+        until the address is modified. """
+        watch = instrumentation.RECORDER
+        if watch is not None:
+            watch = watch.stopwatch()
+
+        required_fields = self.check_required_fields()
+        if watch:
+            watch.lap('validate.check_required_fields')
+        invalid_fields = self.check_invalid_fields(required_fields)
+        if watch:
+            watch.lap('validate.check_invalid_fields')
+        inconsistent_fields = self.check_inconsistent_fields(required_fields,
+                                                             invalid_fields)
+        if watch:
+            watch.lap('validate.check_inconsistent_fields')
+        return required_fields, invalid_fields, inconsistent_fields
+
     def check_required_fields(self):
         """Check that all required fields are set.
 
         :return: The set of unset thus required fields.
         """
-        required_fields = set()
-        for field_id in self.REQUIRED_FIELDS:
-            if not getattr(self, field_id):
-                required_fields.add(field_id)
-        return required_fields
+        return check_required_fields(self)
 
     def check_invalid_fields(self, required_fields):
         """Check all fields for invalidity, only if not previously flagged as
@@ -436,21 +612,7 @@ class Address(object):
         :param required_fields:
         :return:
         """
-        invalid_fields = dict()
-        if 'country_code' not in required_fields:
-            # Check that the country code exists.
-            try:
-                countries.get(alpha_2=self.country_code)
-            except KeyError:
-                invalid_fields['country_code'] = self.country_code
-
-        if self.subdivision_code and 'subdivision_code' not in required_fields:
-            # Check that the country code exists.
-            try:
-                subdivisions.get(code=self.subdivision_code)
-            except KeyError:
-                invalid_fields['subdivision_code'] = self.subdivision_code
-        return invalid_fields
+        return check_invalid_fields(self, required_fields)
 
     def check_inconsistent_fields(self, required_fields, invalid_fields):
         """Check country consistency against subdivision, only if none of the
@@ -460,13 +622,8 @@ class Address(object):
         :param invalid_fields: The set of invalid fields.
         :return:
         """
-        inconsistent_fields = set()
-        any_wrong_field = required_fields.union(invalid_fields)
-        consistency_fields = {'country_code', 'subdivision_code'}
-        inconsistency = consistency_fields.intersection(any_wrong_field)
-        if not inconsistency and not self.valid_subdivision_country():
-            inconsistent_fields.add(tuple(sorted(consistency_fields)))
-        return inconsistent_fields
+        return check_inconsistent_fields(
+            self, required_fields, invalid_fields)
 
     def valid_subdivision_country(self):
         """Validates that the country attached to the subdivision is
@@ -475,19 +632,23 @@ class Address(object):
         :return: True if the subdivision country is the same as the country,
         False otherwise.
         """
-        if not self.subdivision_code:
-            return True
-        inferred_country = country_from_subdivision(self.subdivision_code)
-        return inferred_country == self.country_code
+        return valid_subdivision_country(self)
 
     @property
     def valid(self):
-        """ Return a boolean indicating if the address is valid. """
-        try:
-            self.validate()
-        except InvalidAddress:
-            return False
-        return True
+        """ Return a boolean indicating if the address is valid.
+
+        Each read counts as a validation for instrumentation, cached or not.
+        """
+        if instrumentation.RECORDER is not None:
+            return not any(self.check_fields())
+        return self.validity()
+
+    @derived_value()
+    def validity(self):
+        """ Return the cached validity of the address, without
+        instrumentation. """
+        return not any(self.field_statuses())
 
     @property
     def empty(self):
@@ -506,13 +667,16 @@ class Address(object):
         return self.__bool__()
 
     @property
+    @derived_value()
     def country(self):
         """ Return country object. """
         if self.country_code:
+            from pycountry import countries
             return countries.get(alpha_2=self.country_code)
         return None
 
     @property
+    @derived_value()
     def country_name(self):
         """ Return country's name.
 
@@ -520,56 +684,114 @@ class Address(object):
         latter isoften pompous, and sometimes false (i.e. not in sync with
         current political situation).
         """
-        if self.country:
-            if hasattr(self.country, 'common_name'):
-                return self.country.common_name
-            return self.country.name
-        return None
+        names = country_names().get(self.country_code)
+        return names.display_name if names else None
 
     @property
+    @derived_value()
     def subdivision(self):
         """ Return subdivision object. """
         if self.subdivision_code:
+            from pycountry import subdivisions
             return subdivisions.get(code=self.subdivision_code)
         return None
 
     @property
+    @derived_value()
     def subdivision_name(self):
         """ Return subdivision's name. """
-        if self.subdivision:
-            return self.subdivision.name
-        return None
+        names = subdivision_names().get(self.subdivision_code)
+        return names.name if names else None
 
     @property
+    @derived_value()
     def subdivision_type_name(self):
         """ Return subdivision's type human-readable name. """
-        if self.subdivision:
-            return self.subdivision.type
-        return None
+        names = subdivision_names().get(self.subdivision_code)
+        return names.type_name if names else None
 
     @property
+    @derived_value()
     def subdivision_type_id(self):
         """ Return subdivision's type as a Python-friendly ID string. """
-        if self.subdivision:
-            return subdivision_type_id(self.subdivision)
-        return None
+        names = subdivision_names().get(self.subdivision_code)
+        return names.type_id if names else None
 
 
 # Address utils.
 
-def random_address(locale=None):
-    """ Return a random, valid address.
-
-    A ``locale`` parameter try to produce a localized-consistent address. Else
-    a random locale is picked-up.
-    """
+def import_faker():
+    """ Import the optional ``Faker`` dependency. """
+    try:
+        import faker
+    except ImportError:
+        raise ImportError(
+            "Generation of random addresses requires Faker. Install it with "
+            "the faker extra: pip install postal-address[faker]")
+    return faker
+
+
+@cached_lookup()
+def faker_locales():
+    """ Return the sorted tuple of Faker locales addresses can be made of. """
+    faker = import_faker()
     # XXX Exclude 'ar_PS' that doesn't work currently (it's defined in Faker
     # but not in pycountry).
     # See: https://github.com/scaleway/postal-address/issues/20
-    while locale in [None, 'ar_PS']:
-        locale = random.choice(list(faker.config.AVAILABLE_LOCALES))
-    fake = faker.Faker(locale=locale)
+    return tuple(sorted(
+        set(faker.config.AVAILABLE_LOCALES).difference(['ar_PS'])))
+
+
+@cached_lookup()
+def faker_instance(locale):
+    """ Return a pooled Faker instance for a locale.
+
+    Faker instances are costly to build, so they are built once per locale and
+    process. They share Faker's global random generator.
+    """
+    return import_faker().Faker(locale=locale)
+
+
+@cached_lookup()
+def seeded_faker_instance(locale):
+    """ Return a pooled Faker instance for a locale, with its own random
+    generator.
+
+    Built once per locale and process, like ``faker_instance()``, but never
+    draws from Faker's global random generator. Reseed it with
+    ``seed_instance()`` before use, while holding ``SEEDED_FAKER_LOCK``.
+    """
+    fake = import_faker().Faker(locale=locale)
+    # Some providers hold their data in sets, of which the iteration order
+    # changes from one process to another. Sort them to produce reproducible
+    # addresses.
+    for provider in fake.providers:
+        for name in dir(provider):
+            value = getattr(provider, name, None)
+            if isinstance(value, (set, frozenset)):
+                setattr(provider, name, tuple(sorted(value)))
+    # Detach the instance from the global random generator.
+    fake.seed_instance(0)
+    return fake
+
+
+@cached_lookup(alias_dependent=True)
+def random_subdivision_codes(country_code):
+    """ Return the sorted tuple of subdivision codes of a country.
+
+    Sorted to not depend on the iteration order of sets, which changes from
+    one process to another.
+    """
+    return tuple(sorted(territory_children_codes(country_code)))
+
+
+def random_components(fake, rng):
+    """ Generate random address fields.
 
+    :param fake: A Faker instance.
+    :param rng: A ``random.Random`` instance, or the ``random`` module, used
+        to pick a subdivision.
+    """
     components = {
         'line1': fake.street_address(),
         'line2': fake.sentence(),
@@ -577,15 +799,330 @@ def random_address(locale=None):
         'city_name': fake.city(),
         'country_code': fake.country_code()}
 
-    subdiv_codes = list(territory_children_codes(components['country_code']))
+    subdiv_codes = random_subdivision_codes(components['country_code'])
     if subdiv_codes:
-        components['subdivision_code'] = random.choice(subdiv_codes)
+        components['subdivision_code'] = rng.choice(subdiv_codes)
+
+    return components
+
+
+def random_address(locale=None):
+    """ Return a random, valid address.
+
+    A ``locale`` parameter try to produce a localized-consistent address. Else
+    a random locale is picked-up.
+
+    Requires the optional ``Faker`` dependency, available with the ``faker``
+    extra: ``pip install postal-address[faker]``.
+    """
+    while locale in [None, 'ar_PS']:
+        locale = random.choice(faker_locales())
+    return Address(
+        strict=False, **random_components(faker_instance(locale), random))
+
+
+def random_components_chunk(task):
+    """ Generate a chunk of random address fields.
+
+    Runs in worker processes of ``random_addresses()``. The chunk only depends
+    on its seed, index, size and locales.
+
+    :param task: A ``(seed, index, size, locales)`` tuple.
+    :return: A list of dictionaries of address fields.
+    """
+    seed, index, size, locales = task
+    rng = random.Random(seed * 2 ** 32 + index)
+    locales = locales or faker_locales()
+    # Pooled Faker instances are reseeded on their first use in the chunk.
+    seeded_locales = set()
+    chunk = []
+    # Keep other threads from reseeding the pooled instances mid-chunk.
+    with SEEDED_FAKER_LOCK:
+        for _ in range(size):
+            locale = rng.choice(locales)
+            fake = seeded_faker_instance(locale)
+            if locale not in seeded_locales:
+                fake.seed_instance(rng.getrandbits(32))
+                seeded_locales.add(locale)
+            chunk.append(random_components(fake, rng))
+    return chunk
+
+
+def random_addresses(
+        count, locales=None, seed=None, processes=1, chunk_size=1000):
+    """ Generate a stream of random, valid addresses.
+
+    Addresses are generated by chunks, each reseeding the pooled Faker
+    instances it uses. Given the same ``seed``, ``locales`` and
+    ``chunk_size``, the same addresses are produced in the same order,
+    whatever the number of processes, and even if other generators run at the
+    same time.
+
+    Requires the optional ``Faker`` dependency, available with the ``faker``
+    extra: ``pip install postal-address[faker]``.
+
+    :param count: Number of addresses to generate.
+    :param locales: Faker locales to pick from. Defaults to all of them.
+    :param seed: Integer seed. Random if not set.
+    :param processes: Number of worker processes generating chunks.
+    :param chunk_size: Number of addresses per chunk.
+    :return: A generator of ``Address`` instances.
+    """
+    from .parallel import map_chunks
+
+    if seed is None:
+        seed = random.getrandbits(32)
+    locales = tuple(sorted(locales)) if locales else None
+    tasks = (
+        (seed, index, min(chunk_size, count - start), locales)
+        for index, start in enumerate(range(0, count, chunk_size)))
+    for chunk in map_chunks(
+            random_components_chunk, tasks, workers=processes):
+        for components in chunk:
+            yield Address(strict=False, **components)
+
+
+def render_block(line1, line2, postal_code, city_name, state_name,
+                 subdivision_name, country_name, separator='\n'):
+    """ Render a human-friendly address block from its components.
+
+    Shared by ``Address.render()`` and columnar rendering of
+    ``AddressFrame``. See ``Address.render()`` for the layout of the block.
+    """
+    lines = []
+
+    if line1:
+        lines.append(line1)
+
+    if line2:
+        lines.append(line2)
+
+    # Build the third line.
+    line3_elements = []
+    if city_name:
+        line3_elements.append(city_name)
+    if state_name:
+        # XXX It might not be a good idea to deduplicate state and city.
+        # See: https://en.wikipedia.org/wiki
+        # /List_of_U.S._cities_named_after_their_state
+        line3_elements.append(state_name)
+    # Separate city and state by a comma.
+    line3_elements = [', '.join(line3_elements)]
+    if postal_code:
+        line3_elements.insert(0, postal_code)
+    # Separate the leading zip code and the rest by a dash.
+    line3 = ' - '.join(line3_elements)
+    if line3:
+        lines.append(line3)
+
+    # Compare the vanilla subdivision name to properties that are based on it
+    # and used to produce a printable address. If none overlap, then print an
+    # additional line with the subdivision name as-is to provide extra,
+    # non-redundant, territory precision.
+    if subdivision_name and subdivision_name not in (
+            city_name, state_name, country_name):
+        lines.append(subdivision_name)
+
+    # Place the country line at the end.
+    if country_name:
+        lines.append(country_name)
+
+    # Render the address block with the provided separator.
+    return separator.join(lines)
+
+
+BatchResult = namedtuple('BatchResult', [
+    'status', 'fields', 'required_fields', 'invalid_fields',
+    'inconsistent_fields', 'extra_msg', 'address'])
+
+
+def process_record(record, strict=True, validate=True):
+    """ Normalize and optionally validate a record without raising exceptions.
+
+    :param record: A dictionary of address fields.
+    :param strict: Strictness of normalization.
+    :param validate: Trigger validation of the normalized address.
+    :return: A ``BatchResult`` named tuple, of which ``status`` is either
+        ``'valid'``, ``'invalid'`` or, if validation is skipped,
+        ``'normalized'``. Bad fields are classified in the same
+        ``required_fields``, ``invalid_fields`` and ``inconsistent_fields``
+        sets as in ``InvalidAddress`` exceptions. The normalized ``address``
+        object and its base ``fields`` are ``None`` for records failing
+        normalization.
+    """
+    # Reject unrecognized fields and non-string values upfront, instead of
+    # letting the constructor raise.
+    invalid_fields = {
+        field_id: value for field_id, value in record.items()
+        if field_id not in Address.BASE_FIELD_IDS or not (
+            value is None or isinstance(value, basestring))}
+    if invalid_fields:
+        return BatchResult(
+            'invalid', None, set(), invalid_fields, set(),
+            'unrecognized fields or non-string values', None)
+
+    try:
+        address = Address(strict=strict, **record)
+    except InvalidAddress as expt:
+        return BatchResult(
+            'invalid', None, expt.required_fields, expt.invalid_fields,
+            expt.inconsistent_fields, expt.extra_msg, None)
+
+    fields = {
+        field_id: address[field_id] for field_id in Address.BASE_FIELD_IDS}
+    if not validate:
+        return BatchResult(
+            'normalized', fields, set(), dict(), set(), None, address)
+
+    required_fields, invalid_fields, inconsistent_fields = \
+        address.check_fields()
+    status = 'invalid' if (
+        required_fields or invalid_fields or inconsistent_fields) else 'valid'
+    return BatchResult(
+        status, fields, required_fields, invalid_fields, inconsistent_fields,
+        None, address)
+
+
+def normalize_many(records, strict=True):
+    """ Normalize a stream of records, without raising exceptions.
+
+    Territory lookups are shared by all records through the caches of the
+    ``territory`` module.
+
+    :param records: An iterable of dictionaries of address fields.
+    :return: A generator of ``BatchResult``, one per record, in order.
+    """
+    for record in records:
+        yield process_record(record, strict=strict, validate=False)
+
+
+def validate_many(records, strict=True):
+    """ Normalize and validate a stream of records, without raising exceptions.
+
+    :param records: An iterable of dictionaries of address fields.
+    :return: A generator of ``BatchResult``, one per record, in order.
+    """
+    for record in records:
+        yield process_record(record, strict=strict, validate=True)
+
+
+def normalize_postal_code(postal_code):
+    """ Normalize a postal code, or a batch of them.
 
-    return Address(strict=False, **components)
+    Postal codes are upper-cased, stripped of any characters but
+    alphanumerics, spaces and hyphens, and sequences of mixed hyphens and
+    spaces are reduced to a single hyphen. Blank results are normalized to
+    ``None``.
+
+    :param postal_code: A string, or any iterable of strings.
+    :return: The normalized postal code, or a list of them.
+    """
+    if postal_code is not None and not isinstance(postal_code, basestring):
+        return [normalize_postal_code(value) for value in postal_code]
+    if not postal_code:
+        return None
+
+    code = postal_code.upper()
+    try:
+        code = code.encode('ascii').translate(
+            None, POSTAL_CODE_DELETIONS).decode('ascii')
+    except UnicodeEncodeError:
+        code = POSTAL_CODE_INVALID_CHARS.sub('', code)
+
+    # Reduce sequences of mixed hyphens and spaces to single hyphen, and
+    # remove leading and trailing ones.
+    if '-' in code:
+        code = '-'.join(filter(None, (
+            chunk.strip(' ') for chunk in code.split('-'))))
+
+    return ' '.join(code.split()) or None
+
+
+# Fields checks utils, shared by ``Address`` and ``AddressFrame``. They take
+# any mapping of base fields.
+
+def check_required_fields(fields):
+    """ Return the set of required fields left unset. """
+    required_fields = set()
+    for field_id in Address.REQUIRED_FIELDS:
+        if not fields[field_id]:
+            required_fields.add(field_id)
+    return required_fields
+
+
+def check_invalid_fields(fields, required_fields):
+    """ Return the mapping of invalid fields to their values, only for fields
+    not already flagged as required. """
+    invalid_fields = dict()
+    country_code = fields['country_code']
+    if 'country_code' not in required_fields:
+        # Check that the country code exists. Name tables are built from
+        # the territory snapshot, and hold the same codes as pycountry.
+        if country_code not in country_names():
+            invalid_fields['country_code'] = country_code
+
+    subdivision_code = fields['subdivision_code']
+    if subdivision_code and 'subdivision_code' not in required_fields:
+        # Check that the subdivision code exists.
+        if subdivision_code not in subdivision_names():
+            invalid_fields['subdivision_code'] = subdivision_code
+    return invalid_fields
+
+
+def check_inconsistent_fields(fields, required_fields, invalid_fields):
+    """ Return the set of inconsistent pairs of fields, only if none of the
+    country and subdivision fields were already flagged as required or
+    invalid. """
+    inconsistent_fields = set()
+    any_wrong_field = required_fields.union(invalid_fields)
+    consistency_fields = {'country_code', 'subdivision_code'}
+    inconsistency = consistency_fields.intersection(any_wrong_field)
+    if not inconsistency and not valid_subdivision_country(fields):
+        inconsistent_fields.add(tuple(sorted(consistency_fields)))
+    return inconsistent_fields
+
+
+def valid_subdivision_country(fields):
+    """ Check that the country of the subdivision is the country of the
+    fields. """
+    subdivision_code = fields['subdivision_code']
+    if not subdivision_code:
+        return True
+    inferred_country = country_from_subdivision(subdivision_code)
+    return inferred_country == fields['country_code']
 
 
 # Subdivisions utils.
 
+def subdivision_conflict(record, fields):
+    """ Check if a subdivision record can be applied in strict mode.
+
+    Subdivision-derived values are not allowed to overwrite non-blank address
+    fields, unless they are direct substitutes of each other.
+
+    :param record: A ``SubdivisionRecord``.
+    :param fields: A mapping of current address fields.
+    :return: A ``(field_id, current_value, new_value)`` tuple describing the
+        first conflicting field, or ``None``.
+    """
+    for field_id, new_value in record.fields.items():
+        current_value = fields[field_id]
+        if not current_value:
+            continue
+
+        # Build the list of substitute values that are equivalent to our new
+        # normalized target.
+        alias_values = {new_value}
+        if field_id == 'country_code':
+            alias_values = record.country_codes
+
+        # Change of current value is allowed if it is a direct substitute to
+        # our new normalized value.
+        if current_value not in alias_values:
+            return field_id, current_value, new_value
+    return None
+
+
 def subdivision_type_id(subdivision):
     """ Normalize subdivision type name into a Python-friendly ID.
 
@@ -697,7 +1234,18 @@ def subdivision_type_id(subdivision):
 
     This method transform and normalize any of these into Python-friendly IDs.
     """
-    type_id = slugify(subdivision.type)
+    return type_name_to_id(subdivision.type)
+
+
+@cached_lookup()
+def type_name_to_id(type_name):
+    """ Normalize a subdivision type name into a Python-friendly ID.
+
+    See ``subdivision_type_id()``.
+    """
+    from boltons.strutils import slugify
+
+    type_id = slugify(type_name)
 
     # Any occurence of the 'city' or 'municipality' string in the type
     # overrides its classification to a city.
@@ -728,3 +1276,126 @@ def subdivision_metadata(subdivision):
             Address.BASE_FIELD_IDS)
 
     return metadata
+
+
+TerritoryNames = namedtuple(
+    'TerritoryNames',
+    ['name', 'common_name', 'display_name', 'type_name', 'type_id'])
+
+
+@cached_lookup()
+def country_names():
+    """ Return the table of names of all countries, indexed by code.
+
+    Names are ``TerritoryNames`` records, of which ``display_name`` is the
+    common name of the country if any, else its official name. Countries have
+    no type.
+    """
+    return {
+        code: TerritoryNames(name, common_name, common_name or name, None,
+                             None)
+        for code, name, common_name in territory_snapshot()['countries']}
+
+
+@cached_lookup()
+def subdivision_names():
+    """ Return the table of names of all subdivisions, indexed by code.
+
+    Names are ``TerritoryNames`` records, of which ``display_name`` is the
+    subdivision name, as subdivisions have no common name.
+    """
+    return {
+        record[0]: TerritoryNames(
+            record[1], None, record[1], record[2], type_name_to_id(record[2]))
+        for record in territory_snapshot()['subdivisions']}
+
+
+SubdivisionRecord = namedtuple(
+    'SubdivisionRecord', ['fields', 'country_codes', 'metadata'])
+
+# Stand-in for a pycountry subdivision object, built from the territory
+# snapshot.
+SubdivisionReference = namedtuple(
+    'SubdivisionReference', ['code', 'name', 'type'])
+
+
+class SubdivisionMetadata(Mapping):
+    """ Read-only mapping of the metadata of a subdivision record.
+
+    Subdivision objects are held as ``SubdivisionReference`` until first
+    accessed, so records are built without loading pycountry's database.
+    """
+
+    __slots__ = ('data', )
+
+    def __init__(self, data):
+        self.data = dict(data)
+
+    def __getitem__(self, key):
+        value = self.data[key]
+        if isinstance(value, SubdivisionReference):
+            from pycountry import subdivisions
+            value = self.data[key] = subdivisions.get(code=value.code)
+        return value
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.data)
+
+
+@cached_lookup(alias_dependent=True)
+def subdivision_record(subdivision_code):
+    """ Return all metadata derived from a subdivision and its parents.
+
+    Records are immutable, built once per subdivision code and shared by all
+    addresses located in that subdivision. They are made of:
+
+    * ``fields``: a read-only mapping of base address fields, like
+      ``country_code`` or ``city_name``, to the values the subdivision
+      imposes on them.
+    * ``country_codes``: the frozenset of country codes allowed to be
+      replaced by the ``country_code`` above in strict normalization.
+    * ``metadata``: a read-only mapping of all other metadata.
+    """
+    # Keep track of insertion order, so conflicts in strict normalization
+    # are always reported on the same field.
+    parent_metadata = OrderedDict([
+        # All subdivisions have a parent country.
+        ('country_code', country_from_subdivision(subdivision_code))])
+
+    # Add metadata of each subdivision parent, from the territory snapshot.
+    names = subdivision_names()
+    for parent_code in territory_parents_codes(
+            subdivision_code, include_country=False):
+        parent_names = names[parent_code]
+        parent_metadata.update(subdivision_metadata(SubdivisionReference(
+            parent_code, parent_names.name, parent_names.type_name)))
+
+    # New metadata are not allowed to be blank.
+    assert all(parent_metadata.values())
+
+    fields = OrderedDict(
+        (field_id, value) for field_id, value in parent_metadata.items()
+        if field_id in Address.BASE_FIELD_IDS)
+    for field_id in fields:
+        del parent_metadata[field_id]
+
+    # Allow normalization if the current country code is the direct parent of
+    # a subdivision which also have its own country code.
+    parent_index = territory_parent_index()
+    country_code = subdivision_code
+    while country_code in parent_index:
+        country_code = parent_index[country_code]
+    country_codes = frozenset([fields['country_code'], country_code])
+
+    return SubdivisionRecord(
+        MappingProxyType(fields), country_codes,
+        SubdivisionMetadata(parent_metadata))
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+u""" Asynchronous normalization and validation of streams of records.
+
+Records are grouped into micro-batches, which are processed in an executor so
+the event loop is never blocked by address normalization::
+
+    >>> from postal_address.aio import validate_many_async
+    >>> async def clean(records):
+    ...     async with validate_many_async(records) as results:
+    ...         async for result in results:
+    ...             print(result.status)
+
+Results are the same ``BatchResult`` named tuples as produced by
+``validate_many()`` and ``normalize_many()``, yielded in input order.
+
+Records can come from a regular or an asynchronous iterable. The number of
+batches in flight is bounded: once the limit is reached, records are no longer
+pulled from the source until the consumer catches up.
+
+.. note:: This module requires Python 3.5 or newer.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import asyncio
+from collections import deque
+
+from .address import process_record
+
+# Marks the end of a stream in queues.
+END = object()
+
+
+def process_batch(task):
+    """ Normalize and optionally validate a batch of records.
+
+    Runs in executors, including process pools, so it is a module-level
+    function taking and returning picklable data.
+
+    :param task: A ``(records, strict, validate)`` tuple.
+    :return: A list of ``BatchResult``, one per record.
+    """
+    records, strict, validate = task
+    return [
+        process_record(record, strict=strict, validate=validate)
+        for record in records]
+
+
+class AsyncBatchIterator(object):
+    """ Asynchronous iterator of the results of a stream of records.
+
+    Processing starts on the first iteration. Use it as an asynchronous
+    context manager, or call ``aclose()``, to stop processing if the
+    iteration is interrupted.
+    """
+
+    def __init__(
+            self, records, strict=True, validate=True, batch_size=100,
+            max_in_flight=4, batch_delay=0, executor=None):
+        """ Set up the processing of a stream of records.
+
+        :param records: An iterable or asynchronous iterable of dictionaries
+            of address fields.
+        :param strict: Strictness of normalization.
+        :param validate: Trigger validation of normalized addresses.
+        :param batch_size: Maximum number of records per batch.
+        :param max_in_flight: Maximum number of batches submitted to the
+            executor but not consumed yet.
+        :param batch_delay: Time in seconds to wait for more records of a
+            slow source before submitting an incomplete batch. By default,
+            incomplete batches are submitted as soon as no record is
+            available.
+        :param executor: A ``concurrent.futures`` executor. Defaults to the
+            default executor of the event loop, a thread pool.
+            ``ProcessPoolExecutor`` instances are supported.
+        """
+        if batch_size < 1 or max_in_flight < 1:
+            raise ValueError(
+                "Batch size and maximum number of batches in flight must be "
+                "positive.")
+        self.records = records
+        self.strict = strict
+        self.validate = validate
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.batch_delay = batch_delay
+        self.executor = executor
+
+        self.tasks = None
+        self.ready = deque()
+        self.done = False
+
+    def start(self):
+        """ Start the tasks feeding and dispatching records.
+
+        Queues are bound to the running loop, hence created here rather than
+        at instanciation.
+        """
+        loop = asyncio.get_event_loop()
+        # Records read from the source, waiting to be batched.
+        self.pending_records = asyncio.Queue(self.batch_size)
+        # Futures of batch results, in submission order.
+        self.pending_batches = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        self.tasks = [
+            loop.create_task(self.feed()), loop.create_task(self.dispatch())]
+
+    async def feed(self):
+        """ Pull records from the source into the queue of records. """
+        try:
+            if hasattr(self.records, '__aiter__'):
+                async for record in self.records:
+                    await self.pending_records.put(record)
+            else:
+                for record in self.records:
+                    await self.pending_records.put(record)
+        except Exception as expt:
+            await self.pending_records.put(expt)
+        else:
+            await self.pending_records.put(END)
+
+    async def next_batch(self):
+        """ Collect the next batch of records.
+
+        :return: A ``(records, last_item)`` tuple, of which ``last_item`` is
+            either ``None``, ``END`` or the exception raised by the source.
+        """
+        loop = asyncio.get_event_loop()
+        item = await self.pending_records.get()
+        batch = []
+        deadline = loop.time() + self.batch_delay
+        while True:
+            if item is END or isinstance(item, Exception):
+                return batch, item
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, None
+            try:
+                item = self.pending_records.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    return batch, None
+                try:
+                    item = await asyncio.wait_for(
+                        self.pending_records.get(), timeout)
+                except asyncio.TimeoutError:
+                    return batch, None
+
+    async def dispatch(self):
+        """ Submit batches of records to the executor. """
+        loop = asyncio.get_event_loop()
+        last_item = None
+        while last_item is None:
+            batch, last_item = await self.next_batch()
+            if not batch:
+                continue
+            # Wait for the consumer to catch up.
+            await self.slots.acquire()
+            future = loop.run_in_executor(
+                self.executor, process_batch,
+                (batch, self.strict, self.validate))
+            await self.pending_batches.put(future)
+        await self.pending_batches.put(last_item)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.ready:
+            if self.done:
+                raise StopAsyncIteration
+            if self.tasks is None:
+                self.start()
+            future = await self.pending_batches.get()
+            if future is END or isinstance(future, Exception):
+                self.done = True
+                if future is not END:
+                    raise future
+                continue
+            try:
+                self.ready.extend(await future)
+            finally:
+                self.slots.release()
+        return self.ready.popleft()
+
+    async def aclose(self):
+        """ Stop processing, and cancel pending batches. """
+        self.done = True
+        self.ready.clear()
+        if self.tasks is None:
+            return
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        while not self.pending_batches.empty():
+            future = self.pending_batches.get_nowait()
+            if isinstance(future, asyncio.Future):
+                future.cancel()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+def normalize_many_async(records, strict=True, **kwargs):
+    """ Normalize a stream of records asynchronously, without raising
+    exceptions.
+
+    Asynchronous counterpart of ``normalize_many()``. Takes the same
+    parameters as ``AsyncBatchIterator``.
+
+    :return: An ``AsyncBatchIterator`` of ``BatchResult``, one per record, in
+        order.
+    """
+    return AsyncBatchIterator(
+        records, strict=strict, validate=False, **kwargs)
+
+
+def validate_many_async(records, strict=True, **kwargs):
+    """ Normalize and validate a stream of records asynchronously, without
+    raising exceptions.
+
+    Asynchronous counterpart of ``validate_many()``. Takes the same
+    parameters as ``AsyncBatchIterator``.
+
+    :return: An ``AsyncBatchIterator`` of ``BatchResult``, one per record, in
+        order.
+    """
+    return AsyncBatchIterator(
+        records, strict=strict, validate=True, **kwargs)
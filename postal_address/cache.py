@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+u""" Thread-safe, bounded and observable caches for territory lookups.
+
+All caches are registered by name, so they can be inspected, resized and
+cleared from a single place::
+
+    >>> from postal_address.cache import cache_info, cache_clear
+    >>> cache_info()['country_aliases']
+    CacheInfo(hits=12, misses=4, evictions=0, maxsize=8192, currsize=4)
+    >>> cache_clear()
+
+Each cache is protected by its own lock, which is only held while reading or
+updating the cache, never while computing a missing value. Concurrent misses on
+the same key may then compute the value twice, but never block each other.
+Values whose computation started before the cache was cleared are not stored.
+
+.. data:: CACHES
+
+    Registry of all caches, indexed by name.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import threading
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+CacheInfo = namedtuple(
+    'CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+CACHES = OrderedDict()
+
+# Sentinels.
+_MISSING = object()
+_KWARGS_MARK = object()
+
+
+class LookupCache(object):
+    """ A least-recently-used cache, safe to share between threads.
+
+    A ``maxsize`` of ``None`` makes the cache unbounded, while ``0`` disables
+    it. Caches flagged as ``alias_dependent`` hold values derived from the
+    territory alias mappings, and are cleared when those change.
+
+    The ``generation`` of the cache is bumped each time it is cleared.
+    """
+
+    def __init__(self, name, maxsize=None, alias_dependent=False):
+        self.name = name
+        self.maxsize = maxsize
+        self.alias_dependent = alias_dependent
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        self.generation = 0
+
+    def get(self, key, default=None):
+        """ Return the cached value of a key, and count the hit or miss. """
+        with self.lock:
+            value = self.data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            if self.maxsize is not None:
+                # Mark the key as the most recently used.
+                del self.data[key]
+                self.data[key] = value
+            return value
+
+    def set(self, key, value, generation=None):
+        """ Store a value, evicting least recently used keys if needed.
+
+        If another thread stored a value for the same key in the meantime,
+        that value is kept, so all callers share the same result.
+
+        :param generation: Generation of the cache read before computing the
+            value. The value is not stored if the cache was cleared since.
+        :return: The cached value.
+        """
+        with self.lock:
+            if self.maxsize == 0 or (
+                    generation is not None and generation != self.generation):
+                return value
+            existing = self.data.get(key, _MISSING)
+            if existing is not _MISSING:
+                return existing
+            self.data[key] = value
+            if self.maxsize is not None:
+                while len(self.data) > self.maxsize:
+                    self.data.popitem(last=False)
+                    self.evictions += 1
+            return value
+
+    def resize(self, maxsize):
+        """ Change the maximum size of the cache, evicting keys if needed. """
+        with self.lock:
+            self.maxsize = maxsize
+            while maxsize is not None and len(self.data) > maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """ Remove all cached values and reset statistics. """
+        with self.lock:
+            self.reset()
+
+    def reset(self):
+        """ Same as ``clear()``, for callers already holding the lock. """
+        self.data.clear()
+        self.hits = self.misses = self.evictions = 0
+        self.generation += 1
+
+    def info(self):
+        """ Return the statistics of the cache. """
+        with self.lock:
+            return CacheInfo(
+                self.hits, self.misses, self.evictions, self.maxsize,
+                len(self.data))
+
+
+def cached_lookup(maxsize=None, copy=None, alias_dependent=False):
+    """ Decorator caching results of a function in a registered cache.
+
+    The cache is named after the decorated function, and exposed along with
+    ``cache_info()`` and ``cache_clear()`` helpers as attributes of the
+    returned function.
+
+    :param maxsize: Maximum number of cached results. Unbounded by default.
+    :param copy: Callable applied to results before returning them, to
+        protect cached mutable values from being altered by callers.
+    :param alias_dependent: Set if results depend on territory alias
+        mappings, so the cache is cleared by ``register_aliases()``.
+    """
+    def decorator(func):
+        cache = LookupCache(func.__name__, maxsize, alias_dependent)
+        CACHES[cache.name] = cache
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = args
+            if kwargs:
+                key += (_KWARGS_MARK, ) + tuple(sorted(kwargs.items()))
+            # Read before computing, so results of lookups overlapping a
+            # clear of the cache are not stored.
+            generation = cache.generation
+            value = cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = cache.set(key, func(*args, **kwargs), generation)
+            if copy is not None:
+                return copy(value)
+            return value
+
+        wrapper.cache = cache
+        wrapper.cache_info = cache.info
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+def cache_info():
+    """ Return statistics of all caches, indexed by name. """
+    return OrderedDict(
+        (name, cache.info()) for name, cache in CACHES.items())
+
+
+def cache_clear(*names):
+    """ Clear caches by name, or all caches if none provided.
+
+    Caches are cleared at once, holding all their locks, so values computed
+    from one another before the clear are never stored after it.
+    """
+    names = set(names or CACHES)
+    unknown_names = names.difference(CACHES)
+    if unknown_names:
+        raise KeyError(unknown_names.pop())
+    # Always lock caches in the same order, to never deadlock.
+    caches = [cache for name, cache in CACHES.items() if name in names]
+    for cache in caches:
+        cache.lock.acquire()
+    try:
+        for cache in caches:
+            cache.reset()
+    finally:
+        for cache in caches:
+            cache.lock.release()
+
+
+def alias_dependent_caches():
+    """ Return the names of caches depending on territory alias mappings.
+    """
+    return [name for name, cache in CACHES.items() if cache.alias_dependent]
+
+
+def set_cache_size(name, maxsize):
+    """ Set the maximum size of a cache. ``None`` makes it unbounded. """
+    CACHES[name].resize(maxsize)
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+u""" ``postal-address`` command line interface.
+
+Streams CSV or JSON Lines files of addresses through normalization and
+validation::
+
+    $ postal-address addresses.csv --output clean.csv --rejects rejects.csv \\
+        --workers 4
+
+Records are read and processed by chunks, so memory usage is bounded by the
+number of chunks in flight, whatever the size of the input. Columns which are
+not address fields, like identifiers, are passed through untouched.
+
+Valid records are written to the output, while invalid ones are written to the
+rejects file, if any, along with an ``errors`` field describing the reasons of
+their rejection, as classified by ``InvalidAddress``. Lines of JSON Lines
+inputs which are not JSON objects are rejected with a ``parse_error``, and
+their raw content in a ``line`` field. So are rows of CSV inputs with more
+cells than columns, along with their cells matching columns. Throughput
+statistics are printed on ``stderr``.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import sys
+import time
+from collections import namedtuple
+
+from . import PY2, __version__
+from .address import Address, process_record
+from .parallel import iter_chunks, map_chunks
+
+# Order of address columns in CSV outputs.
+FIELD_IDS = [
+    'line1', 'line2', 'postal_code', 'city_name', 'subdivision_code',
+    'country_code']
+assert set(FIELD_IDS) == Address.BASE_FIELD_IDS
+
+FORMATS = ('csv', 'jsonl')
+
+# Name of the field holding rejection reasons.
+ERRORS_FIELD = 'errors'
+
+# Name of the field holding raw input lines which could not be parsed.
+LINE_FIELD = 'line'
+
+# Key of the cells of CSV rows beyond the last column.
+EXTRA_CELLS = object()
+
+# A line of input which is not a valid record, with the fields to reject it
+# with.
+UnparsedRecord = namedtuple('UnparsedRecord', ['fields', 'error'])
+
+
+def result_errors(result):
+    """ Serialize the reasons of the rejection of a ``BatchResult``. """
+    errors = {}
+    if result.required_fields:
+        errors['required_fields'] = sorted(result.required_fields)
+    if result.invalid_fields:
+        errors['invalid_fields'] = result.invalid_fields
+    if result.inconsistent_fields:
+        errors['inconsistent_fields'] = sorted(
+            list(fields) for fields in result.inconsistent_fields)
+    if result.extra_msg:
+        errors['extra_msg'] = result.extra_msg
+    return errors
+
+
+def process_chunk(task):
+    """ Normalize and validate a chunk of records.
+
+    Runs in worker processes, so it only takes and returns plain,
+    picklable data.
+
+    :param task: A ``(records, strict, validate)`` tuple.
+    :return: A list of ``(accepted, record)`` tuples. Accepted records have
+        their address fields normalized, while rejected ones are returned
+        as-is, with their rejection reasons.
+    """
+    records, strict, validate = task
+    results = []
+    for record in records:
+        if isinstance(record, UnparsedRecord):
+            rejected = dict(record.fields)
+            rejected[ERRORS_FIELD] = {'parse_error': record.error}
+            results.append((False, rejected))
+            continue
+        fields = {}
+        extra_fields = {}
+        for field_id, value in record.items():
+            if field_id in Address.BASE_FIELD_IDS:
+                fields[field_id] = value
+            else:
+                extra_fields[field_id] = value
+        result = process_record(fields, strict=strict, validate=validate)
+        if result.status == 'invalid':
+            record = dict(record)
+            record[ERRORS_FIELD] = result_errors(result)
+            results.append((False, record))
+        else:
+            extra_fields.update(result.fields)
+            results.append((True, extra_fields))
+    return results
+
+
+def guess_format(file_path, default='jsonl'):
+    """ Guess the format of a file from its extension. """
+    if file_path and file_path != '-':
+        extension = file_path.rsplit('.', 1)[-1].lower()
+        if extension == 'csv':
+            return 'csv'
+        if extension in ('jsonl', 'ndjson', 'json'):
+            return 'jsonl'
+    return default
+
+
+def open_file(file_path, mode):
+    """ Open a file in text mode, or standard input and output for ``-``. """
+    if file_path == '-':
+        stream = sys.stdin if mode == 'r' else sys.stdout
+        if PY2:
+            return stream
+        return io.open(
+            stream.fileno(), mode, encoding='utf-8', newline='',
+            closefd=False)
+    if PY2:
+        return io.open(file_path, mode + 'b')
+    return io.open(file_path, mode, encoding='utf-8', newline='')
+
+
+def parse_line(line):
+    """ Parse a line of JSON Lines into a record, or an ``UnparsedRecord``.
+    """
+    try:
+        record = json.loads(line)
+    except ValueError as expt:
+        return UnparsedRecord(
+            {LINE_FIELD: line.rstrip('\r\n')}, '{}'.format(expt))
+    if not isinstance(record, dict):
+        return UnparsedRecord(
+            {LINE_FIELD: line.rstrip('\r\n')}, "Not a JSON object.")
+    return record
+
+
+def parse_row(row):
+    """ Decode a row of CSV into a record, or an ``UnparsedRecord`` if it has
+    more cells than columns.
+    """
+    extra_cells = row.pop(EXTRA_CELLS, None)
+    if PY2:
+        row = {key.decode('utf-8'): value.decode('utf-8')
+               for key, value in row.items()}
+    if extra_cells:
+        return UnparsedRecord(
+            row, "{} more cells than columns.".format(len(extra_cells)))
+    return row
+
+
+def read_records(stream, file_format):
+    """ Read records of an input stream.
+
+    :return: A ``(columns, records)`` tuple, of which ``columns`` is the list
+        of CSV columns, or ``None`` for JSON Lines, and ``records`` an iterator
+        over records. Lines of JSON Lines which are not JSON objects and rows
+        of CSV with more cells than columns are returned as
+        ``UnparsedRecord``.
+    """
+    if file_format == 'jsonl':
+        return None, (
+            parse_line(line.decode('utf-8') if PY2 else line)
+            for line in stream if line.strip())
+
+    reader = csv.DictReader(stream, restkey=EXTRA_CELLS)
+    columns = reader.fieldnames or []
+    if PY2:
+        columns = [column.decode('utf-8') for column in columns]
+    return columns, (parse_row(row) for row in reader)
+
+
+class RecordWriter(object):
+    """ Write records to an output stream, in CSV or JSON Lines format.
+
+    The columns of CSV outputs are defined by the ``columns`` parameter.
+    Values of non-string fields are JSON-encoded.
+    """
+
+    def __init__(self, stream, file_format, columns=None):
+        self.stream = stream
+        self.file_format = file_format
+        self.columns = columns
+        self.csv_writer = None
+        if file_format == 'csv':
+            self.csv_writer = csv.writer(stream, lineterminator='\n')
+            self.write_row(columns)
+
+    def write_row(self, values):
+        """ Write a row of CSV values. """
+        if PY2:
+            values = [value.encode('utf-8') for value in values]
+        self.csv_writer.writerow(values)
+
+    def write(self, record):
+        """ Write a record. """
+        if self.csv_writer is None:
+            line = json.dumps(
+                record, sort_keys=True, ensure_ascii=False) + '\n'
+            if PY2:
+                line = line.encode('utf-8')
+            self.stream.write(line)
+            return
+        values = []
+        for column in self.columns:
+            value = record.get(column)
+            if value is None:
+                value = ''
+            elif not isinstance(value, type('')):
+                value = json.dumps(value, sort_keys=True, ensure_ascii=False)
+            values.append(value)
+        self.write_row(values)
+
+
+def build_parser():
+    """ Build the parser of command line arguments. """
+    parser = argparse.ArgumentParser(
+        prog='postal-address',
+        description="Normalize and validate a stream of postal addresses.")
+    parser.add_argument(
+        'input', nargs='?', default='-',
+        help="CSV or JSON Lines file. Defaults to standard input.")
+    parser.add_argument(
+        '-o', '--output', default='-',
+        help="Destination of valid records. Defaults to standard output.")
+    parser.add_argument(
+        '-r', '--rejects',
+        help="Destination of invalid records, with their rejection reasons. "
+        "Invalid records are dropped if not set.")
+    parser.add_argument(
+        '-f', '--format', choices=FORMATS,
+        help="Format of input and outputs. Guessed from the input file "
+        "extension by default, else JSON Lines.")
+    parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help="Number of worker processes. 0 uses all CPUs. Defaults to 1.")
+    parser.add_argument(
+        '-c', '--chunk-size', type=int, default=1000,
+        help="Number of records per chunk of work. Defaults to 1000.")
+    parser.add_argument(
+        '--unordered', action='store_true',
+        help="Write records as soon as they are processed, instead of in "
+        "input order.")
+    parser.add_argument(
+        '--lax', action='store_true',
+        help="Non-strict normalization: subdivision-derived values take "
+        "precedence over user-provided fields.")
+    parser.add_argument(
+        '--no-validate', action='store_true',
+        help="Only normalize records. Only records failing normalization "
+        "are rejected.")
+    parser.add_argument(
+        '-q', '--quiet', action='store_true',
+        help="Do not print statistics on standard error.")
+    parser.add_argument(
+        '--version', action='version',
+        version='%(prog)s {}'.format(__version__))
+    return parser
+
+
+def main(args=None):
+    """ Entry point of the ``postal-address`` command. """
+    options = build_parser().parse_args(args)
+    file_format = options.format or guess_format(options.input)
+    workers = options.workers or multiprocessing.cpu_count()
+    if options.chunk_size < 1 or workers < 1:
+        raise SystemExit("Chunk size and number of workers must be positive.")
+
+    stats = {'read': 0, 'accepted': 0, 'rejected': 0}
+    start = time.time()
+
+    input_stream = open_file(options.input, 'r')
+    output_stream = open_file(options.output, 'w')
+    rejects_stream = None
+    if options.rejects:
+        rejects_stream = open_file(options.rejects, 'w')
+    try:
+        input_columns, records = read_records(input_stream, file_format)
+
+        # CSV outputs mirror input columns, completed by address fields.
+        columns = rejects_columns = None
+        if input_columns is not None:
+            columns = input_columns + [
+                field_id for field_id in FIELD_IDS
+                if field_id not in input_columns]
+            rejects_columns = input_columns + [ERRORS_FIELD]
+
+        writer = RecordWriter(output_stream, file_format, columns)
+        rejects_writer = None
+        if rejects_stream:
+            rejects_writer = RecordWriter(
+                rejects_stream, file_format, rejects_columns)
+
+        tasks = (
+            (chunk, not options.lax, not options.no_validate)
+            for chunk in iter_chunks(records, options.chunk_size))
+        for results in map_chunks(
+                process_chunk, tasks, workers=workers,
+                ordered=not options.unordered):
+            for accepted, record in results:
+                stats['read'] += 1
+                if accepted:
+                    stats['accepted'] += 1
+                    writer.write(record)
+                else:
+                    stats['rejected'] += 1
+                    if rejects_writer:
+                        rejects_writer.write(record)
+    finally:
+        for stream in (input_stream, output_stream, rejects_stream):
+            # Standard streams are flushed but not closed.
+            if stream in (sys.stdin, sys.stdout):
+                stream.flush()
+            elif stream is not None:
+                stream.close()
+
+    elapsed = time.time() - start
+    if not options.quiet:
+        print(
+            "{read} records read, {accepted} accepted, {rejected} rejected "
+            "in {elapsed:.2f}s ({rate:.0f} records/s).".format(
+                elapsed=elapsed, rate=stats['read'] / (elapsed or 1),
+                **stats),
+            file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+u""" Columnar container of addresses.
+
+An ``AddressFrame`` stores each base field of a collection of addresses in its
+own column. Normalization, validation and rendering are performed column-wise,
+with the same semantics as the ``Address`` class, but without instantiating
+one ``Address`` per row::
+
+    >>> from postal_address.frame import AddressFrame
+    >>> frame = AddressFrame({
+    ...     'line1': ['10, avenue des Champs Elysées', '1 rue de la Paix'],
+    ...     'postal_code': ['75008', '75002'],
+    ...     'city_name': ['Paris', None],
+    ...     'country_code': ['fr', 'FR']})
+    >>> frame.valid()
+    [True, False]
+
+Columns can be lists, NumPy arrays or pandas series, and a pandas dataframe
+can be passed as-is. Field values, territory codes and subdivision metadata
+are normalized once per distinct value of each column.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import sys
+
+from .address import (
+    NO_METADATA,
+    Address,
+    InvalidAddress,
+    check_inconsistent_fields,
+    check_invalid_fields,
+    check_required_fields,
+    country_names,
+    normalize_postal_code,
+    render_block,
+    subdivision_conflict,
+    subdivision_names,
+    subdivision_record
+)
+from .territory import default_subdivision_code, normalize_territory_codes
+
+try:
+    basestring
+except NameError:  # pragma: no cover
+    basestring = (str, bytes)
+
+# Precedence of the kinds of columns when picking the kind of results. Other
+# kinds, like lists, produce lists.
+LIBRARY_PRECEDENCE = {'numpy': 1, 'pandas': 2}
+
+
+def field_value(value):
+    """ Check and convert a cell value to an address field value.
+
+    Missing values of NumPy and pandas columns, like ``NaN`` or
+    ``pandas.NA``, are converted to ``None``.
+    """
+    if value is None or isinstance(value, basestring):
+        return value
+    # pandas.NA can't be compared, so let pandas recognize its own missing
+    # values. Values can't come from pandas if it isn't loaded already.
+    pandas = sys.modules.get('pandas')
+    if pandas is not None and pandas.api.types.is_scalar(value) and \
+            pandas.isna(value):
+        return None
+    # NaN is the only value not equal to itself.
+    if value != value:
+        return None
+    raise TypeError(
+        "{!r} is not a valid address field value.".format(value))
+
+
+def normalize_spaces(value):
+    """ Collapse runs of whitespaces, and reset empty and blank strings to
+    ``None``. """
+    return (' '.join(value.split()) or None) if value else None
+
+
+def map_distinct(function, column):
+    """ Apply a function on each distinct value of a column.
+
+    Results are computed once per value, and broadcasted back to all its
+    occurrences.
+
+    :return: A list of results, one per item of the column.
+    """
+    results = {}
+    mapped = []
+    for value in column:
+        try:
+            result = results[value]
+        except KeyError:
+            result = results[value] = function(value)
+        mapped.append(result)
+    return mapped
+
+
+class AddressFrame(object):
+    """ A collection of addresses, stored field by field.
+
+    At instanciation, columns are normalized like ``Address`` instances are.
+    Rows failing strict normalization are kept as-is, and reported as invalid
+    by ``check_fields()`` and ``valid()``.
+    """
+
+    def __init__(self, columns=None, strict=True):
+        """ Load columns of address fields and normalize them.
+
+        :param columns: A mapping of base field IDs to columns of values, or a
+            pandas dataframe. Missing columns are filled with ``None``.
+        :param strict: Strictness of normalization.
+        """
+        columns = columns if columns is not None else {}
+
+        # Only common fields are allowed to be set directly.
+        unknown_fields = set(columns).difference(Address.BASE_FIELD_IDS)
+        if unknown_fields:
+            raise KeyError(
+                "{!r} fields are not allowed to be set freely.".format(
+                    unknown_fields))
+
+        # Keep track of the kind of input, to produce results of the same
+        # kind. Mixed columns are resolved by precedence, whatever their
+        # order: pandas series win over NumPy arrays, which win over lists.
+        self.library = type(columns).__module__.split('.')[0]
+        self.index = getattr(columns, 'index', None)
+
+        self.columns = {}
+        for field_id in sorted(columns):
+            column = columns[field_id]
+            library = type(column).__module__.split('.')[0]
+            if LIBRARY_PRECEDENCE.get(library, 0) > LIBRARY_PRECEDENCE.get(
+                    self.library, 0):
+                self.library = library
+                self.index = getattr(column, 'index', None)
+            self.columns[field_id] = [field_value(value) for value in column]
+
+        lengths = set(map(len, self.columns.values()))
+        if len(lengths) > 1:
+            raise ValueError("All columns must be of the same length.")
+        self.size = lengths.pop() if lengths else 0
+
+        for field_id in Address.BASE_FIELD_IDS.difference(self.columns):
+            self.columns[field_id] = [None] * self.size
+        self.metadata = [NO_METADATA] * self.size
+        self.errors = [None] * self.size
+
+        self.normalize(strict=strict)
+
+    @classmethod
+    def from_records(cls, records, strict=True):
+        """ Build a frame from an iterable of mappings of address fields. """
+        records = list(records)
+        field_ids = set()
+        for record in records:
+            field_ids.update(record)
+        return cls({
+            field_id: [record.get(field_id) for record in records]
+            for field_id in field_ids}, strict=strict)
+
+    def __len__(self):
+        """ Return the number of addresses. """
+        return self.size
+
+    def __getitem__(self, field_id):
+        """ Return the column of a base field. """
+        if field_id not in Address.BASE_FIELD_IDS:
+            raise KeyError(field_id)
+        return self.wrap(self.columns[field_id], object)
+
+    def wrap(self, values, dtype):
+        """ Convert a list of results to the kind of the input columns. """
+        if self.library == 'numpy':
+            import numpy
+            return numpy.array(values, dtype=dtype)
+        if self.library == 'pandas':
+            import pandas
+            return pandas.Series(values, index=self.index, dtype=dtype)
+        return values
+
+    def normalize(self, strict=True):
+        """ Normalize all columns.
+
+        Follows the same steps as ``Address.normalize()``. Instead of raising
+        ``InvalidAddress``, inconsistencies between user-provided fields and
+        subdivision-derived values are recorded in ``errors``, and the
+        offending rows are left untouched by subdivision metadata.
+        """
+        columns = self.columns
+        self.errors = [None] * self.size
+
+        columns['postal_code'] = map_distinct(
+            normalize_postal_code, columns['postal_code'])
+
+        # Normalize spaces of base fields, and reset empty and blank strings.
+        for field_id in Address.BASE_FIELD_IDS:
+            columns[field_id] = map_distinct(
+                normalize_spaces, columns[field_id])
+
+        # Swap lines if the first is empty.
+        line1, line2 = columns['line1'], columns['line2']
+        for row, value in enumerate(line2):
+            if value and not line1[row]:
+                line1[row], line2[row] = value, None
+
+        # Normalize territory codes, once per distinct value. Unrecognized
+        # territory codes are reset to None.
+        for territory_id in ['country_code', 'subdivision_code']:
+            columns[territory_id] = normalize_territory_codes(
+                columns[territory_id], resolve_aliases=False)[0]
+
+        # Try to set default subdivision from country if not set.
+        country_codes = columns['country_code']
+        subdivision_codes = columns['subdivision_code']
+        for row, country_code in enumerate(country_codes):
+            if country_code and not subdivision_codes[row]:
+                subdivision_code = default_subdivision_code(country_code)
+                if subdivision_code:
+                    subdivision_codes[row] = subdivision_code
+                    country_codes[row] = None
+
+        # Populate address fields with metadata extracted from subdivisions.
+        records = {
+            code: subdivision_record(code)
+            for code in set(subdivision_codes) if code}
+        metadata = [NO_METADATA] * self.size
+        for row, subdivision_code in enumerate(subdivision_codes):
+            if not subdivision_code:
+                continue
+            record = records[subdivision_code]
+            if strict:
+                conflict = subdivision_conflict(record, RowView(self, row))
+                if conflict:
+                    self.errors[row] = InvalidAddress(
+                        inconsistent_fields={tuple(sorted((
+                            conflict[0], 'subdivision_code')))},
+                        extra_msg="{} subdivision is trying to replace "
+                        "{}={!r} field by {}={!r}".format(
+                            subdivision_code,
+                            conflict[0], conflict[1],
+                            conflict[0], conflict[2]))
+                    continue
+            for field_id, new_value in record.fields.items():
+                columns[field_id][row] = new_value
+            metadata[row] = record.metadata
+        self.metadata = metadata
+
+    def check_fields(self):
+        """ Check fields consistency and requirements of all rows.
+
+        :return: A list of ``(required_fields, invalid_fields,
+            inconsistent_fields)`` tuples, one per row, as returned by
+            ``Address.check_fields()``. Rows which failed normalization
+            report the fields of their ``InvalidAddress`` error.
+        """
+        statuses = []
+        for row, error in enumerate(self.errors):
+            if error is not None:
+                statuses.append((
+                    error.required_fields, error.invalid_fields,
+                    error.inconsistent_fields))
+                continue
+            fields = RowView(self, row)
+            required_fields = check_required_fields(fields)
+            invalid_fields = check_invalid_fields(fields, required_fields)
+            statuses.append((
+                required_fields, invalid_fields,
+                check_inconsistent_fields(
+                    fields, required_fields, invalid_fields)))
+        return statuses
+
+    def valid(self):
+        """ Return the boolean mask of valid addresses. """
+        return self.wrap(
+            [not any(status) for status in self.check_fields()], bool)
+
+    def render(self, separator='\n'):
+        """ Render human-friendly address blocks of all rows. """
+        columns = self.columns
+        countries = country_names()
+        subdivisions = subdivision_names()
+
+        blocks = []
+        for row in range(self.size):
+            # Invalid codes have no name.
+            country = countries.get(columns['country_code'][row])
+            subdivision = subdivisions.get(columns['subdivision_code'][row])
+            blocks.append(render_block(
+                line1=columns['line1'][row],
+                line2=columns['line2'][row],
+                postal_code=columns['postal_code'][row],
+                city_name=columns['city_name'][row],
+                state_name=self.metadata[row].get('state_name'),
+                subdivision_name=subdivision.name if subdivision else None,
+                country_name=country.display_name if country else None,
+                separator=separator))
+        return self.wrap(blocks, object)
+
+    def to_records(self):
+        """ Return a list of dictionaries of fields and metadata, per row. """
+        records = []
+        for row in range(self.size):
+            record = dict(self.metadata[row])
+            record.update(RowView(self, row).items())
+            records.append(record)
+        return records
+
+    def to_pandas(self):
+        """ Return base fields as a pandas dataframe. """
+        import pandas
+        return pandas.DataFrame(
+            {field_id: self.columns[field_id]
+             for field_id in sorted(Address.BASE_FIELD_IDS)},
+            index=self.index, dtype=object)
+
+
+class RowView(object):
+    """ Read-only mapping of the base fields of a row. """
+
+    __slots__ = ('frame', 'row')
+
+    def __init__(self, frame, row):
+        self.frame = frame
+        self.row = row
+
+    def __getitem__(self, field_id):
+        return self.frame.columns[field_id][self.row]
+
+    def items(self):
+        return [
+            (field_id, self[field_id]) for field_id in Address.BASE_FIELD_IDS]
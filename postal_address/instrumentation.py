@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+u""" Opt-in instrumentation of normalization and validation stages.
+
+``Address.normalize()`` and ``Address.check_fields()`` are split into named
+stages, of which durations are reported to the active recorder, if any, along
+with the duration and outcome of the whole operation::
+
+    >>> from postal_address.address import Address
+    >>> from postal_address.instrumentation import instrumented
+    >>> with instrumented() as stats:
+    ...     Address(line1='1 Infinite Loop', postal_code='95014',
+    ...             city_name='Cupertino', subdivision_code='US-CA').valid
+    >>> stats.report()['stages']['normalize.postal_code']
+    StageReport(calls=1, total_time=4.1e-06)
+
+Instrumentation is disabled by default, in which case each stage only costs a
+test on a local variable.
+
+Custom timers and counters can be plugged by subclassing ``Recorder``.
+
+.. data:: STAGES
+
+    Names of all instrumented stages.
+
+.. data:: RECORDER
+
+    The active recorder, or ``None`` if instrumentation is disabled.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from timeit import default_timer
+
+from .cache import cache_info
+
+STAGES = (
+    'normalize.postal_code',
+    'normalize.whitespace',
+    'normalize.lines',
+    'normalize.territory_codes',
+    'normalize.default_subdivision',
+    'normalize.subdivision_record',
+    'normalize.metadata',
+    'validate.check_required_fields',
+    'validate.check_invalid_fields',
+    'validate.check_inconsistent_fields',
+)
+
+RECORDER = None
+
+StageReport = namedtuple('StageReport', ['calls', 'total_time'])
+
+
+class Recorder(object):
+    """ Base class of recorders, which receive durations of stages.
+
+    Both ``record()`` and ``record_call()`` do nothing by default. Subclasses
+    override those they are interested in, and may override ``clock``.
+    """
+
+    # Returns the current time in seconds.
+    clock = staticmethod(default_timer)
+
+    def record(self, stage, elapsed):
+        """ Record the duration in seconds of a run of a stage. """
+
+    def record_call(self, operation, elapsed, error=None):
+        """ Record the duration in seconds of a whole operation.
+
+        :param operation: Either ``normalize`` or ``validate``.
+        :param error: The ``InvalidAddress`` exception describing why the
+            address failed the operation, if it did.
+        """
+
+    def stopwatch(self):
+        """ Return a stopwatch started now, reporting to this recorder. """
+        return Stopwatch(self)
+
+
+class Stopwatch(object):
+    """ Time consecutive stages of a single call. """
+
+    __slots__ = ('recorder', 'clock', 'start', 'last')
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.clock = recorder.clock
+        self.start = self.last = self.clock()
+
+    def lap(self, stage):
+        """ Record the time elapsed since the previous lap as a stage. """
+        now = self.clock()
+        self.recorder.record(stage, now - self.last)
+        # Leave the cost of recording out of the next stage.
+        self.last = self.clock()
+
+    def finish(self, operation, error=None):
+        """ Record the time elapsed since the start as a whole operation. """
+        self.recorder.record_call(operation, self.clock() - self.start, error)
+
+
+class StageStats(Recorder):
+    """ Recorder of call counts and cumulative time of each stage.
+
+    Also reports hit ratios of lookup caches since its creation or last
+    reset.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Forget all recorded stats. """
+        with self.lock:
+            self.calls = dict.fromkeys(STAGES, 0)
+            self.total_time = dict.fromkeys(STAGES, 0.0)
+            self.initial_cache_info = cache_info()
+
+    def record(self, stage, elapsed):
+        with self.lock:
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+            self.total_time[stage] = self.total_time.get(stage, 0) + elapsed
+
+    def cache_hit_ratios(self):
+        """ Return hit ratios of caches used since the last reset, by name.
+        """
+        ratios = OrderedDict()
+        for name, info in cache_info().items():
+            initial = self.initial_cache_info.get(name)
+            hits, misses = info.hits, info.misses
+            # Statistics restart from zero if a cache was cleared since.
+            if initial and initial.hits <= hits and initial.misses <= misses:
+                hits -= initial.hits
+                misses -= initial.misses
+            if hits + misses:
+                ratios[name] = hits / (hits + misses)
+        return ratios
+
+    def report(self):
+        """ Return stats of stages and caches.
+
+        :return: A dictionary with a ``stages`` mapping of stage names to
+            ``StageReport``, and a ``caches`` mapping of cache names to their
+            hit ratio.
+        """
+        with self.lock:
+            stages = OrderedDict(
+                (stage, StageReport(self.calls[stage], self.total_time[stage]))
+                for stage in sorted(self.calls, key=stage_order))
+        return {'stages': stages, 'caches': self.cache_hit_ratios()}
+
+
+def stage_order(stage):
+    """ Sort known stages in order of execution, and others by name. """
+    if stage in STAGES:
+        return (STAGES.index(stage), stage)
+    return (len(STAGES), stage)
+
+
+def enable(recorder=None):
+    """ Activate instrumentation.
+
+    :param recorder: A ``Recorder`` instance. Defaults to a new
+        ``StageStats``.
+    :return: The active recorder.
+    """
+    global RECORDER
+    RECORDER = recorder if recorder is not None else StageStats()
+    return RECORDER
+
+
+def disable():
+    """ Deactivate instrumentation. """
+    global RECORDER
+    RECORDER = None
+
+
+@contextmanager
+def instrumented(recorder=None):
+    """ Activate instrumentation within a context, and yield the recorder.
+
+    The previously active recorder is restored on exit.
+    """
+    global RECORDER
+    previous = RECORDER
+    try:
+        yield enable(recorder)
+    finally:
+        RECORDER = previous
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+u""" Export of library metrics in the Prometheus text format.
+
+Statistics of all lookup caches are always available. Counts and latencies of
+normalizations and validations are collected once a ``MetricsRecorder`` is
+active, through the ``instrumentation`` hooks. Each call to
+``Address.validate()`` or ``Address.check_fields()``, and each read of
+``Address.valid``, counts as a validation, even if its result comes from the
+cache of the address::
+
+    >>> from postal_address import metrics
+    >>> from postal_address.address import Address
+    >>> recorder = metrics.enable()
+    >>> Address(line1='1 Infinite Loop', postal_code='95014',
+    ...         city_name='Cupertino', subdivision_code='US-CA').valid
+    True
+    >>> print(metrics.render_metrics())
+    # HELP postal_address_cache_hits_total Number of hits of lookup caches.
+    # TYPE postal_address_cache_hits_total counter
+    postal_address_cache_hits_total{cache="country_aliases"} 0
+    ...
+
+The output is meant to be served as-is on a ``/metrics`` endpoint, with the
+``CONTENT_TYPE`` content type. No HTTP server is provided by this module.
+
+.. data:: LATENCY_BUCKETS
+
+    Upper bounds, in seconds, of buckets of latency histograms.
+
+.. data:: INVALID_REASONS
+
+    Reasons of ``InvalidAddress`` exceptions, after their attributes.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+from . import instrumentation
+from .cache import cache_info
+from .instrumentation import StageStats, stage_order
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PREFIX = 'postal_address'
+
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1)
+
+OPERATIONS = ('normalize', 'validate')
+
+INVALID_REASONS = ('required', 'invalid', 'inconsistent')
+
+
+class Histogram(object):
+    """ Cumulative histogram of observed values. """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # Counts of observations per bucket, the last one being +Inf.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """ Add an observation. """
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """ Return ``(upper_bound, count)`` tuples of all buckets.
+
+        Counts are cumulative, as expected by Prometheus, and the last bound
+        is ``+Inf``.
+        """
+        total = 0
+        results = []
+        for upper_bound, count in zip(
+                self.buckets + (float('inf'), ), self.counts):
+            total += count
+            results.append((upper_bound, total))
+        return results
+
+
+class MetricsRecorder(StageStats):
+    """ Recorder of stage durations, and of counts, outcomes and latencies of
+    whole operations.
+    """
+
+    def reset(self):
+        super(MetricsRecorder, self).reset()
+        with self.lock:
+            self.operations = dict.fromkeys(OPERATIONS, 0)
+            self.invalid = {
+                (operation, reason): 0
+                for operation in OPERATIONS for reason in INVALID_REASONS}
+            self.latencies = {
+                operation: Histogram() for operation in OPERATIONS}
+
+    def record_call(self, operation, elapsed, error=None):
+        with self.lock:
+            self.operations[operation] += 1
+            self.latencies[operation].observe(elapsed)
+            if error is not None:
+                for reason in INVALID_REASONS:
+                    if getattr(error, '{}_fields'.format(reason)):
+                        self.invalid[operation, reason] += 1
+
+
+def format_value(value):
+    """ Format a sample value the way Prometheus expects it. """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return '{}'.format(value)
+
+
+def format_labels(labels):
+    """ Format a sequence of ``(name, value)`` label pairs. """
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, '{}'.format(value).replace(
+            '\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels))
+
+
+class MetricsWriter(object):
+    """ Accumulate metric families in the Prometheus text format. """
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, metric_type, help_text):
+        """ Start a new metric family. """
+        self.lines.append('# HELP {}_{} {}'.format(PREFIX, name, help_text))
+        self.lines.append('# TYPE {}_{} {}'.format(PREFIX, name, metric_type))
+
+    def sample(self, name, value, labels=()):
+        """ Add a sample to the current family. """
+        self.lines.append('{}_{}{} {}'.format(
+            PREFIX, name, format_labels(labels), format_value(value)))
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def write_cache_metrics(writer):
+    """ Write statistics of all lookup caches. """
+    infos = cache_info()
+    for attribute, name, metric_type, help_text in [
+            ('hits', 'cache_hits_total', 'counter',
+             "Number of hits of lookup caches."),
+            ('misses', 'cache_misses_total', 'counter',
+             "Number of misses of lookup caches."),
+            ('evictions', 'cache_evictions_total', 'counter',
+             "Number of entries evicted from lookup caches."),
+            ('currsize', 'cache_size', 'gauge',
+             "Number of entries of lookup caches."),
+            ('maxsize', 'cache_max_size', 'gauge',
+             "Maximum number of entries of bounded lookup caches.")]:
+        writer.family(name, metric_type, help_text)
+        for cache_name, info in infos.items():
+            value = getattr(info, attribute)
+            if value is not None:
+                writer.sample(name, value, [('cache', cache_name)])
+
+
+def write_recorder_metrics(writer, recorder):
+    """ Write operations and stages statistics of a recorder. """
+    with recorder.lock:
+        operations = dict(recorder.operations)
+        invalid = dict(recorder.invalid)
+        latencies = {
+            operation: (
+                histogram.cumulative_counts(), histogram.sum, histogram.count)
+            for operation, histogram in recorder.latencies.items()}
+        stage_calls = dict(recorder.calls)
+        stage_time = dict(recorder.total_time)
+
+    for operation, noun in [
+            ('normalize', 'normalizations'), ('validate', 'validations')]:
+        writer.family(
+            '{}_total'.format(noun), 'counter',
+            "Number of address {} performed.".format(noun))
+        writer.sample('{}_total'.format(noun), operations[operation])
+
+    writer.family(
+        'invalid_addresses_total', 'counter',
+        "Number of addresses failing an operation, by reason.")
+    for operation in OPERATIONS:
+        for reason in INVALID_REASONS:
+            writer.sample(
+                'invalid_addresses_total', invalid[operation, reason],
+                [('operation', operation), ('reason', reason)])
+
+    for operation, noun in [
+            ('normalize', 'normalizations'), ('validate', 'validations')]:
+        name = '{}_duration_seconds'.format(operation)
+        writer.family(
+            name, 'histogram',
+            "Latency of address {}, in seconds.".format(noun))
+        buckets, total_time, calls = latencies[operation]
+        for upper_bound, count in buckets:
+            writer.sample(
+                '{}_bucket'.format(name), count,
+                [('le', format_value(upper_bound))])
+        writer.sample('{}_sum'.format(name), total_time)
+        writer.sample('{}_count'.format(name), calls)
+
+    stages = sorted(stage_calls, key=stage_order)
+    writer.family(
+        'stage_calls_total', 'counter',
+        "Number of runs of normalization and validation stages.")
+    for stage in stages:
+        writer.sample('stage_calls_total', stage_calls[stage], [
+            ('stage', stage)])
+    writer.family(
+        'stage_seconds_total', 'counter',
+        "Cumulative time spent in normalization and validation stages.")
+    for stage in stages:
+        writer.sample('stage_seconds_total', stage_time[stage], [
+            ('stage', stage)])
+
+
+def render_metrics(recorder=None):
+    """ Render all metrics in the Prometheus text exposition format.
+
+    :param recorder: A ``MetricsRecorder``. Defaults to the active recorder.
+        Only cache metrics are rendered if it is not a ``MetricsRecorder``.
+    """
+    if recorder is None:
+        recorder = instrumentation.RECORDER
+    writer = MetricsWriter()
+    write_cache_metrics(writer)
+    if isinstance(recorder, MetricsRecorder):
+        write_recorder_metrics(writer, recorder)
+    return writer.render()
+
+
+def enable():
+    """ Activate collection of metrics by a new ``MetricsRecorder``.
+
+    :return: The active recorder.
+    """
+    return instrumentation.enable(MetricsRecorder())
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+u""" Chunked processing of streams, in a pool of worker processes.
+
+Shared by the ``postal-address`` command and ``random_addresses()``.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import multiprocessing
+from collections import deque
+from itertools import islice
+
+
+def iter_chunks(iterable, chunk_size):
+    """ Group items of an iterable into lists of ``chunk_size`` items. """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def map_chunks(function, chunks, workers=1, ordered=True, max_pending=None):
+    """ Apply a function on chunks, in a pool of worker processes.
+
+    Unlike ``multiprocessing.Pool.imap()``, which consumes its input as fast
+    as it can, at most ``max_pending`` chunks are submitted to the pool at any
+    time, to keep memory usage constant.
+
+    :param workers: Number of worker processes. Chunks are processed in the
+        current process if set to 1.
+    :param ordered: Yield results in the order of chunks. Else, results are
+        yielded as soon as they are available.
+    :param max_pending: Maximum number of chunks in flight. Defaults to twice
+        the number of workers.
+    """
+    if workers == 1:
+        for chunk in chunks:
+            yield function(chunk)
+        return
+
+    max_pending = max_pending or 2 * workers
+    pool = multiprocessing.Pool(workers)
+    pending = deque()
+
+    def pop_result():
+        if not ordered:
+            for async_result in pending:
+                if async_result.ready():
+                    pending.remove(async_result)
+                    return async_result.get()
+        # Wait for the oldest chunk.
+        return pending.popleft().get()
+
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(function, (chunk, )))
+            while len(pending) >= max_pending:
+                yield pop_result()
+        while pending:
+            yield pop_result()
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
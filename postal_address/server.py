@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+u""" HTTP/JSON service normalizing, validating and rendering addresses.
+
+Runs on the standard library only::
+
+    $ postal-address-server --port 8080 --workers 4
+
+    $ curl -X POST localhost:8080/validate -d '{"line1": "1 rue de la Paix",
+        "postal_code": "75002", "city_name": "Paris", "country_code": "fr"}'
+    {"errors": {}, "fields": {"city_name": "Paris", ...}, "status": "valid"}
+
+Endpoints:
+
+* ``POST /normalize``, ``POST /validate`` and ``POST /render`` take a JSON
+  object of address fields, or a list of such objects, and return one result
+  object per record. Results have the ``status``, ``fields`` and ``errors`` of
+  the ``BatchResult`` produced by ``normalize_many()`` or ``validate_many()``,
+  and a ``rendered`` address block for ``/render``. Single invalid records
+  are answered with a ``422`` status code.
+* ``GET /health`` reports the readiness of the service.
+* ``GET /metrics`` exports library and service metrics in the Prometheus text
+  format.
+
+Records of concurrent requests are queued and coalesced into micro-batches,
+processed by a bounded pool of worker threads. Requests are rejected with a
+``503`` status code once the queue is full.
+
+Before accepting connections, the server loads pycountry databases and builds
+territory tables and subdivision records, so the first requests do not pay for
+them.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import argparse
+import json
+import sys
+import threading
+import time
+
+from . import PY2, __version__, instrumentation
+from .address import (
+    Address,
+    country_names,
+    process_record,
+    subdivision_names,
+    subdivision_record
+)
+from .cli import result_errors
+from .metrics import (
+    CONTENT_TYPE,
+    Histogram,
+    MetricsRecorder,
+    MetricsWriter,
+    format_value,
+    render_metrics
+)
+from .territory import (
+    normalize_territory_code,
+    supported_country_codes,
+    supported_subdivision_codes
+)
+
+if PY2:
+    import Queue as queue
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+else:
+    import queue
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+OPERATIONS = ('normalize', 'validate', 'render')
+
+# Upper bounds of buckets of the histogram of batch sizes.
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Tells a worker thread to exit.
+STOP = object()
+
+
+def warm_up():
+    """ Load pycountry databases, and build all tables and records used to
+    normalize, validate and render addresses.
+
+    :return: Time spent, in seconds.
+    """
+    start = time.time()
+    supported_country_codes()
+    country_names()
+    subdivision_names()
+    for subdivision_code in supported_subdivision_codes():
+        normalize_territory_code(subdivision_code)
+        subdivision_record(subdivision_code)
+    Address(
+        line1='10, avenue des Champs Elysées', postal_code='75008',
+        city_name='Paris', country_code='FR').render()
+    return time.time() - start
+
+
+def result_document(result, operation):
+    """ Serialize a ``BatchResult`` to a JSON-compatible dictionary. """
+    document = {
+        'status': result.status,
+        'fields': result.fields,
+        'errors': result_errors(result)}
+    if operation == 'render':
+        document['rendered'] = (
+            result.address.render() if result.address is not None else None)
+    return document
+
+
+class PendingRecord(object):
+    """ A record waiting for its result. """
+
+    __slots__ = ('record', 'operation', 'done', 'result', 'error')
+
+    def __init__(self, record, operation):
+        self.record = record
+        self.operation = operation
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchProcessor(object):
+    """ Pool of worker threads processing queued records by micro-batches.
+
+    Each worker takes all records queued at once, up to ``batch_size``, and
+    waits up to ``batch_delay`` seconds for more before processing them back
+    to back.
+
+    At most ``max_pending`` records are queued or being processed at any
+    time. Records of a submission are queued all together or not at all.
+    """
+
+    def __init__(
+            self, strict=True, workers=4, batch_size=100, batch_delay=0.002,
+            max_pending=10000):
+        if workers < 1 or batch_size < 1 or max_pending < 1:
+            raise ValueError(
+                "Number of workers, batch size and queue size must be "
+                "positive.")
+        self.strict = strict
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue = queue.Queue()
+        self.max_pending = max_pending
+        self.pending = 0
+        self.capacity = threading.Condition()
+        self.lock = threading.Lock()
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.threads = [
+            threading.Thread(target=self.work, name='postal-address-worker')
+            for _ in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """ Stop workers once all queued records are processed. """
+        started = [thread for thread in self.threads if thread.ident]
+        for _ in started:
+            self.queue.put(STOP)
+        for thread in started:
+            thread.join()
+
+    def submit(self, records, operation, timeout=None):
+        """ Queue records and wait for their results.
+
+        :raise queue.Full: If there was no room for all records within
+            ``timeout`` seconds. None of the records are processed then.
+        :return: A list of result documents, one per record.
+        """
+        pending = [PendingRecord(record, operation) for record in records]
+        self.reserve(len(pending), timeout)
+        for item in pending:
+            self.queue.put(item)
+        results = []
+        for item in pending:
+            item.done.wait()
+            if item.error is not None:
+                raise item.error
+            results.append(item.result)
+        return results
+
+    def reserve(self, count, timeout=None):
+        """ Wait for room for ``count`` more pending records, and take it.
+
+        :raise queue.Full: If there is still no room after ``timeout``
+            seconds, or if ``count`` exceeds ``max_pending``.
+        """
+        if count > self.max_pending:
+            raise queue.Full
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.capacity:
+            while self.pending + count > self.max_pending:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise queue.Full
+                self.capacity.wait(remaining)
+            self.pending += count
+
+    def release(self, count):
+        """ Give back room for ``count`` pending records. """
+        with self.capacity:
+            self.pending -= count
+            self.capacity.notify_all()
+
+    def next_batch(self):
+        """ Wait for queued records and collect a batch of them. """
+        batch = [self.queue.get()]
+        deadline = time.time() + self.batch_delay
+        while batch[-1] is not STOP and len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def work(self):
+        """ Process batches of records until stopped. """
+        while True:
+            batch = self.next_batch()
+            stop = batch[-1] is STOP
+            if stop:
+                batch.pop()
+            if batch:
+                with self.lock:
+                    self.batch_sizes.observe(len(batch))
+            for item in batch:
+                try:
+                    result = process_record(
+                        item.record, strict=self.strict,
+                        validate=item.operation == 'validate')
+                    item.result = result_document(result, item.operation)
+                except Exception as expt:
+                    item.error = expt
+                item.done.set()
+            self.release(len(batch))
+            if stop:
+                return
+
+    def write_metrics(self, writer):
+        """ Write statistics of the queue and batches. """
+        writer.family(
+            'server_queued_records', 'gauge',
+            "Number of records waiting for a worker.")
+        writer.sample('server_queued_records', self.queue.qsize())
+        with self.lock:
+            buckets = self.batch_sizes.cumulative_counts()
+            total, count = self.batch_sizes.sum, self.batch_sizes.count
+        writer.family(
+            'server_batch_size', 'histogram',
+            "Number of records per batch processed by workers.")
+        for upper_bound, batch_count in buckets:
+            writer.sample('server_batch_size_bucket', batch_count, [
+                ('le', format_value(upper_bound))])
+        writer.sample('server_batch_size_sum', total)
+        writer.sample('server_batch_size_count', count)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ Route requests to the batch processor of the server. """
+
+    server_version = 'postal-address/{}'.format(__version__)
+
+    def send_body(self, code, body, content_type):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', '{}'.format(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count_response(self.path, code)
+
+    def send_json(self, code, document):
+        self.send_body(
+            code, json.dumps(document, sort_keys=True, ensure_ascii=False),
+            'application/json; charset=utf-8')
+
+    def send_error_json(self, code, message):
+        self.send_json(code, {'error': message})
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {
+                'status': 'ok',
+                'version': __version__,
+                'warm_up_time': self.server.warm_up_time})
+        elif self.path == '/metrics':
+            self.send_body(200, self.server.render_metrics(), CONTENT_TYPE)
+        elif self.path.lstrip('/') in OPERATIONS:
+            self.send_error_json(405, "Use POST.")
+        else:
+            self.send_error_json(404, "Unknown endpoint.")
+
+    def do_POST(self):
+        operation = self.path.lstrip('/')
+        if operation not in OPERATIONS:
+            self.send_error_json(404, "Unknown endpoint.")
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error_json(400, "Invalid Content-Length header.")
+            return
+        if length > self.server.max_body_size:
+            self.send_error_json(413, "Request body is too large.")
+            return
+        try:
+            document = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            self.send_error_json(400, "Request body is not valid JSON.")
+            return
+        single = isinstance(document, dict)
+        records = [document] if single else document
+        if not isinstance(records, list) or not all(
+                isinstance(record, dict) for record in records):
+            self.send_error_json(
+                400, "Expecting an object or a list of objects.")
+            return
+
+        try:
+            results = self.server.processor.submit(
+                records, operation, timeout=self.server.queue_timeout)
+        except queue.Full:
+            self.send_error_json(503, "Too many pending records.")
+            return
+        except Exception as expt:
+            # Keep details of internal errors out of responses.
+            self.log_error("Failed to process records: %r", expt)
+            self.send_error_json(500, "Internal error.")
+            return
+
+        if single:
+            result = results[0]
+            code = 422 if result['status'] == 'invalid' else 200
+            self.send_json(code, result)
+        else:
+            self.send_json(200, results)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def log_error(self, format, *args):
+        # Quiet mode only silences requests, errors are always logged.
+        BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class AddressServer(ThreadingMixIn, HTTPServer):
+    """ HTTP server of address normalization, validation and rendering.
+
+    Tables are warmed up before the socket is bound. Set ``port`` to 0 to let
+    the system pick a free port, available in ``server_address`` afterwards.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+            self, host='127.0.0.1', port=8080, strict=True, workers=4,
+            batch_size=100, batch_delay=0.002, max_pending=10000,
+            queue_timeout=1, max_body_size=2 ** 20, quiet=False):
+        self.warm_up_time = warm_up()
+        self.processor = BatchProcessor(
+            strict=strict, workers=workers, batch_size=batch_size,
+            batch_delay=batch_delay, max_pending=max_pending)
+        self.queue_timeout = queue_timeout
+        self.max_body_size = max_body_size
+        self.quiet = quiet
+        self.responses = {}
+        self.responses_lock = threading.Lock()
+        self.recorder = None
+        HTTPServer.__init__(self, (host, port), RequestHandler)
+        # Only take over global instrumentation once the socket is bound.
+        self.recorder = instrumentation.enable(MetricsRecorder())
+        self.processor.start()
+
+    def count_response(self, path, code):
+        with self.responses_lock:
+            key = (path, code)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def render_metrics(self):
+        """ Render library and service metrics in the Prometheus format. """
+        writer = MetricsWriter()
+        with self.responses_lock:
+            responses = sorted(self.responses.items())
+        writer.family(
+            'server_responses_total', 'counter',
+            "Number of HTTP responses, by endpoint and status code.")
+        for (path, code), count in responses:
+            # Do not let arbitrary paths blow up the number of series.
+            if path.lstrip('/') not in OPERATIONS + ('health', 'metrics'):
+                path = 'other'
+            writer.sample('server_responses_total', count, [
+                ('path', path), ('code', code)])
+        self.processor.write_metrics(writer)
+        return render_metrics(self.recorder) + writer.render()
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.processor.stop()
+        if self.recorder is not None and \
+                instrumentation.RECORDER is self.recorder:
+            instrumentation.disable()
+
+
+def build_parser():
+    """ Build the parser of command line arguments. """
+    parser = argparse.ArgumentParser(
+        prog='postal-address-server',
+        description="Serve address normalization, validation and rendering "
+        "over HTTP.")
+    parser.add_argument(
+        '--host', default='127.0.0.1',
+        help="Interface to listen on. Defaults to 127.0.0.1.")
+    parser.add_argument(
+        '-p', '--port', type=int, default=8080,
+        help="Port to listen on. Defaults to 8080.")
+    parser.add_argument(
+        '-w', '--workers', type=int, default=4,
+        help="Number of worker threads. Defaults to 4.")
+    parser.add_argument(
+        '-b', '--batch-size', type=int, default=100,
+        help="Maximum number of records per batch. Defaults to 100.")
+    parser.add_argument(
+        '-d', '--batch-delay', type=float, default=0.002,
+        help="Time in seconds to wait for more records before processing an "
+        "incomplete batch. Defaults to 0.002.")
+    parser.add_argument(
+        '--max-pending', type=int, default=10000,
+        help="Maximum number of queued records. Defaults to 10000.")
+    parser.add_argument(
+        '--lax', action='store_true',
+        help="Non-strict normalization: subdivision-derived values take "
+        "precedence over user-provided fields.")
+    parser.add_argument(
+        '-q', '--quiet', action='store_true',
+        help="Do not log requests.")
+    parser.add_argument(
+        '--version', action='version',
+        version='%(prog)s {}'.format(__version__))
+    return parser
+
+
+def main(args=None):
+    """ Entry point of the ``postal-address-server`` command. """
+    options = build_parser().parse_args(args)
+    try:
+        server = AddressServer(
+            host=options.host, port=options.port, strict=not options.lax,
+            workers=options.workers, batch_size=options.batch_size,
+            batch_delay=options.batch_delay, max_pending=options.max_pending,
+            quiet=options.quiet)
+    except ValueError as expt:
+        raise SystemExit(expt)
+    host, port = server.server_address[:2]
+    print("Warmed up in {:.2f}s, listening on http://{}:{}/".format(
+        server.warm_up_time, host, port), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
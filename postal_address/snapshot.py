@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+u""" Compiled snapshot of the territory data we need from pycountry.
+
+Parsing pycountry's JSON databases is the main cost of a cold start. This
+module compiles all the territory data ``postal_address`` relies on into a
+single, compact binary file, which is read and decoded on first use.
+
+The snapshot is keyed to the fingerprint of the installed pycountry databases
+and of the running Python interpreter, and is transparently rebuilt when any of
+them changes.
+
+The snapshot can be compiled ahead of time, as part of a build step::
+
+    $ python -m postal_address.snapshot
+
+.. data:: SNAPSHOT_FORMAT
+
+    Version of the layout of the snapshot. Bump it on any change to the
+    structure produced by ``build_snapshot()``.
+
+.. data:: SNAPSHOT_ENV_VAR
+
+    Name of the environment variable overriding the location of the snapshot
+    file. Set it to an empty string to disable on-disk snapshots altogether.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import marshal
+import os
+import sys
+import tempfile
+from os import path
+
+from . import __version__
+from .cache import cached_lookup
+
+SNAPSHOT_FORMAT = 1
+
+SNAPSHOT_ENV_VAR = 'POSTAL_ADDRESS_SNAPSHOT'
+
+# Permissions of snapshot files, before applying the umask.
+SNAPSHOT_MODE = 0o644
+
+# pycountry databases the snapshot is compiled from.
+SOURCE_DATABASES = ('iso3166-1.json', 'iso3166-2.json')
+
+
+def default_snapshot_path():
+    """ Return the location of the snapshot file.
+
+    Defaults to a file in the user's cache directory, unless overridden by the
+    ``POSTAL_ADDRESS_SNAPSHOT`` environment variable. Returns ``None`` if
+    on-disk snapshots are disabled.
+    """
+    snapshot_path = os.environ.get(SNAPSHOT_ENV_VAR)
+    if snapshot_path is not None:
+        return snapshot_path or None
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or path.join(
+        path.expanduser('~'), '.cache')
+    # Marshal format is specific to each Python version.
+    return path.join(
+        cache_dir, 'postal-address',
+        'territories-py{}{}.bin'.format(*sys.version_info[:2]))
+
+
+def pycountry_database_dir():
+    """ Locate pycountry's databases without importing the package. """
+    try:
+        from importlib.util import find_spec
+    except ImportError:
+        # Python 2.
+        import imp
+        package_dir = imp.find_module('pycountry')[1]
+    else:
+        spec = find_spec('pycountry')
+        if spec is None:
+            raise ImportError("pycountry is not installed.")
+        package_dir = path.dirname(spec.origin)
+    return path.join(package_dir, 'databases')
+
+
+def fingerprint():
+    """ Return a key identifying the data the snapshot is compiled from.
+
+    Made of the snapshot format, the versions of Python and ``postal_address``,
+    and the size and modification time of each source database.
+    """
+    database_dir = pycountry_database_dir()
+    database_stats = []
+    for database in SOURCE_DATABASES:
+        stat = os.stat(path.join(database_dir, database))
+        database_stats.append((database, stat.st_size, int(stat.st_mtime)))
+    return (
+        SNAPSHOT_FORMAT, tuple(sys.version_info[:2]), __version__,
+        path.abspath(database_dir), tuple(database_stats))
+
+
+def build_snapshot():
+    """ Compile territory data from pycountry into plain, marshallable types.
+
+    Returns a dictionary with the following keys:
+
+    * ``fingerprint``: the result of ``fingerprint()``.
+    * ``countries``: tuple of ``(alpha_2, name, common_name)`` records.
+    * ``subdivisions``: tuple of ``(code, name, type, parent_code,
+      country_code)`` records.
+
+    Missing values are set to ``None``. Records are sorted by code.
+    """
+    from pycountry import countries, subdivisions
+    return {
+        'fingerprint': fingerprint(),
+        'countries': tuple(sorted(
+            (country.alpha_2, country.name,
+             getattr(country, 'common_name', None))
+            for country in countries)),
+        'subdivisions': tuple(sorted(
+            (subdiv.code, subdiv.name, subdiv.type,
+             subdiv.parent_code or None, subdiv.country_code)
+            for subdiv in subdivisions)),
+    }
+
+
+def current_umask():
+    """ Return the umask of the process. """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def write_snapshot(snapshot, snapshot_path):
+    """ Atomically write a snapshot to disk. """
+    snapshot_dir = path.dirname(snapshot_path)
+    if snapshot_dir and not path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=snapshot_dir or None)
+    try:
+        with os.fdopen(file_descriptor, 'wb') as temp_file:
+            marshal.dump(snapshot, temp_file)
+        # Temporary files are only readable by their owner. Snapshots
+        # compiled ahead of time must be readable by all users.
+        os.chmod(temp_path, SNAPSHOT_MODE & ~current_umask())
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, snapshot_path)
+        else:
+            # Python 2.
+            os.rename(temp_path, snapshot_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def read_snapshot(snapshot_path):
+    """ Read and decode a snapshot file.
+
+    Returns ``None`` if the file is missing or can't be decoded.
+    """
+    try:
+        with open(snapshot_path, 'rb') as snapshot_file:
+            return marshal.loads(snapshot_file.read())
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def compile_snapshot(snapshot_path=None):
+    """ Build the snapshot from pycountry and write it to disk.
+
+    :param snapshot_path: Destination file. Defaults to
+        ``default_snapshot_path()``.
+    :return: The freshly built snapshot.
+    """
+    snapshot_path = snapshot_path or default_snapshot_path()
+    snapshot = build_snapshot()
+    if snapshot_path:
+        write_snapshot(snapshot, snapshot_path)
+    return snapshot
+
+
+def load_snapshot(snapshot_path=None):
+    """ Return the territory snapshot, rebuilding it if stale.
+
+    Falls back to an in-memory snapshot if the file can't be written, as on
+    read-only file systems.
+    """
+    snapshot_path = snapshot_path or default_snapshot_path()
+    if not snapshot_path:
+        return build_snapshot()
+    snapshot = read_snapshot(snapshot_path)
+    if isinstance(snapshot, dict) and \
+            snapshot.get('fingerprint') == fingerprint():
+        return snapshot
+    snapshot = build_snapshot()
+    try:
+        write_snapshot(snapshot, snapshot_path)
+    except (IOError, OSError):
+        pass
+    return snapshot
+
+
+@cached_lookup()
+def territory_snapshot():
+    """ Return the territory snapshot of the current process. """
+    return load_snapshot()
+
+
+if __name__ == '__main__':
+    compile_snapshot()
+    print(default_snapshot_path())
@@ -48,6 +48,21 @@ u""" Utilities to normalize and reconcile territory codes.
 .. data:: REVERSE_MAPPING
 
    Reverse index of the SUBDIVISION_COUNTRIES mapping defined above.
+
+.. data:: DEFAULT_SUBDIVISIONS
+
+   Map country codes to their default subdivision code, derived from the
+   SUBDIVISION_COUNTRIES and COUNTRY_ALIAS_TO_SUBDIVISION mappings above.
+
+.. data:: ALIAS_MAPPINGS
+
+   All alias mappings defined above, which can be updated at runtime with
+   ``register_aliases()``.
+
+.. data:: ALIASES_GENERATION
+
+   Counter bumped each time alias mappings are updated, so values derived
+   from them can be invalidated.
 """
 
 from __future__ import (
@@ -57,19 +72,15 @@ from __future__ import (
     unicode_literals
 )
 
-from itertools import chain
-from operator import attrgetter
+import threading
+from itertools import chain, count
 
-from boltons.cacheutils import cached, LRI
-from pycountry import countries, subdivisions
+from . import PY3
+from .cache import alias_dependent_caches, cache_clear, cached_lookup
+from .snapshot import territory_snapshot
 
-from . import PY2
-
-if PY2:
-    from itertools import imap, ifilter
-else:
-    imap = map
-    ifilter = filter
+if PY3:
+    basestring = (str, bytes)
 
 FOREIGN_TERRITORIES_MAPPING = {
     'CC': 'AU',  # Cocos Island,                      Australian territory
@@ -192,14 +203,107 @@ def generate_mapping():
 REVERSE_MAPPING = generate_mapping()
 
 
-@cached(LRI())
+def generate_default_subdivisions():
+    """Build the index of default subdivisions of countries.
+
+    A default subdivision can be guessed only if there is a 1:1 mapping between
+    a country code and a subdivision code.
+
+    :return: A dictionary mapping country codes to subdivision codes.
+    """
+    # Build the reverse index of the subdivision/country alias mapping.
+    default_subdiv = {}
+    for subdiv_code, alias_code in SUBDIVISION_COUNTRIES.items():
+        # Skip non-country
+        if len(alias_code) == 2:
+            default_subdiv.setdefault(alias_code, set()).add(subdiv_code)
+
+    # Include countries directly mapping to a subdivision.
+    for alias_code, subdiv_code in COUNTRY_ALIAS_TO_SUBDIVISION.items():
+        default_subdiv.setdefault(alias_code, set()).add(subdiv_code)
+
+    return {
+        country_code: subdiv_codes.pop()
+        for country_code, subdiv_codes in default_subdiv.items()
+        if len(subdiv_codes) == 1}
+
+
+DEFAULT_SUBDIVISIONS = generate_default_subdivisions()
+
+ALIAS_MAPPINGS = (
+    FOREIGN_TERRITORIES_MAPPING,
+    COUNTRY_ALIASES,
+    SUBDIVISION_COUNTRIES,
+    SUBDIVISION_ALIASES,
+    RESERVED_COUNTRY_CODES,
+    COUNTRY_ALIAS_TO_SUBDIVISION,
+)
+
+# Serializes updates of alias mappings and of the indexes derived from them.
+ALIASES_LOCK = threading.RLock()
+
+ALIASES_GENERATION = 0
+
+
+def register_aliases(mapping, aliases):
+    """Register or override aliases at runtime.
+
+    All indexes and caches derived from alias mappings are rebuilt
+    consistently afterwards.
+
+    :param mapping: One of the alias mappings listed in ``ALIAS_MAPPINGS``,
+        like ``COUNTRY_ALIASES``.
+    :param aliases: A dictionary of alias codes and their targets. A ``None``
+        target removes the alias from the mapping.
+    """
+    if not any(mapping is alias_mapping for alias_mapping in ALIAS_MAPPINGS):
+        raise ValueError("Unrecognized alias mapping.")
+    with ALIASES_LOCK:
+        for alias_code, target_code in aliases.items():
+            alias_code = alias_code.strip().upper()
+            if target_code is None:
+                mapping.pop(alias_code, None)
+            else:
+                mapping[alias_code] = target_code.strip().upper()
+        rebuild_indexes()
+
+
+def replace_items(index, new_index):
+    """Update a dictionary in-place to the content of another.
+
+    New keys are added before stale ones are removed, so concurrent readers
+    never see an empty index.
+    """
+    index.update(new_index)
+    for key in set(index).difference(new_index):
+        del index[key]
+
+
+def rebuild_indexes():
+    """Recompute all indexes and caches derived from alias mappings.
+
+    Indexes are updated in-place, so references to them stay valid. Only
+    caches registered as ``alias_dependent`` are cleared.
+    """
+    global ALIASES_GENERATION
+    with ALIASES_LOCK:
+        reverse_mapping = generate_mapping()
+        default_subdivisions = generate_default_subdivisions()
+        replace_items(REVERSE_MAPPING, reverse_mapping)
+        replace_items(DEFAULT_SUBDIVISIONS, default_subdivisions)
+        cache_clear(*alias_dependent_caches())
+        # Bumped last, so values derived in the meantime are dropped too.
+        ALIASES_GENERATION += 1
+
+
+@cached_lookup(alias_dependent=True)
 def supported_territory_codes():
     """ Return a set of recognized territory codes.
     """
     return supported_country_codes().union(supported_subdivision_codes())
 
 
-@cached(LRI())
+@cached_lookup(alias_dependent=True)
 def supported_country_codes():
     """ Return a set of recognized country codes.
 
@@ -208,21 +312,52 @@ def supported_country_codes():
         * European Commision country code exceptions
     """
     return set(chain(
-        imap(attrgetter('alpha_2'), countries),
+        (record[0] for record in territory_snapshot()['countries']),
         # Include ISO and EC exceptions.
         COUNTRY_ALIASES.keys(),
         RESERVED_COUNTRY_CODES.keys(),
         COUNTRY_ALIAS_TO_SUBDIVISION.keys()))
 
 
-@cached(LRI())
+@cached_lookup()
 def supported_subdivision_codes():
     """ Return a set of recognized subdivision codes.
 
     Are supported:
         * ISO 3166-2 subdivision codes
     """
-    return set(imap(attrgetter('code'), subdivisions))
+    return set(record[0] for record in territory_snapshot()['subdivisions'])
+
+
+@cached_lookup(alias_dependent=True)
+def normalization_table():
+    """Precompute the normalized form of all supported territory codes.
+
+    Resolution of aliases is a chain of lookups in the mappings defined above.
+    This chain is resolved once for all, for each combination of the
+    ``resolve_aliases`` and ``resolve_top_country`` options of
+    ``normalize_territory_code()``.
+
+    :return: A dictionary mapping ``(resolve_aliases, resolve_top_country)``
+        tuples to a flat dictionary of territory codes and their targets.
+    """
+    table = {}
+    for resolve_aliases in (True, False):
+        for resolve_top_country in (True, False):
+            targets = table[resolve_aliases, resolve_top_country] = {}
+            for territory_code in supported_territory_codes():
+                # We resolve country aliases and subdivision aliases
+                # nevertheless since their keys does not exists in pycountry!
+                code = RESERVED_COUNTRY_CODES.get(
+                    territory_code, territory_code)
+                code = COUNTRY_ALIASES.get(code, code)
+                if resolve_aliases:
+                    code = SUBDIVISION_ALIASES.get(code, code)
+                    code = SUBDIVISION_COUNTRIES.get(code, code)
+                if resolve_top_country:
+                    code = territory_attachment(code)
+                targets[territory_code] = code
+    return table
 
 
 def normalize_territory_code(territory_code, resolve_aliases=True,
@@ -235,24 +370,62 @@ def normalize_territory_code(territory_code, resolve_aliases=True,
     :return: The resolved territory code.
     """
     territory_code = territory_code.strip().upper()
-    if territory_code not in supported_territory_codes():
+    code = normalization_table()[
+        bool(resolve_aliases), bool(resolve_top_country)].get(territory_code)
+    if code is None:
         raise ValueError(
             'Unrecognized {!r} territory code.'.format(territory_code))
+    return code
 
-    # We resolve country aliases and subdivision aliases
-    # nevertheless since their keys does not exists in pycountry!
-    territory_code = RESERVED_COUNTRY_CODES.get(territory_code,
-                                                territory_code)
-    territory_code = COUNTRY_ALIASES.get(territory_code,
-                                         territory_code)
-    if resolve_aliases:
-        territory_code = SUBDIVISION_ALIASES.get(
-            territory_code, territory_code)
-        territory_code = SUBDIVISION_COUNTRIES.get(
-            territory_code, territory_code)
-    if resolve_top_country:
-        territory_code = territory_attachment(territory_code)
-    return territory_code
+
+def normalize_territory_codes(territory_codes, resolve_aliases=True,
+                              resolve_top_country=False):
+    """Normalize a batch of strings into territory codes.
+
+    Each distinct value is resolved once, and its result broadcasted back to
+    all its occurrences. Unrecognized values don't raise any exception, but
+    are normalized to ``None`` and flagged in the returned validity mask.
+
+    :param territory_codes: Any iterable of strings, including NumPy arrays
+        and pandas series.
+    :param resolve_aliases: Trigger alias computation.
+    :param resolve_top_country: Trigger foreign country computation.
+    :return: A ``(codes, mask)`` tuple of resolved codes and booleans, each
+        with one item per input value. Both are lists, unless input is a NumPy
+        array or a pandas series, in which case they are of the same type.
+    """
+    resolved = {}
+    codes = []
+    for value in territory_codes:
+        try:
+            code = resolved[value]
+        except KeyError:
+            code = None
+            if isinstance(value, basestring):
+                try:
+                    code = normalize_territory_code(
+                        value, resolve_aliases=resolve_aliases,
+                        resolve_top_country=resolve_top_country)
+                except ValueError:
+                    pass
+            resolved[value] = code
+        except TypeError:
+            # Unhashable values can't be territory codes.
+            code = None
+        codes.append(code)
+    mask = [code is not None for code in codes]
+
+    # Produce results of the same kind as the input.
+    library = type(territory_codes).__module__.split('.')[0]
+    if library == 'numpy':
+        import numpy
+        return numpy.array(codes, dtype=object), numpy.array(mask, dtype=bool)
+    if library == 'pandas':
+        import pandas
+        index = territory_codes.index
+        return (pandas.Series(codes, index=index, dtype=object),
+                pandas.Series(mask, index=index, dtype=bool))
+    return codes, mask
 
 
 def territory_attachment(country_code):
@@ -266,6 +439,7 @@ def territory_attachment(country_code):
     return FOREIGN_TERRITORIES_MAPPING.get(country_code, country_code)
 
 
+@cached_lookup(maxsize=8192, alias_dependent=True)
 def country_from_subdivision(subdivision_code):
     """ Return the normalized country code from a subdivision code.
 
@@ -282,12 +456,13 @@ def country_from_subdivision(subdivision_code):
     if code in supported_country_codes():
         return code
 
-    # Try to extract country code from subdivision.
-    try:
-        subdiv = subdivisions.get(code=code)
-    except KeyError:
+    # Walk up the parent index of subdivisions to their country.
+    parent_index = territory_parent_index()
+    if code not in parent_index:
         return None
-    return subdiv.country_code
+    while code in parent_index:
+        code = parent_index[code]
+    return code
 
 
 def default_subdivision_code(country_code):
@@ -299,46 +474,54 @@ def default_subdivision_code(country_code):
     :param country_code: Country code to find subdivision for.
     :return: The subdivision key if found, None otherwise.
     """
-    # Build the reverse index of the subdivision/country alias mapping.
-    default_subdiv = {}
-    for subdiv_code, alias_code in SUBDIVISION_COUNTRIES.items():
-        # Skip non-country
-        if len(alias_code) == 2:
-            default_subdiv.setdefault(alias_code, set()).add(subdiv_code)
+    return DEFAULT_SUBDIVISIONS.get(country_code)
 
-    # Include countries directly mapping to a subdivision.
-    for alias_code, subdiv_code in COUNTRY_ALIAS_TO_SUBDIVISION.items():
-        default_subdiv.setdefault(alias_code, set()).add(subdiv_code)
 
-    default_subdivisions = default_subdiv.get(country_code)
+@cached_lookup()
+def territory_children_index():
+    """ Return the parent-to-children adjacency index of all territories.
+
+    Each country code is mapped to the frozenset of its top-level subdivision
+    codes, and each subdivision code to the frozenset of its direct children.
+    Territories without children are not indexed.
 
-    if default_subdivisions and len(default_subdivisions) == 1:
-        return default_subdivisions.pop()
-    return None
+    The index is built in a single pass over the subdivision snapshot, as
+    pycountry only expose the child-parent relationship upwards.
+    """
+    index = {}
+    for code, _, _, parent_code, country_code in territory_snapshot()[
+            'subdivisions']:
+        index.setdefault(parent_code or country_code, set()).add(code)
+    return {
+        code: frozenset(children_codes)
+        for code, children_codes in index.items()}
 
 
+@cached_lookup(
+    maxsize=1024, copy=set, alias_dependent=True)
 def territory_children_codes(territory_code, include_self=False):
     """ Return a set of subdivision codes from all sub-levels.
 
-    All returned codes are normalized, including self.
+    All returned codes are normalized, including self, but for subdivisions
+    of a country, which are returned as-is.
     """
     codes = set()
 
     code = normalize_territory_code(territory_code)
+    index = territory_children_index()
 
-    # We have a country code, look for matching subdivisions in one pass.
+    # We have a country code, walk down the whole hierarchy of its
+    # subdivisions.
     if code in supported_country_codes():
-        codes.update(imap(
-            attrgetter('code'),
-            ifilter(lambda subdiv: subdiv.country_code == code, subdivisions)))
+        pending_codes = [code]
+        while pending_codes:
+            children_codes = index.get(pending_codes.pop(), ())
+            codes.update(children_codes)
+            pending_codes.extend(children_codes)
 
-    # Engage the stupid per-level recursive brute-force search as pycountry
-    # only expose the child-parent relationship upwards.
+    # Normalize each child, and look for its own children.
     else:
-        direct_children_codes = set(imap(
-            attrgetter('code'),
-            ifilter(lambda subdiv: subdiv.parent_code == code, subdivisions)))
-        for child_code in direct_children_codes:
+        for child_code in index.get(code, ()):
             codes.update(
                 territory_children_codes(child_code, include_self=True))
 
@@ -348,6 +531,64 @@ def territory_children_codes(territory_code, include_self=False):
     return codes
 
 
+@cached_lookup()
+def territory_parent_index():
+    """ Return the child-to-parent index of all subdivisions.
+
+    Each subdivision code is mapped to the code of its direct parent, which is
+    either a subdivision or, for top-level subdivisions, a country.
+    """
+    return {
+        code: parent_code or country_code
+        for code, _, _, parent_code, country_code in territory_snapshot()[
+            'subdivisions']}
+
+
+@cached_lookup()
+def territory_intervals():
+    """ Return the Euler-tour numbering of the territory hierarchy.
+
+    Each country and subdivision code is mapped to an ``(enter, exit)`` pair of
+    integers, assigned while walking the tree depth-first. The interval of a
+    territory nests into the interval of each of its parents, so ancestry is
+    reduced to two integer comparisons.
+    """
+    index = territory_children_index()
+    intervals = {}
+    ticks = count()
+
+    def visit(code):
+        enter = next(ticks)
+        for child_code in sorted(index.get(code, ())):
+            visit(child_code)
+        intervals[code] = (enter, next(ticks))
+
+    # Hierarchy depth is a handful of levels at most, recursion is safe.
+    for country_record in territory_snapshot()['countries']:
+        visit(country_record[0])
+
+    return intervals
+
+
+def is_within(territory_code, ancestor_code):
+    """ Return ``True`` if a territory is part of another one.
+
+    Both codes are normalized the same way ``territory_parents()`` does, and a
+    territory is considered to be within itself. Which means this is a
+    constant-time equivalent of::
+
+        >>> ancestor_code in territory_parents_codes(territory_code)
+    """
+    intervals = territory_intervals()
+    enter, exit_ = intervals[normalize_territory_code(
+        COUNTRY_ALIAS_TO_SUBDIVISION.get(territory_code, territory_code))]
+    ancestor_enter, ancestor_exit = intervals[normalize_territory_code(
+        COUNTRY_ALIAS_TO_SUBDIVISION.get(ancestor_code, ancestor_code))]
+    return ancestor_enter <= enter and exit_ <= ancestor_exit
+
+
+@cached_lookup(
+    maxsize=4096, copy=list, alias_dependent=True)
 def territory_parents(territory_code, include_country=True):
     """ Return the whole hierarchy of territories, up to the country.
 
@@ -355,6 +596,8 @@ def territory_parents(territory_code, include_country=True):
     objects, starting from the provided territory and up its way to the top
     administrative territory (i.e. country).
     """
+    from pycountry import countries, subdivisions
+
     tree = []
 
     # Retrieving subdivision from alias to get full paternity
@@ -383,26 +626,39 @@ def territory_parents(territory_code, include_country=True):
     return tree
 
 
+@cached_lookup(maxsize=8192, alias_dependent=True)
 def territory_parents_codes(territory_code, include_country=True):
     """ Like territory_parents but return normalized codes instead of objects.
+
+    Codes are read from the precomputed parent index, without instantiating
+    nor introspecting any pycountry object. Returns a tuple.
     """
-    for territory in territory_parents(
-            territory_code, include_country=include_country):
-        full_class_name = '{}.{}'.format(
-            territory.__module__, territory.__class__.__name__)
-        if full_class_name == 'pycountry.db.Country':
-            yield territory.alpha_2
-        elif full_class_name == 'pycountry.db.Subdivision':
-            yield territory.code
-        else:
-            raise ValueError("Unrecognized {!r} territory.".format(territory))
+    # Retrieving subdivision from alias to get full paternity
+    code = normalize_territory_code(
+        COUNTRY_ALIAS_TO_SUBDIVISION.get(territory_code, territory_code))
 
+    codes = []
+    parent_index = territory_parent_index()
+    while code in parent_index:
+        codes.append(code)
+        code = parent_index[code]
 
+    # We're left with the country on top of the hierarchy.
+    if include_country:
+        codes.append(code)
+
+    return tuple(codes)
+
+
+@cached_lookup(maxsize=8192, alias_dependent=True)
 def country_aliases(territory_code):
     """ List valid country code aliases of a territory.
 
     Mainly used to check if a non-normalized country code can safely be
     replaced by its normalized form.
+
+    Results are memoized, including those of all the intermediate territories
+    walked through, and returned as frozensets.
     """
     country_codes = set()
 
@@ -413,17 +669,14 @@ def country_aliases(territory_code):
     # A subdivision code triggers a walk along the non-normalized parent tree
     # and look for aliases at each level.
     else:
-        subdiv = subdivisions.get(code=territory_code)
-        parent_code = subdiv.parent_code
-        if not parent_code:
-            parent_code = subdiv.country.alpha_2
-        country_codes.update(country_aliases(parent_code))
+        country_codes.update(
+            country_aliases(territory_parent_index()[territory_code]))
         # Adding subdivision's country alias
         if territory_code in SUBDIVISION_COUNTRIES:
-            country_codes.update({SUBDIVISION_COUNTRIES.get(territory_code)})
+            country_codes.add(SUBDIVISION_COUNTRIES[territory_code])
 
     # Hunt for aliases
     for mapped_code in REVERSE_MAPPING.get(territory_code, []):
         country_codes.update(country_aliases(mapped_code))
 
-    return country_codes
+    return frozenset(country_codes)
@@ -6,3 +6,25 @@
 # Licensed under the BSD 2-Clause License (the "License"); you may not use this
 # file except in compliance with the License. You may obtain a copy of the
 # License at http://opensource.org/licenses/BSD-2-Clause
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import atexit
+import os
+import shutil
+import tempfile
+from os import path
+
+from postal_address.snapshot import SNAPSHOT_ENV_VAR
+
+# Keep the territory snapshot compiled during tests out of the user's cache
+# directory. Child processes spawned by tests inherit the location.
+if SNAPSHOT_ENV_VAR not in os.environ:
+    SNAPSHOT_DIR = tempfile.mkdtemp(prefix='postal-address-tests-')
+    atexit.register(shutil.rmtree, SNAPSHOT_DIR, True)
+    os.environ[SNAPSHOT_ENV_VAR] = path.join(SNAPSHOT_DIR, 'territories.bin')
@@ -15,18 +15,41 @@ from __future__ import (
     unicode_literals
 )
 
+import copy
+import os
+import pickle
+import random
+import re
+import subprocess
 import sys
 import textwrap
+import threading
 import unittest
 from decimal import Decimal
 
 from pycountry import countries, subdivisions
 
-from postal_address.address import Address, InvalidAddress, random_address
+from postal_address.address import (
+    Address,
+    InvalidAddress,
+    country_names,
+    normalize_many,
+    normalize_postal_code,
+    random_address,
+    random_addresses,
+    seeded_faker_instance,
+    subdivision_names,
+    subdivision_record,
+    subdivision_type_id,
+    validate_many
+)
 from postal_address.territory import (
+    SUBDIVISION_COUNTRIES,
+    register_aliases,
     supported_country_codes,
-    supported_territory_codes,
-    supported_subdivision_codes)
+    supported_subdivision_codes,
+    supported_territory_codes
+)
 
 
 class TestAddressIO(unittest.TestCase):
@@ -113,6 +136,276 @@ class TestAddressIO(unittest.TestCase):
         with self.assertRaises(AttributeError):
             self.assertIsNone(address.state_name)
 
+    def test_compact_storage(self):
+        address = Address(
+            line1='31, place du Théatre',
+            postal_code='59000',
+            city_name='Lille',
+            subdivision_code='FR-59')
+        self.assertFalse(hasattr(address, '__dict__'))
+        with self.assertRaises(AttributeError):
+            address.unknown_attribute = 'Blah blah blah'
+
+        # Metadata of a new subdivision replace the old ones.
+        self.assertEquals(address.metropolitan_region_area_code, 'FR-HDF')
+        address.subdivision_code = 'FR-75'
+        address.city_name = 'Paris'
+        address.normalize()
+        self.assertEquals(address.metropolitan_region_area_code, 'FR-IDF')
+        address.subdivision_code = None
+        address.normalize()
+        self.assertEquals(len(address), 6)
+        with self.assertRaises(AttributeError):
+            address.metropolitan_region_area_code
+
+    def test_copy(self):
+        address = Address(
+            line1='1 Infinite Loop',
+            postal_code='95014',
+            city_name='Cupertino',
+            subdivision_code='US-CA')
+        clone = copy.copy(address)
+        self.assertEquals(dict(clone.items()), dict(address.items()))
+        self.assertEquals(clone.state_name, 'California')
+
+        # Deletion of metadata does not leak to copies.
+        del clone['state_name']
+        self.assertEquals(address.state_name, 'California')
+
+        # Addresses without metadata can be pickled.
+        address = Address(
+            line1='10, avenue des Champs Elysées',
+            postal_code='75008',
+            city_name='Paris',
+            country_code='FR')
+        clone = pickle.loads(pickle.dumps(address))
+        self.assertEquals(dict(clone.items()), dict(address.items()))
+
+        # Subdivision metadata are restored from shared records.
+        address = Address(
+            line1='1 Infinite Loop',
+            postal_code='95014',
+            city_name='Cupertino',
+            subdivision_code='US-CA')
+        clone = pickle.loads(pickle.dumps(address))
+        self.assertEquals(dict(clone.items()), dict(address.items()))
+        self.assertIs(clone._metadata, address._metadata)
+        del address['state_type_name']
+        clone = pickle.loads(pickle.dumps(address))
+        self.assertEquals(dict(clone.items()), dict(address.items()))
+        self.assertNotIn('state_type_name', clone)
+
+    def test_derived_values_cache(self):
+        calls = []
+
+        class CountingAddress(Address):
+            __slots__ = ()
+
+            def check_required_fields(self):
+                calls.append(None)
+                return super(CountingAddress, self).check_required_fields()
+
+        address = CountingAddress(
+            line1='1 Infinite Loop',
+            postal_code='95014',
+            city_name='Cupertino',
+            subdivision_code='US-CA')
+        self.assertTrue(address.valid)
+        self.assertTrue(address.valid)
+        repr(address)
+        address.validate()
+        self.assertEquals(len(calls), 1)
+        self.assertIs(address.country, address.country)
+
+        # Setting a field to its current value or renormalizing an already
+        # normalized address keeps cached values.
+        address.city_name = 'Cupertino'
+        address.normalize()
+        self.assertTrue(address.valid)
+        self.assertEquals(len(calls), 1)
+
+        # Cached values are dropped on field changes.
+        del address['city_name']
+        self.assertFalse(address.valid)
+        self.assertEquals(
+            address.check_fields()[0], set(['city_name']))
+        address['city_name'] = 'Cupertino'
+        self.assertTrue(address.valid)
+        self.assertEquals(len(calls), 3)
+
+        # Cached results are protected against alterations by callers.
+        address.check_fields()[0].add('line1')
+        self.assertEquals(address.check_fields()[0], set())
+
+        # Cached values are dropped on registration of territory aliases.
+        lille = Address(
+            line1='31, place du Théatre',
+            postal_code='59000',
+            city_name='Lille',
+            subdivision_code='FR-59')
+        self.assertTrue(lille.valid)
+        try:
+            register_aliases(SUBDIVISION_COUNTRIES, {'FR-59': 'MC'})
+            self.assertFalse(lille.valid)
+        finally:
+            register_aliases(SUBDIVISION_COUNTRIES, {'FR-59': None})
+        self.assertTrue(lille.valid)
+
+        # Territory-derived values follow subdivision changes.
+        self.assertEquals(address.subdivision_name, 'California')
+        address.subdivision_code = 'US-NY'
+        self.assertEquals(address.subdivision_name, 'New York')
+        address.country_code = 'FR'
+        self.assertEquals(address.country_name, 'France')
+        self.assertFalse(address.valid)
+
+    def test_territory_names(self):
+        # Tables are consistent with pycountry.
+        self.assertEquals(len(country_names()), len(countries))
+        for country in countries:
+            names = country_names()[country.alpha_2]
+            self.assertEquals(names.name, country.name)
+            self.assertEquals(
+                names.display_name,
+                getattr(country, 'common_name', country.name))
+            self.assertIsNone(names.type_id)
+        self.assertEquals(len(subdivision_names()), len(subdivisions))
+        for subdivision in subdivisions:
+            names = subdivision_names()[subdivision.code]
+            self.assertEquals(names.name, subdivision.name)
+            self.assertEquals(names.type_name, subdivision.type)
+            self.assertEquals(
+                names.type_id, subdivision_type_id(subdivision))
+
+        address = Address(
+            line1='1 Infinite Loop',
+            postal_code='95014',
+            city_name='Cupertino',
+            subdivision_code='US-CA')
+        self.assertEquals(address.country_name, 'United States')
+        self.assertEquals(address.subdivision_name, 'California')
+        self.assertEquals(address.subdivision_type_name, 'State')
+        self.assertEquals(address.subdivision_type_id, 'state')
+
+        # Unknown codes have no names.
+        address = Address(line1='1 Infinite Loop', country_code='TW')
+        address['country_code'] = 'ZZ'
+        self.assertIsNone(address.country_name)
+        address['subdivision_code'] = 'ZZ-ZZ'
+        self.assertIsNone(address.subdivision_name)
+        self.assertIsNone(address.subdivision_type_id)
+
+    def test_incremental_normalization(self):
+        """ Incremental renormalization is equivalent to a full one. """
+        random.seed(2)
+        values = {
+            'line1': [
+                None, '', '  ', '1 Infinite  Loop ', '31, rue Nationale'],
+            'line2': [None, ' ', 'Building  B', 'Floor 3 '],
+            'postal_code': [None, '', '95014', ' 59000 ', '75-008 ', '#$%'],
+            'city_name': [None, '', 'Cupertino', 'Paris ', 'Lille'],
+            'country_code': [None, '', 'US', 'fr', 'GF', 'ZZ', 'UK'],
+            'subdivision_code': [
+                None, '', 'US-CA', 'fr-59', 'FR-GF', 'FR-75', 'GB-ENG',
+                'ZZ-ZZ']}
+        field_ids = sorted(values)
+
+        for _ in range(30):
+            for strict in (True, False):
+                try:
+                    address = Address(strict=strict, **{
+                        field_id: random.choice(values[field_id])
+                        for field_id in field_ids})
+                except InvalidAddress:
+                    continue
+
+                for _ in range(10):
+                    for _ in range(random.randint(1, 2)):
+                        field_id = random.choice(field_ids)
+                        address[field_id] = random.choice(values[field_id])
+
+                    # Copies are fully normalized.
+                    reference = copy.copy(address)
+                    self.assertIsNone(reference._changes)
+                    try:
+                        reference.normalize(strict=strict)
+                    except InvalidAddress as expected:
+                        with self.assertRaises(InvalidAddress) as context:
+                            address.normalize(strict=strict)
+                        self.assertEquals(
+                            str(context.exception), str(expected))
+                        break
+                    address.normalize(strict=strict)
+                    self.assertEquals(
+                        dict(address.items()), dict(reference.items()))
+                    self.assertEquals(address.valid, reference.valid)
+
+    def test_normalization_dependencies(self):
+        address = Address(
+            line1='1 Infinite Loop',
+            postal_code='95014',
+            city_name='Cupertino',
+            subdivision_code='US-CA')
+        self.assertEquals(address._changes, frozenset())
+
+        address.line2 = ' Building  B '
+        self.assertEquals(address._changes, frozenset(['line2']))
+        record_cache_info = subdivision_record.cache_info()
+        address.normalize()
+        self.assertEquals(address.line2, 'Building B')
+        # Territory data were not looked up.
+        self.assertEquals(
+            subdivision_record.cache_info(), record_cache_info)
+        self.assertEquals(address._changes, frozenset())
+
+        address.subdivision_code = 'US-NY'
+        address.normalize()
+        self.assertEquals(address.state_name, 'New York')
+        self.assertGreater(
+            subdivision_record.cache_info().hits
+            + subdivision_record.cache_info().misses,
+            record_cache_info.hits + record_cache_info.misses)
+
+        # Removal of metadata triggers a full normalization.
+        del address['state_name']
+        self.assertIsNone(address._changes)
+        address.normalize()
+        self.assertEquals(address.state_name, 'New York')
+
+    def test_shared_metadata(self):
+        address1 = Address(
+            line1='31, place du Théatre',
+            postal_code='59000',
+            city_name='Lille',
+            subdivision_code='FR-59')
+        address2 = Address(
+            line1='1, rue de la République',
+            postal_code='59800',
+            city_name='Lille',
+            subdivision_code='FR-59')
+        self.assertEquals(
+            subdivision_record('FR-59').fields, {'country_code': 'FR'})
+        self.assertEquals(
+            subdivision_record('FR-59').country_codes, {'FR'})
+        self.assertIs(address1._metadata, address2._metadata)
+        self.assertIs(address1._metadata, subdivision_record('FR-59').metadata)
+
+        # Records are read-only.
+        if sys.version_info.major > 2:
+            with self.assertRaises(TypeError):
+                subdivision_record('FR-59').metadata['city'] = None
+
+        # Deletion of metadata does not leak to other addresses.
+        del address1['metropolitan_region_name']
+        self.assertEquals(
+            address2.metropolitan_region_name, 'Hauts-de-France')
+
+        self.assertEquals(
+            subdivision_record('GB-LND').fields,
+            {'country_code': 'GB', 'city_name': 'London, City of'})
+        self.assertEquals(
+            subdivision_record('US-GU').country_codes, {'GU', 'US'})
+
     def test_dict_access(self):
         address = Address(
             line1='10, avenue des Champs Elysées',
@@ -308,6 +601,55 @@ class TestAddressIO(unittest.TestCase):
             address.validate()
             address.render()
 
+    def test_random_addresses(self):
+        """ Test reproducibility of bulk generation of random addresses. """
+        addresses = list(random_addresses(120, seed=42, chunk_size=50))
+        self.assertEquals(len(addresses), 120)
+        for address in addresses:
+            address.validate()
+        renders = [address.render() for address in addresses]
+
+        self.assertEquals(renders, [
+            address.render() for address in random_addresses(
+                120, seed=42, chunk_size=50, processes=2)])
+        self.assertNotEqual(renders, [
+            address.render() for address in random_addresses(
+                120, seed=43, chunk_size=50)])
+
+        # Addresses don't depend on the iteration order of sets, which
+        # changes with the hash seed of each Python process.
+        script = (
+            "from postal_address.address import random_addresses; "
+            "print(repr([address.render() for address in random_addresses("
+            "120, seed=42, chunk_size=50)]))")
+        output = subprocess.check_output([sys.executable, '-c', script])
+        self.assertEquals(output.decode('utf-8').strip(), repr(renders))
+
+        addresses = list(random_addresses(10, locales=['fr_FR'], seed=1))
+        self.assertEquals(len(addresses), 10)
+
+        # Faker instances are built once per locale, not once per chunk.
+        misses = seeded_faker_instance.cache_info().misses
+        list(random_addresses(30, locales=['fr_FR'], seed=2, chunk_size=10))
+        self.assertEquals(seeded_faker_instance.cache_info().misses, misses)
+
+        # Generators with the same seed don't interfere with each other,
+        # even when run concurrently.
+        def generate(results):
+            results.extend(address.render() for address in random_addresses(
+                100, locales=['fr_FR'], seed=7, chunk_size=100))
+        expected = []
+        generate(expected)
+        concurrent = [[], []]
+        threads = [
+            threading.Thread(target=generate, args=(results, ))
+            for results in concurrent]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(concurrent, [expected, expected])
+
 
 class TestAddressValidation(unittest.TestCase):
 
@@ -515,6 +857,37 @@ class TestAddressValidation(unittest.TestCase):
             country_code='FR')
         self.assertEqual(address.postal_code, 'AAA 77B')
 
+    def test_normalize_postal_code(self):
+        self.assertEqual(normalize_postal_code(None), None)
+        self.assertEqual(normalize_postal_code(''), None)
+        self.assertEqual(normalize_postal_code(' - * - '), None)
+        self.assertEqual(normalize_postal_code('ec1a  1hq'), 'EC1A 1HQ')
+        self.assertEqual(normalize_postal_code(' f - 75008'), 'F-75008')
+        # Python 2 does not expand the sharp S on upper-casing.
+        if sys.version_info.major > 2:
+            self.assertEqual(normalize_postal_code('straße 1'), 'STRASSE 1')
+        self.assertEqual(normalize_postal_code('3☾Ă🐎ȁ'), '3')
+        self.assertEqual(
+            normalize_postal_code(['f-75008', None, '**']),
+            ['F-75008', None, None])
+        self.assertEqual(normalize_postal_code(iter(['a1'])), ['A1'])
+
+        # Results must match the regular expression based pipeline.
+        def reference(postal_code):
+            postal_code = re.compile(r'[^A-Z0-9 -]').sub(
+                '', postal_code.upper())
+            postal_code = re.compile(r'[^A-Z0-9]*-+[^A-Z0-9]*').sub(
+                '-', postal_code).strip('-')
+            return ' '.join(postal_code.split()) or None
+
+        rng = random.Random(42)
+        alphabet = 'aZ09 -_*/\t\nßéĂ🐎\u3000'
+        for _ in range(2000):
+            postal_code = ''.join(
+                rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+            self.assertEqual(
+                normalize_postal_code(postal_code), reference(postal_code))
+
     def test_blank_line_swap(self):
         address = Address(
             line1='',
@@ -792,6 +1165,27 @@ class TestAddressValidation(unittest.TestCase):
 
         self.assertEquals(address.country_code, 'GB')
 
+    def test_subdivision_conflict_order(self):
+        # Country and city both conflict with the subdivision. The reported
+        # conflict must not depend on the order of hashed collections.
+        script = textwrap.dedent("""
+            from postal_address.address import Address, InvalidAddress
+            try:
+                Address(
+                    line1='1 rue de la Paix', postal_code='75002',
+                    city_name='Paris', country_code='FR',
+                    subdivision_code='GB-LND')
+            except InvalidAddress as expt:
+                print(sorted(expt.inconsistent_fields), expt.extra_msg)
+            """)
+        outputs = set()
+        for seed in ('0', '1', '2', '3'):
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            outputs.add(subprocess.check_output(
+                [sys.executable, '-c', script], env=env))
+        self.assertEquals(len(outputs), 1)
+        self.assertIn(b"'country_code'", outputs.pop())
+
     def test_subdivision_derived_country(self):
         address = Address(
             line1='Senate House',
@@ -922,6 +1316,55 @@ class TestAddressValidation(unittest.TestCase):
         self.assertEqual(address.country_name, 'Taiwan')
         self.assertEqual(address.subdivision_code, 'TW-TNN')
 
+    def test_batch_validation(self):
+        records = [
+            # Valid.
+            {'line1': '10, avenue des Champs Elysées',
+             'postal_code': '75008', 'city_name': 'Paris',
+             'country_code': 'FR'},
+            # Missing city.
+            {'line1': '10, avenue des Champs Elysées',
+             'postal_code': '75008', 'country_code': 'FR'},
+            # Unknown country.
+            {'line1': '1 rue de la Paix', 'postal_code': '75002',
+             'city_name': 'Paris', 'country_code': 'ZZ'},
+            # Inconsistent subdivision and country.
+            {'line1': '1 rue de la Paix', 'postal_code': '75002',
+             'city_name': 'Paris', 'country_code': 'FR',
+             'subdivision_code': 'US-GA'},
+            # Unrecognized field.
+            {'line1': '1 rue de la Paix', 'dummy_field': 'dummy'},
+            # Non-string value.
+            {'line1': '1 rue de la Paix', 'postal_code': 75002},
+        ]
+        results = list(validate_many(iter(records)))
+        self.assertEqual(
+            [result.status for result in results],
+            ['valid', 'invalid', 'invalid', 'invalid', 'invalid', 'invalid'])
+
+        self.assertEqual(results[0].fields['country_code'], 'FR')
+        self.assertIsInstance(results[0].address, Address)
+        self.assertEqual(results[1].required_fields, set(['city_name']))
+        # Unknown territory codes are reset by normalization.
+        self.assertEqual(results[2].required_fields, set(['country_code']))
+        self.assertIsNone(results[3].address)
+        self.assertEqual(
+            results[3].inconsistent_fields,
+            set([('country_code', 'subdivision_code')]))
+        self.assertEqual(list(results[4].invalid_fields), ['dummy_field'])
+        self.assertEqual(list(results[5].invalid_fields), ['postal_code'])
+
+        # Batch results are consistent with single-address validation.
+        for record, result in zip(records[:3], results):
+            address = Address(**record)
+            self.assertEqual(result.status == 'valid', address.valid)
+
+        # Normalization only.
+        results = list(normalize_many(records[:3]))
+        self.assertEqual(
+            [result.status for result in results], ['normalized'] * 3)
+        self.assertIsNone(results[2].fields['country_code'])
+
     def test_all_country_codes(self):
         """ Validate & render random addresses with all supported countries.
         """
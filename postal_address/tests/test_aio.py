@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+""" Tests of the ``aio`` module.
+
+Written without ``async`` syntax, so this module can still be collected by
+Python versions lacking it.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import sys
+import unittest
+
+from postal_address.address import normalize_many, validate_many
+from postal_address.tests.test_frame import RECORDS
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+
+    from postal_address.aio import (
+        AsyncBatchIterator,
+        normalize_many_async,
+        validate_many_async
+    )
+else:  # pragma: no cover
+    asyncio = None
+
+
+def collect(iterator, limit=None):
+    """ Iterate asynchronously over results, up to an optional limit. """
+    loop = asyncio.new_event_loop()
+    results = []
+    try:
+        while limit is None or len(results) < limit:
+            try:
+                results.append(
+                    loop.run_until_complete(iterator.__anext__()))
+            except StopAsyncIteration:
+                break
+        loop.run_until_complete(iterator.aclose())
+    finally:
+        loop.close()
+    return results
+
+
+def result_fields(results):
+    """ Comparable summary of ``BatchResult``, without address objects. """
+    return [result[:-1] for result in results]
+
+
+class SlowSource(object):
+    """ Asynchronous iterable of records, with a pause before each one.
+
+    Keeps track of the number of records pulled from it.
+    """
+
+    def __init__(self, records, pause=0):
+        self.records = iter(records)
+        self.pause = pause
+        self.pulled = 0
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        try:
+            record = next(self.records)
+        except StopIteration:
+            raise StopAsyncIteration
+        self.pulled += 1
+        future = asyncio.Future()
+        asyncio.get_event_loop().call_later(
+            self.pause, future.set_result, record)
+        return future
+
+
+def failing_records():
+    yield RECORDS[0]
+    raise RuntimeError("Source failure.")
+
+
+@unittest.skipIf(asyncio is None, "Requires Python 3.5 or newer.")
+class TestAsyncBatches(unittest.TestCase):
+
+    records = RECORDS * 20
+
+    def test_same_as_sync(self):
+        for strict in (True, False):
+            self.assertEqual(
+                result_fields(collect(validate_many_async(
+                    self.records, strict=strict, batch_size=7))),
+                result_fields(validate_many(self.records, strict=strict)))
+            self.assertEqual(
+                result_fields(collect(normalize_many_async(
+                    self.records, strict=strict, batch_size=7))),
+                result_fields(normalize_many(self.records, strict=strict)))
+
+    def test_async_source(self):
+        source = SlowSource(RECORDS, pause=0.001)
+        self.assertEqual(
+            result_fields(collect(validate_many_async(
+                source, batch_size=3, batch_delay=0.1))),
+            result_fields(validate_many(RECORDS)))
+        self.assertEqual(source.pulled, len(RECORDS))
+
+    def test_process_executor(self):
+        with ProcessPoolExecutor(2) as executor:
+            results = collect(validate_many_async(
+                self.records, batch_size=10, executor=executor))
+        self.assertEqual(
+            result_fields(results), result_fields(validate_many(self.records)))
+        self.assertEqual(
+            results[0].address.render(), next(validate_many(
+                self.records)).address.render())
+
+    def test_backpressure(self):
+        source = SlowSource(self.records)
+        results = collect(AsyncBatchIterator(
+            source, batch_size=5, max_in_flight=2), limit=1)
+        self.assertEqual(len(results), 1)
+        # Only a few batches are pulled from the source when the consumer
+        # stalls: the ones in flight, plus those waiting in queues.
+        self.assertLess(source.pulled, 5 * 6)
+
+    def test_source_failure(self):
+        iterator = validate_many_async(failing_records())
+        with self.assertRaises(RuntimeError):
+            collect(iterator)
+
+    def test_bad_parameters(self):
+        with self.assertRaises(ValueError):
+            AsyncBatchIterator([], batch_size=0)
+        self.assertEqual(collect(AsyncBatchIterator([])), [])
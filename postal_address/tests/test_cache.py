@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import threading
+import unittest
+
+from postal_address.cache import (
+    CACHES,
+    CacheInfo,
+    LookupCache,
+    cache_clear,
+    cache_info,
+    cached_lookup,
+    set_cache_size
+)
+from postal_address.territory import (
+    COUNTRY_ALIASES,
+    REVERSE_MAPPING,
+    country_aliases,
+    register_aliases,
+    supported_subdivision_codes,
+    territory_children_codes,
+    territory_parents
+)
+
+
+class TestLookupCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = LookupCache('test', maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # 'b' is now the least recently used key.
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.info(), CacheInfo(
+            hits=3, misses=1, evictions=1, maxsize=2, currsize=2))
+
+        cache.resize(1)
+        self.assertEqual(cache.info().evictions, 2)
+        self.assertEqual(cache.get('c'), 3)
+
+        cache.clear()
+        self.assertEqual(cache.info(), CacheInfo(
+            hits=0, misses=0, evictions=0, maxsize=1, currsize=0))
+
+    def test_disabled_cache(self):
+        cache = LookupCache('test', maxsize=0)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        self.assertEqual(cache.info().currsize, 0)
+
+    def test_unbounded_cache(self):
+        cache = LookupCache('test')
+        for key in range(1000):
+            cache.set(key, key)
+        self.assertEqual(cache.info().currsize, 1000)
+        self.assertEqual(cache.info().evictions, 0)
+
+
+class TestCachedLookup(unittest.TestCase):
+
+    def tearDown(self):
+        CACHES.pop('double', None)
+
+    def test_decorator(self):
+        calls = []
+
+        @cached_lookup(maxsize=10, copy=list)
+        def double(value, twice=True):
+            calls.append(value)
+            return [value * 2 if twice else value]
+
+        self.assertIs(CACHES['double'], double.cache)
+        self.assertEqual(double(1), [2])
+        self.assertEqual(double(1), [2])
+        self.assertEqual(double(1, twice=False), [1])
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(double.cache_info().hits, 1)
+        self.assertEqual(double.cache_info().misses, 2)
+
+        # Callers get copies of cached values.
+        double(1).append(42)
+        self.assertEqual(double(1), [2])
+
+        double.cache_clear()
+        self.assertEqual(double.cache_info().currsize, 0)
+
+    def test_threads(self):
+        @cached_lookup(maxsize=50)
+        def double(value):
+            return value * 2
+
+        errors = []
+
+        def worker():
+            for value in range(200):
+                if double(value % 100) != (value % 100) * 2:
+                    errors.append(value)
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        info = double.cache_info()
+        self.assertEqual(info.hits + info.misses, 16 * 200)
+        self.assertEqual(info.currsize, 50)
+        # Concurrent misses of the same key only store one value.
+        self.assertGreaterEqual(info.misses - info.evictions, info.currsize)
+
+    def test_concurrent_misses(self):
+        started = threading.Event()
+        proceed = threading.Event()
+
+        @cached_lookup()
+        def new_list(value):
+            started.set()
+            proceed.wait()
+            return [value]
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(new_list(1)))
+            for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        started.wait()
+        proceed.set()
+        for thread in threads:
+            thread.join()
+        # Both callers get the first stored result.
+        self.assertIs(results[0], results[1])
+        self.assertEqual(new_list.cache_info().currsize, 1)
+
+
+class TestTerritoryCaches(unittest.TestCase):
+
+    def test_registry(self):
+        for name in [
+                'supported_territory_codes', 'supported_country_codes',
+                'supported_subdivision_codes', 'normalization_table',
+                'territory_children_codes', 'territory_parents',
+                'country_from_subdivision', 'country_aliases']:
+            self.assertIn(name, cache_info())
+            self.assertIsInstance(cache_info()[name], CacheInfo)
+
+    def test_cache_clear(self):
+        country_aliases('FR-59')
+        self.assertTrue(cache_info()['country_aliases'].currsize)
+        cache_clear('country_aliases')
+        self.assertEqual(cache_info()['country_aliases'].currsize, 0)
+        self.assertEqual(country_aliases('FR-59'), {'FR'})
+        cache_clear()
+        self.assertEqual(cache_info()['country_aliases'].currsize, 0)
+        self.assertEqual(country_aliases('FR-59'), {'FR'})
+
+    def test_alias_dependent_caches(self):
+        supported_subdivision_codes()
+        country_aliases('FR-59')
+        register_aliases(COUNTRY_ALIASES, {'ZZ': None})
+        # Only caches depending on alias mappings are cleared.
+        self.assertTrue(cache_info()['supported_subdivision_codes'].currsize)
+        self.assertEqual(cache_info()['country_aliases'].currsize, 0)
+        self.assertTrue(CACHES['country_aliases'].alias_dependent)
+        self.assertFalse(CACHES['territory_snapshot'].alias_dependent)
+        self.assertEqual(REVERSE_MAPPING['UK'], {'GB'})
+
+    def test_lookup_during_alias_registration(self):
+        started = threading.Event()
+        proceed = threading.Event()
+
+        @cached_lookup(alias_dependent=True)
+        def alias_codes():
+            codes = frozenset(COUNTRY_ALIASES)
+            started.set()
+            proceed.wait()
+            return codes
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(alias_codes()))
+        try:
+            thread.start()
+            # The lookup reads alias mappings before the registration, but
+            # completes after it.
+            started.wait()
+            register_aliases(COUNTRY_ALIASES, {'ZZ': 'FR'})
+            proceed.set()
+            thread.join()
+            self.assertNotIn('ZZ', results[0])
+            # The stale result was not cached.
+            self.assertEqual(alias_codes.cache_info().currsize, 0)
+            self.assertIn('ZZ', alias_codes())
+        finally:
+            proceed.set()
+            register_aliases(COUNTRY_ALIASES, {'ZZ': None})
+            CACHES.pop('alias_codes', None)
+
+    def test_set_cache_size(self):
+        try:
+            set_cache_size('territory_parents', 1)
+            territory_parents('FR-59')
+            territory_parents('FR-75')
+            info = cache_info()['territory_parents']
+            self.assertEqual(info.maxsize, 1)
+            self.assertEqual(info.currsize, 1)
+        finally:
+            set_cache_size('territory_parents', 4096)
+
+    def test_mutable_results(self):
+        territory_children_codes('GQ-I').add('FR')
+        self.assertNotIn('FR', territory_children_codes('GQ-I'))
+        territory_parents('FR-59').append(None)
+        self.assertEqual(len(territory_parents('FR-59')), 3)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import io
+import json
+import shutil
+import sys
+import tempfile
+import unittest
+from os import path
+
+from postal_address.cli import main, open_file, read_records
+
+CSV_INPUT = """id,line1,postal_code,city_name,country_code
+1,"10, avenue des Champs Elysées",75008,Paris,fr
+2,1 rue de la Paix,75002,,FR
+3,1600 Pennsylvania Ave NW,20500,Washington,US
+"""
+
+
+class TestCLI(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, name, content):
+        file_path = path.join(self.temp_dir, name)
+        with io.open(file_path, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+        return file_path
+
+    def read_file(self, name):
+        with io.open(
+                path.join(self.temp_dir, name), encoding='utf-8') as stream:
+            return stream.read()
+
+    def read_csv(self, name):
+        """ Read rows of a CSV file, the same way the CLI does. """
+        stream = open_file(path.join(self.temp_dir, name), 'r')
+        try:
+            return list(read_records(stream, 'csv')[1])
+        finally:
+            stream.close()
+
+    def test_csv(self):
+        input_path = self.write_file('input.csv', CSV_INPUT)
+        for workers in ('1', '2'):
+            main([input_path, '--quiet', '--workers', workers,
+                  '--chunk-size', '1',
+                  '--output', path.join(self.temp_dir, 'output.csv'),
+                  '--rejects', path.join(self.temp_dir, 'rejects.csv')])
+
+            output = self.read_csv('output.csv')
+            self.assertEqual([row['id'] for row in output], ['1', '3'])
+            self.assertEqual(output[0]['country_code'], 'FR')
+            self.assertEqual(output[0]['line2'], '')
+
+            rejects = self.read_csv('rejects.csv')
+            self.assertEqual([row['id'] for row in rejects], ['2'])
+            self.assertEqual(
+                json.loads(rejects[0]['errors']),
+                {'required_fields': ['city_name']})
+
+    def test_jsonl(self):
+        input_path = self.write_file('input.jsonl', '\n'.join([
+            json.dumps({'id': 1, 'line1': '1 rue de la Paix',
+                        'postal_code': '75002', 'city_name': 'Paris',
+                        'country_code': 'FR', 'subdivision_code': 'US-GA'}),
+            json.dumps({'id': 2, 'line1': '1 rue de la Paix',
+                        'postal_code': 75002}),
+            json.dumps({'id': 3, 'line1': '1 rue de la Paix',
+                        'postal_code': '75002', 'city_name': 'Paris',
+                        'country_code': 'fr'}),
+        ]))
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            main([input_path, '--workers', '2', '--unordered',
+                  '--output', path.join(self.temp_dir, 'output.jsonl'),
+                  '--rejects', path.join(self.temp_dir, 'rejects.jsonl')])
+            stats = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertIn('3 records read, 1 accepted, 2 rejected', stats)
+
+        output = [json.loads(line)
+                  for line in self.read_file('output.jsonl').splitlines()]
+        self.assertEqual(len(output), 1)
+        self.assertEqual(output[0]['id'], 3)
+        self.assertEqual(output[0]['country_code'], 'FR')
+
+        rejects = {
+            record['id']: record['errors'] for record in map(
+                json.loads, self.read_file('rejects.jsonl').splitlines())}
+        self.assertEqual(
+            rejects[1]['inconsistent_fields'],
+            [['country_code', 'subdivision_code']])
+        self.assertEqual(
+            rejects[2]['invalid_fields'], {'postal_code': 75002})
+
+    def test_unparsable_lines(self):
+        input_path = self.write_file('input.jsonl', '\n'.join([
+            json.dumps({'id': 1, 'line1': '1 rue de la Paix',
+                        'postal_code': '75002', 'city_name': 'Paris',
+                        'country_code': 'fr'}),
+            '{"id": 2, "line1": ',
+            json.dumps(['dummy']),
+            json.dumps({'id': 4, 'line1': '1 rue de la Paix',
+                        'postal_code': '75002', 'city_name': 'Paris',
+                        'country_code': 'fr'}),
+        ]))
+        for workers in ('1', '2'):
+            main([input_path, '--quiet', '--workers', workers,
+                  '--chunk-size', '2',
+                  '--output', path.join(self.temp_dir, 'output.jsonl'),
+                  '--rejects', path.join(self.temp_dir, 'rejects.jsonl')])
+
+            output = [json.loads(line) for line in self.read_file(
+                'output.jsonl').splitlines()]
+            self.assertEqual([record['id'] for record in output], [1, 4])
+
+            rejects = [json.loads(line) for line in self.read_file(
+                'rejects.jsonl').splitlines()]
+            self.assertEqual(
+                [record['line'] for record in rejects],
+                ['{"id": 2, "line1": ', '["dummy"]'])
+            self.assertEqual(
+                rejects[1]['errors'], {'parse_error': "Not a JSON object."})
+            self.assertIn('parse_error', rejects[0]['errors'])
+
+    def test_extra_cells(self):
+        input_path = self.write_file('input.csv', CSV_INPUT.replace(
+            '2,1 rue de la Paix,75002,,FR',
+            '2,1 rue de la Paix,75002,Paris,FR,dummy,dummy'))
+        main([input_path, '--quiet',
+              '--output', path.join(self.temp_dir, 'output.csv'),
+              '--rejects', path.join(self.temp_dir, 'rejects.csv')])
+
+        output = self.read_csv('output.csv')
+        self.assertEqual([row['id'] for row in output], ['1', '3'])
+
+        rejects = self.read_csv('rejects.csv')
+        self.assertEqual([row['id'] for row in rejects], ['2'])
+        self.assertEqual(rejects[0]['city_name'], 'Paris')
+        self.assertEqual(
+            json.loads(rejects[0]['errors']),
+            {'parse_error': "2 more cells than columns."})
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import random
+import unittest
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+from postal_address.address import Address, InvalidAddress, random_address
+from postal_address.frame import AddressFrame, map_distinct
+
+RECORDS = [
+    # Valid.
+    {'line1': '10, avenue des Champs Elysées', 'postal_code': '75008',
+     'city_name': 'Paris', 'country_code': 'fr'},
+    # Missing city, blank line.
+    {'line1': '  ', 'line2': ' 1   rue de la Paix ', 'postal_code': '75002 ',
+     'country_code': 'FR'},
+    # Unknown country.
+    {'line1': '1 rue de la Paix', 'postal_code': '75002',
+     'city_name': 'Paris', 'country_code': 'ZZ'},
+    # Country derived from subdivision.
+    {'line1': '1600 Pennsylvania Ave NW', 'postal_code': '20500',
+     'city_name': 'Washington', 'subdivision_code': 'us-dc'},
+    # Subdivision of a foreign territory.
+    {'line1': '1 rue du Port', 'postal_code': '97300',
+     'city_name': 'Cayenne', 'country_code': 'FR',
+     'subdivision_code': 'FR-GF'},
+    # Country with a default subdivision.
+    {'line1': '1 rue du Port', 'postal_code': '97300',
+     'city_name': 'Cayenne', 'country_code': 'GF'},
+    # Conflicting subdivision.
+    {'line1': '1 rue de la Paix', 'postal_code': '75002',
+     'city_name': 'Paris', 'country_code': 'FR',
+     'subdivision_code': 'US-GA'},
+    # Empty.
+    {},
+]
+
+
+class TestAddressFrame(unittest.TestCase):
+
+    def assert_same_as_addresses(self, records, strict=True):
+        frame = AddressFrame.from_records(records, strict=strict)
+        self.assertEqual(len(frame), len(records))
+        statuses = frame.check_fields()
+        rendered = frame.render()
+        frame_records = frame.to_records()
+        for row, record in enumerate(records):
+            try:
+                address = Address(strict=strict, **record)
+            except InvalidAddress as expt:
+                self.assertIsNotNone(frame.errors[row])
+                self.assertEqual(
+                    statuses[row][2], expt.inconsistent_fields)
+                continue
+            self.assertIsNone(frame.errors[row])
+            self.assertEqual(frame_records[row], dict(address.items()))
+            self.assertEqual(statuses[row], address.check_fields())
+            if address.valid:
+                self.assertEqual(rendered[row], address.render())
+
+    def test_same_as_addresses(self):
+        self.assert_same_as_addresses(RECORDS)
+        self.assert_same_as_addresses(RECORDS, strict=False)
+
+    def test_alias_only_country_codes(self):
+        # Codes like TA are territory aliases, but not countries.
+        records = [
+            {'line1': '1 Main Road', 'postal_code': 'TDCU 1ZZ',
+             'city_name': 'Edinburgh of the Seven Seas',
+             'subdivision_code': 'TA'},
+            {'line1': '1 Main Road', 'postal_code': 'TDCU 1ZZ',
+             'city_name': 'Edinburgh of the Seven Seas',
+             'country_code': 'TA'}]
+        for strict in (True, False):
+            self.assert_same_as_addresses(records, strict=strict)
+
+    def test_same_as_random_addresses(self):
+        random.seed(1)
+        records = []
+        for _ in range(50):
+            address = random_address()
+            records.append({
+                field_id: address[field_id]
+                for field_id in Address.BASE_FIELD_IDS})
+        self.assert_same_as_addresses(records)
+
+    def test_valid_mask(self):
+        frame = AddressFrame.from_records(RECORDS)
+        self.assertEqual(
+            frame.valid(),
+            [True, False, False, True, True, True, False, False])
+        self.assertEqual(frame['country_code'][:2], ['FR', 'FR'])
+        self.assertEqual(frame['line1'][1], '1 rue de la Paix')
+
+    def test_map_distinct(self):
+        calls = []
+
+        def upper(value):
+            calls.append(value)
+            return value.upper()
+
+        self.assertEqual(
+            map_distinct(upper, ['a', 'b', 'a', 'a']), ['A', 'B', 'A', 'A'])
+        self.assertEqual(calls, ['a', 'b'])
+
+    def test_bad_columns(self):
+        with self.assertRaises(KeyError):
+            AddressFrame({'dummy_field': ['dummy']})
+        with self.assertRaises(ValueError):
+            AddressFrame({'line1': ['a', 'b'], 'city_name': ['c']})
+        with self.assertRaises(TypeError):
+            AddressFrame({'postal_code': [75002]})
+        self.assertEqual(len(AddressFrame()), 0)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed.")
+    def test_numpy_columns(self):
+        frame = AddressFrame({
+            'line1': numpy.array(['1 rue de la Paix', 'b'], dtype=object),
+            'postal_code': numpy.array(['75002', numpy.nan], dtype=object),
+            'city_name': numpy.array(['Paris', 'c'], dtype=object),
+            'country_code': numpy.array(['FR', 'FR'], dtype=object)})
+        mask = frame.valid()
+        self.assertIsInstance(mask, numpy.ndarray)
+        self.assertEqual(mask.tolist(), [True, False])
+        self.assertIsNone(frame['postal_code'][1])
+
+    @unittest.skipIf(pandas is None, "pandas is not installed.")
+    def test_mixed_columns(self):
+        columns = {
+            'line1': ['1 rue de la Paix', 'b'],
+            'postal_code': numpy.array(['75002', None], dtype=object),
+            'city_name': pandas.Series(['Paris', 'c'], index=[3, 4]),
+            'country_code': numpy.array(['FR', 'FR'], dtype=object)}
+        # The kind of results doesn't depend on the order of columns.
+        for field_ids in (sorted(columns), sorted(columns, reverse=True)):
+            frame = AddressFrame(
+                OrderedDict((field_id, columns[field_id])
+                            for field_id in field_ids))
+            mask = frame.valid()
+            self.assertIsInstance(mask, pandas.Series)
+            self.assertEqual(list(mask.index), [3, 4])
+            self.assertEqual(mask.tolist(), [True, False])
+        del columns['city_name']
+        self.assertIsInstance(AddressFrame(columns).valid(), numpy.ndarray)
+
+    @unittest.skipIf(pandas is None, "pandas is not installed.")
+    def test_pandas_dataframe(self):
+        dataframe = pandas.DataFrame(
+            [{field_id: record.get(field_id)
+              for field_id in Address.BASE_FIELD_IDS}
+             for record in RECORDS],
+            index=range(10, 10 + len(RECORDS)))
+        frame = AddressFrame(dataframe)
+        mask = frame.valid()
+        self.assertIsInstance(mask, pandas.Series)
+        self.assertEqual(list(mask.index), list(dataframe.index))
+        self.assertEqual(
+            mask.tolist(), AddressFrame.from_records(RECORDS).valid())
+        self.assertIsInstance(frame.render(), pandas.Series)
+        normalized = frame.to_pandas()
+        self.assertEqual(normalized['country_code'][10], 'FR')
+
+    @unittest.skipIf(pandas is None, "pandas is not installed.")
+    def test_pandas_string_dtype(self):
+        dataframe = pandas.DataFrame(
+            [{field_id: record.get(field_id)
+              for field_id in Address.BASE_FIELD_IDS}
+             for record in RECORDS]).astype('string')
+        # Missing values are pandas.NA.
+        self.assertTrue(dataframe['line2'].isna().any())
+        frame = AddressFrame(dataframe)
+        self.assertIsNone(frame['line2'][0])
+        self.assertEqual(
+            frame.valid().tolist(), AddressFrame.from_records(RECORDS).valid())
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from os import path
+
+from postal_address.snapshot import SNAPSHOT_ENV_VAR, compile_snapshot
+
+# Time budget in seconds of a bare ``import postal_address``. Measured at
+# around 20 ms on a laptop, so this leaves room for slow CI workers.
+IMPORT_TIME_BUDGET = 0.2
+
+# Dependencies that are only allowed to load on first use.
+LAZY_MODULES = frozenset(['faker', 'pycountry', 'boltons.strutils'])
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.time()
+import postal_address
+elapsed = time.time() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+VALIDATION_PROBE = """
+import json
+from postal_address.address import Address
+for fields in [
+        dict(line1='1 rue de la Paix', postal_code='75002', city_name='Paris',
+             country_code='fr'),
+        dict(line1='1 Infinite Loop', postal_code='95014',
+             city_name='Cupertino', subdivision_code='US-CA'),
+        dict(line1='1 rue de la Paix', postal_code='75002', city_name='Paris',
+             country_code='ZZ', subdivision_code='ZZ-01')]:
+    address = Address(strict=False, **fields)
+    address.valid
+    address.render()
+import pycountry
+print(json.dumps({
+    "countries": pycountry.countries._is_loaded,
+    "subdivisions": pycountry.subdivisions._is_loaded}))
+"""
+
+
+class TestImport(unittest.TestCase):
+
+    def setUp(self):
+        # Probes must not depend on the state of the user's snapshot cache.
+        self.temp_dir = tempfile.mkdtemp()
+        snapshot_path = path.join(self.temp_dir, 'snapshot.bin')
+        compile_snapshot(snapshot_path)
+        self.environ = dict(os.environ)
+        self.environ[SNAPSHOT_ENV_VAR] = snapshot_path
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_probe(self, probe):
+        """ Run a probe in a fresh interpreter and decode its report. """
+        output = subprocess.check_output(
+            [sys.executable, '-c', probe], env=self.environ)
+        return json.loads(output.decode('utf-8'))
+
+    def probe_import(self):
+        """ Import the package in a fresh interpreter and report on it. """
+        return self.run_probe(IMPORT_PROBE)
+
+    def test_lazy_dependencies(self):
+        loaded_modules = set(self.probe_import()['modules'])
+        self.assertFalse(LAZY_MODULES.intersection(loaded_modules))
+
+    def test_snapshot_validation(self):
+        # Normalization, validation and rendering only rely on the territory
+        # snapshot, not on pycountry's databases.
+        self.assertEqual(
+            self.run_probe(VALIDATION_PROBE),
+            {'countries': False, 'subdivisions': False})
+
+    def test_import_time(self):
+        # Keep the best of a few runs to smooth out noise.
+        elapsed = min(self.probe_import()['elapsed'] for _ in range(3))
+        self.assertLess(elapsed, IMPORT_TIME_BUDGET)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import unittest
+from functools import partial
+from itertools import count
+
+from postal_address import instrumentation
+from postal_address.address import Address, InvalidAddress
+from postal_address.instrumentation import (
+    STAGES,
+    Recorder,
+    StageStats,
+    instrumented
+)
+
+
+def new_address():
+    return Address(
+        line1='1 Infinite Loop',
+        postal_code='95014',
+        city_name='Cupertino',
+        subdivision_code='US-CA')
+
+
+class TickingRecorder(Recorder):
+    """ Recorder with a clock ticking by one second on each reading. """
+
+    def __init__(self):
+        self.clock = partial(next, count())
+        self.records = []
+
+    def record(self, stage, elapsed):
+        self.records.append((stage, elapsed))
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_disabled(self):
+        self.assertIsNone(instrumentation.RECORDER)
+        stats = StageStats()
+        new_address().validate()
+        self.assertEqual(
+            set(report.calls for report in stats.report()['stages'].values()),
+            set([0]))
+
+    def test_stage_stats(self):
+        with instrumented() as stats:
+            self.assertIs(instrumentation.RECORDER, stats)
+            for _ in range(3):
+                new_address().validate()
+        self.assertIsNone(instrumentation.RECORDER)
+
+        report = stats.report()
+        self.assertEqual(list(report['stages']), list(STAGES))
+        for stage in STAGES:
+            self.assertEqual(report['stages'][stage].calls, 3)
+            self.assertGreaterEqual(report['stages'][stage].total_time, 0)
+        # Subdivision records are computed once, then shared.
+        self.assertGreaterEqual(report['caches']['subdivision_record'], 2 / 3)
+
+        stats.reset()
+        self.assertEqual(stats.report()['stages'][STAGES[0]].calls, 0)
+
+    def test_custom_recorder(self):
+        recorder = TickingRecorder()
+        with instrumented(recorder):
+            address = new_address()
+            # Incremental normalization skips territory stages.
+            address.line2 = 'Building B'
+            address.normalize()
+            address.validate()
+        self.assertEqual(
+            [stage for stage, _ in recorder.records],
+            list(STAGES[:7]) + list(STAGES[:3]) + list(STAGES[7:]))
+        # Each stage is timed between two ticks of the clock.
+        self.assertEqual(
+            set(elapsed for _, elapsed in recorder.records), set([1]))
+
+    def test_base_recorder(self):
+        # The base recorder ignores everything.
+        with instrumented(Recorder()):
+            new_address().validate()
+            with self.assertRaises(InvalidAddress):
+                Address(line1='1 Infinite Loop', postal_code='95014',
+                        city_name='Cupertino', country_code='FR',
+                        subdivision_code='US-CA')
+
+    def test_nested_contexts(self):
+        with instrumented() as outer:
+            with instrumented() as inner:
+                new_address()
+            self.assertIs(instrumentation.RECORDER, outer)
+            new_address()
+        self.assertEqual(
+            inner.report()['stages']['normalize.postal_code'].calls, 1)
+        self.assertEqual(
+            outer.report()['stages']['normalize.postal_code'].calls, 1)
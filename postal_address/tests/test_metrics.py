@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import re
+import unittest
+
+from postal_address import instrumentation, metrics
+from postal_address.address import Address, InvalidAddress
+from postal_address.cache import cache_info
+from postal_address.instrumentation import instrumented
+from postal_address.metrics import Histogram, MetricsRecorder, render_metrics
+
+SAMPLE_LINE = re.compile(
+    r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? '
+    r'(\+Inf|[0-9.e+-]+)$')
+
+
+def parse_samples(text):
+    """ Return a mapping of sample names with labels to values. """
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('#'):
+            continue
+        name, value = line.rsplit(' ', 1)
+        samples[name] = float(value)
+    return samples
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(1, 0.1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 2.65)
+        self.assertEqual(
+            histogram.cumulative_counts(),
+            [(0.1, 2), (1, 3), (float('inf'), 4)])
+
+    def test_text_format(self):
+        with instrumented(MetricsRecorder()) as recorder:
+            Address(line1='1 rue de la Paix', city_name='Paris',
+                    postal_code='75002', country_code='FR').validate()
+        text = render_metrics(recorder)
+        self.assertTrue(text.endswith('\n'))
+        families = set()
+        for line in text.splitlines():
+            if line.startswith('# TYPE '):
+                name = line.split()[2]
+                self.assertNotIn(name, families)
+                families.add(name)
+            elif not line.startswith('# HELP '):
+                self.assertRegexpMatches(line, SAMPLE_LINE)
+        self.assertIn('postal_address_validate_duration_seconds', families)
+
+    def test_cache_metrics(self):
+        # Cache metrics are available without any recorder.
+        self.assertIsNone(instrumentation.RECORDER)
+        samples = parse_samples(render_metrics())
+        for name, info in cache_info().items():
+            self.assertEqual(
+                samples['postal_address_cache_hits_total'
+                        '{{cache="{}"}}'.format(name)], info.hits)
+            self.assertEqual(
+                samples['postal_address_cache_size'
+                        '{{cache="{}"}}'.format(name)], info.currsize)
+        self.assertNotIn('postal_address_normalizations_total', samples)
+
+    def test_operations(self):
+        recorder = metrics.enable()
+        try:
+            self.assertIs(instrumentation.RECORDER, recorder)
+            address = Address(
+                line1='1 rue de la Paix', city_name='Paris',
+                postal_code='75002', country_code='FR')
+            self.assertTrue(address.valid)
+            # Validations served from the cache are counted too.
+            address.validate()
+            address.check_fields()
+            address.city_name = None
+            with self.assertRaises(InvalidAddress):
+                address.validate()
+            with self.assertRaises(InvalidAddress):
+                Address(line1='1 rue de la Paix', city_name='Paris',
+                        postal_code='75002', country_code='FR',
+                        subdivision_code='US-GA')
+        finally:
+            instrumentation.disable()
+
+        samples = parse_samples(render_metrics(recorder))
+        self.assertEqual(samples['postal_address_normalizations_total'], 2)
+        self.assertEqual(samples['postal_address_validations_total'], 4)
+        self.assertEqual(samples[
+            'postal_address_validate_duration_seconds_count'], 4)
+        self.assertEqual(samples[
+            'postal_address_invalid_addresses_total'
+            '{operation="validate",reason="required"}'], 1)
+        self.assertEqual(samples[
+            'postal_address_invalid_addresses_total'
+            '{operation="validate",reason="inconsistent"}'], 0)
+        self.assertEqual(samples[
+            'postal_address_invalid_addresses_total'
+            '{operation="normalize",reason="inconsistent"}'], 1)
+        self.assertEqual(samples[
+            'postal_address_normalize_duration_seconds_bucket{le="+Inf"}'], 2)
+        self.assertEqual(samples[
+            'postal_address_normalize_duration_seconds_count'], 2)
+        self.assertEqual(samples[
+            'postal_address_stage_calls_total'
+            '{stage="validate.check_required_fields"}'], 2)
+
+        recorder.reset()
+        samples = parse_samples(render_metrics(recorder))
+        self.assertEqual(samples['postal_address_normalizations_total'], 0)
+
+    def test_repeated_valid_reads(self):
+        address = Address(
+            line1='1 rue de la Paix', city_name='Paris',
+            postal_code='75002', country_code='FR')
+        self.assertTrue(address.valid)
+        with instrumented(MetricsRecorder()) as recorder:
+            for _ in range(5):
+                self.assertTrue(address.valid)
+        samples = parse_samples(render_metrics(recorder))
+        self.assertEqual(samples['postal_address_validations_total'], 5)
+        self.assertEqual(samples[
+            'postal_address_validate_duration_seconds_count'], 5)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import unittest
+
+from postal_address.parallel import iter_chunks, map_chunks
+
+
+def double(chunk):
+    return [item * 2 for item in chunk]
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_map_chunks(self):
+        chunks = list(iter_chunks(range(10), 3))
+        self.assertEqual(chunks, [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]])
+        expected = [double(chunk) for chunk in chunks]
+        self.assertEqual(list(map_chunks(double, chunks)), expected)
+        self.assertEqual(
+            list(map_chunks(double, iter(chunks), workers=2, max_pending=1)),
+            expected)
+        self.assertEqual(
+            sorted(map_chunks(double, chunks, workers=2, ordered=False)),
+            expected)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import json
+import socket
+import sys
+import threading
+import unittest
+
+from postal_address import PY2, instrumentation, server
+from postal_address.address import Address, validate_many
+from postal_address.server import AddressServer, BatchProcessor
+from postal_address.tests.test_frame import RECORDS
+
+if PY2:
+    import Queue as queue
+    from urllib2 import HTTPError, Request, urlopen
+else:
+    import queue
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+
+class TestServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = AddressServer(
+            port=0, workers=2, batch_delay=0.05, quiet=True)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+        assert instrumentation.RECORDER is None
+
+    def request(self, path, document=None, data=None, headers=None):
+        """ Return the status code and decoded body of a response. """
+        if document is not None:
+            data = json.dumps(document).encode('utf-8')
+        try:
+            response = urlopen(
+                Request(self.url + path, data=data, headers=headers or {}))
+        except HTTPError as expt:
+            response = expt
+        body = response.read().decode('utf-8')
+        if response.headers['Content-Type'].startswith('application/json'):
+            body = json.loads(body)
+        return response.code, body
+
+    def test_health(self):
+        code, body = self.request('/health')
+        self.assertEqual(code, 200)
+        self.assertEqual(body['status'], 'ok')
+        self.assertGreater(body['warm_up_time'], 0)
+
+    def test_single_record(self):
+        code, body = self.request('/validate', RECORDS[0])
+        self.assertEqual(code, 200)
+        self.assertEqual(body['status'], 'valid')
+        self.assertEqual(body['fields']['country_code'], 'FR')
+        self.assertEqual(body['errors'], {})
+
+        code, body = self.request('/validate', RECORDS[1])
+        self.assertEqual(code, 422)
+        self.assertEqual(body['errors'], {'required_fields': ['city_name']})
+
+        code, body = self.request('/render', RECORDS[0])
+        self.assertEqual(code, 200)
+        self.assertEqual(body['rendered'], Address(**RECORDS[0]).render())
+
+    def test_batch_request(self):
+        code, body = self.request('/validate', RECORDS)
+        self.assertEqual(code, 200)
+        self.assertEqual(
+            [(result['status'], result['fields']) for result in body],
+            [(result.status, result.fields)
+             for result in validate_many(RECORDS)])
+
+        code, body = self.request('/normalize', RECORDS)
+        self.assertEqual(code, 200)
+        self.assertNotIn('valid', [result['status'] for result in body])
+
+    def test_coalescing(self):
+        before = self.server.processor.batch_sizes.count
+        results = []
+
+        def client():
+            results.append(self.request('/validate', RECORDS[0])[0])
+        clients = [threading.Thread(target=client) for _ in range(20)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+
+        self.assertEqual(results, [200] * 20)
+        self.assertLess(self.server.processor.batch_sizes.count - before, 20)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.request('/validate', data=b'{')[0], 400)
+        self.assertEqual(self.request('/validate', ['dummy'])[0], 400)
+        self.assertEqual(self.request('/validate')[0], 405)
+        self.assertEqual(self.request('/dummy', {})[0], 404)
+        self.assertEqual(self.request('/dummy')[0], 404)
+        # The body is rejected on its announced length, before being read.
+        self.assertEqual(self.request('/validate', data=b'{}', headers={
+            'Content-Length': '{}'.format(2 ** 20 + 1)})[0], 413)
+        self.assertEqual(self.request('/validate', data=b'{}', headers={
+            'Content-Length': '-1'})[0], 400)
+        self.assertEqual(self.request('/validate', data=b'{}', headers={
+            'Content-Length': 'dummy'})[0], 400)
+        code, body = self.request('/validate', {'line1': 1})
+        self.assertEqual(code, 422)
+        self.assertEqual(body['errors']['invalid_fields'], {'line1': 1})
+
+    def test_internal_error(self):
+        def failing_process_record(*args, **kwargs):
+            raise KeyError('FR')
+
+        class Log(list):
+            write = list.append
+
+            def flush(self):
+                pass
+
+        process_record = server.process_record
+        server.process_record = failing_process_record
+        stderr, sys.stderr = sys.stderr, Log()
+        try:
+            code, body = self.request('/validate', RECORDS[0])
+            log = ''.join(sys.stderr)
+        finally:
+            server.process_record = process_record
+            sys.stderr = stderr
+        self.assertEqual(code, 500)
+        # Details are logged, but not sent to clients.
+        self.assertEqual(body, {'error': "Internal error."})
+        self.assertIn("Failed to process records: KeyError", log)
+        self.assertIn(
+            'postal_address_server_responses_total'
+            '{path="/validate",code="500"}', self.request('/metrics')[1])
+
+    def test_bind_failure(self):
+        with self.assertRaises(socket.error):
+            AddressServer(port=self.server.server_address[1], quiet=True)
+        # Metrics of the running server are left untouched.
+        self.assertIs(instrumentation.RECORDER, self.server.recorder)
+
+    def test_metrics(self):
+        self.request('/validate', RECORDS[0])
+        code, body = self.request('/metrics')
+        self.assertEqual(code, 200)
+        self.assertIn('postal_address_validations_total ', body)
+        self.assertIn('postal_address_cache_hits_total{', body)
+        self.assertIn(
+            'postal_address_server_responses_total'
+            '{path="/validate",code="200"}', body)
+        self.assertIn('postal_address_server_batch_size_count ', body)
+
+
+class TestBatchProcessor(unittest.TestCase):
+
+    def test_full_queue(self):
+        # Workers are not started, so records pile up.
+        processor = BatchProcessor(max_pending=3)
+        processor.reserve(2)
+        with self.assertRaises(queue.Full):
+            processor.submit([{}, {}], 'validate', timeout=0.01)
+        # Submissions larger than the queue are rejected right away.
+        with self.assertRaises(queue.Full):
+            processor.submit([{}] * 4, 'validate')
+        # Rejected submissions are not queued, even partially.
+        self.assertEqual(processor.queue.qsize(), 0)
+        self.assertEqual(processor.pending, 2)
+        processor.stop()
+
+    def test_bad_parameters(self):
+        with self.assertRaises(ValueError):
+            BatchProcessor(workers=0)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2018 Scaleway and Contributors. All Rights Reserved.
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import marshal
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from os import path
+
+from pycountry import countries, subdivisions
+
+from postal_address.snapshot import (
+    SNAPSHOT_ENV_VAR,
+    build_snapshot,
+    compile_snapshot,
+    default_snapshot_path,
+    fingerprint,
+    load_snapshot,
+    read_snapshot
+)
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.snapshot_path = path.join(self.temp_dir, 'sub', 'snapshot.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_content(self):
+        snapshot = build_snapshot()
+        self.assertEquals(snapshot['fingerprint'], fingerprint())
+        self.assertEquals(
+            set(record[0] for record in snapshot['countries']),
+            set(country.alpha_2 for country in countries))
+        self.assertEquals(
+            len(snapshot['subdivisions']), len(subdivisions))
+        self.assertIn(
+            ('FR-59', 'Nord', 'Metropolitan department', 'FR-HDF', 'FR'),
+            snapshot['subdivisions'])
+        self.assertIn(('TW', 'Taiwan, Province of China', 'Taiwan'),
+                      snapshot['countries'])
+
+    def test_roundtrip(self):
+        self.assertIsNone(read_snapshot(self.snapshot_path))
+        snapshot = compile_snapshot(self.snapshot_path)
+        self.assertTrue(path.isfile(self.snapshot_path))
+        self.assertEquals(read_snapshot(self.snapshot_path), snapshot)
+        self.assertEquals(load_snapshot(self.snapshot_path), snapshot)
+        # Snapshots are readable by all users, unless the umask says
+        # otherwise.
+        umask = os.umask(0o022)
+        try:
+            compile_snapshot(self.snapshot_path)
+        finally:
+            os.umask(umask)
+        self.assertEquals(
+            stat.S_IMODE(os.stat(self.snapshot_path).st_mode), 0o644)
+
+    def test_stale_snapshot(self):
+        snapshot = build_snapshot()
+        snapshot['fingerprint'] = ('outdated', )
+        os.makedirs(path.dirname(self.snapshot_path))
+        with open(self.snapshot_path, 'wb') as snapshot_file:
+            marshal.dump(snapshot, snapshot_file)
+        self.assertEquals(
+            load_snapshot(self.snapshot_path)['fingerprint'], fingerprint())
+        self.assertEquals(
+            read_snapshot(self.snapshot_path)['fingerprint'], fingerprint())
+
+    def test_corrupted_snapshot(self):
+        os.makedirs(path.dirname(self.snapshot_path))
+        with open(self.snapshot_path, 'wb') as snapshot_file:
+            snapshot_file.write(b'\x00garbage')
+        self.assertIsNone(read_snapshot(self.snapshot_path))
+        self.assertEquals(
+            load_snapshot(self.snapshot_path), build_snapshot())
+
+    def test_snapshot_path_override(self):
+        previous_value = os.environ.get(SNAPSHOT_ENV_VAR)
+        try:
+            os.environ[SNAPSHOT_ENV_VAR] = self.snapshot_path
+            self.assertEquals(default_snapshot_path(), self.snapshot_path)
+            # An empty value disables on-disk snapshots.
+            os.environ[SNAPSHOT_ENV_VAR] = ''
+            self.assertIsNone(default_snapshot_path())
+            self.assertEquals(load_snapshot(), build_snapshot())
+            self.assertFalse(path.exists(self.snapshot_path))
+        finally:
+            if previous_value is None:
+                del os.environ[SNAPSHOT_ENV_VAR]
+            else:
+                os.environ[SNAPSHOT_ENV_VAR] = previous_value
@@ -18,6 +18,15 @@ import re
 import unittest
 from operator import attrgetter
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
 from pycountry import countries, subdivisions
 
 from postal_address.address import (
@@ -26,19 +35,28 @@ from postal_address.address import (
     subdivision_type_id
 )
 from postal_address.territory import (
+    COUNTRY_ALIAS_TO_SUBDIVISION,
     COUNTRY_ALIASES,
+    FOREIGN_TERRITORIES_MAPPING,
+    RESERVED_COUNTRY_CODES,
+    REVERSE_MAPPING,
+    SUBDIVISION_ALIASES,
     SUBDIVISION_COUNTRIES,
     country_aliases,
     country_from_subdivision,
     default_subdivision_code,
+    is_within,
     normalize_territory_code,
+    normalize_territory_codes,
+    register_aliases,
     supported_country_codes,
     supported_subdivision_codes,
     supported_territory_codes,
     territory_attachment,
     territory_children_codes,
-    territory_parents_codes,
-    FOREIGN_TERRITORIES_MAPPING, RESERVED_COUNTRY_CODES)
+    territory_parents,
+    territory_parents_codes
+)
 
 PYCOUNTRY_CC = set(map(attrgetter('alpha_2'), countries))
 PYCOUNTRY_SUB = set(map(attrgetter('code'), subdivisions))
@@ -113,6 +131,35 @@ class TestTerritory(unittest.TestCase):
         self.assertEquals(default_subdivision_code('GU'), 'US-GU')
         self.assertEquals(default_subdivision_code('SJ'), None)
 
+    def test_register_aliases(self):
+        self.assertNotIn('ZZ', supported_country_codes())
+        try:
+            register_aliases(COUNTRY_ALIASES, {'zz ': 'fr'})
+            self.assertEquals(COUNTRY_ALIASES['ZZ'], 'FR')
+            self.assertIn('ZZ', supported_country_codes())
+            self.assertIn('ZZ', supported_territory_codes())
+            self.assertEquals(REVERSE_MAPPING['ZZ'], {'FR'})
+            self.assertEquals(normalize_territory_code('ZZ'), 'FR')
+        finally:
+            register_aliases(COUNTRY_ALIASES, {'ZZ': None})
+        self.assertNotIn('ZZ', COUNTRY_ALIASES)
+        self.assertNotIn('ZZ', supported_country_codes())
+        self.assertNotIn('ZZ', REVERSE_MAPPING)
+        with self.assertRaises(ValueError):
+            normalize_territory_code('ZZ')
+
+        # Overrides are propagated to the default subdivision index.
+        try:
+            register_aliases(COUNTRY_ALIAS_TO_SUBDIVISION, {'CP': 'FR-75'})
+            self.assertEquals(default_subdivision_code('CP'), 'FR-75')
+        finally:
+            register_aliases(COUNTRY_ALIAS_TO_SUBDIVISION, {'CP': 'FR-CP'})
+        self.assertEquals(default_subdivision_code('CP'), 'FR-CP')
+
+        # Only alias mappings are allowed to be updated.
+        with self.assertRaises(ValueError):
+            register_aliases({}, {'ZZ': 'FR'})
+
     def test_territory_children_codes(self):
         self.assertEquals(territory_children_codes('GQ'),
                           {'GQ-C', 'GQ-I', 'GQ-AN', 'GQ-BN', 'GQ-BS', 'GQ-CS',
@@ -123,6 +170,29 @@ class TestTerritory(unittest.TestCase):
         self.assertEquals(territory_children_codes(
             'GQ-AN', include_self=True), {'GQ-AN'})
 
+        # Subdivisions of countries are returned as-is, even those aliased to
+        # countries, while children of other subdivisions are normalized.
+        self.assertEquals(territory_children_codes('FR-GUA'), {'GP'})
+        self.assertEquals(territory_children_codes('FR-LRE'), {'RE'})
+        self.assertEquals(territory_children_codes('FR-MAY'), {'YT'})
+        self.assertIn('FR-GP', territory_children_codes('FR'))
+        self.assertNotIn('GP', territory_children_codes('FR'))
+        self.assertIn('FI-01', territory_children_codes('FI'))
+        self.assertTrue(territory_children_codes('CN').issuperset(
+            ['CN-71', 'CN-91', 'CN-92']))
+
+    def test_territory_children_index(self):
+        # Indexed lookups must match a brute-force scan of all subdivisions.
+        for country_code in PYCOUNTRY_CC:
+            self.assertEquals(
+                territory_children_codes(country_code),
+                set(subdiv.code for subdiv in subdivisions
+                    if subdiv.country_code == country_code))
+        self.assertEquals(
+            territory_children_codes('FR-HDF'),
+            set(subdiv.code for subdiv in subdivisions
+                if subdiv.parent_code == 'FR-HDF'))
+
     def test_territory_parents_codes(self):
         self.assertEquals(
             list(territory_parents_codes('FR-59')),
@@ -137,6 +207,58 @@ class TestTerritory(unittest.TestCase):
             list(territory_parents_codes('FR', include_country=False)),
             [])
 
+    def test_is_within(self):
+        self.assertTrue(is_within('FR-75', 'FR-IDF'))
+        self.assertTrue(is_within('FR-75', 'FR'))
+        self.assertTrue(is_within('FR-75', 'FR-75'))
+        self.assertTrue(is_within('FR', 'FR'))
+        self.assertFalse(is_within('FR-IDF', 'FR-75'))
+        self.assertFalse(is_within('FR', 'FR-75'))
+        self.assertFalse(is_within('FR-75', 'FR-HDF'))
+        self.assertFalse(is_within('FR-75', 'BE'))
+
+        # Aliases are normalized on both sides.
+        self.assertTrue(is_within('TA', 'SH'))
+        self.assertTrue(is_within('SH-TA', 'TA'))
+        self.assertTrue(is_within('NL-BQ3', 'BQ'))
+        self.assertTrue(is_within('GB-ENG', 'UK'))
+        self.assertFalse(is_within('FR-MQ', 'FR'))
+
+        with self.assertRaises(ValueError):
+            is_within('FR-75', 'XX')
+
+        # Interval checks must agree with a walk up the parent tree.
+        territory_codes = set(['TA', 'DG', 'NL-BQ1', 'FR-MQ', 'UK']).union(
+            territory_children_codes('FR', include_self=True),
+            territory_children_codes('GB', include_self=True),
+            territory_children_codes('SH', include_self=True))
+        for territory_code in territory_codes:
+            parent_codes = set(territory_parents_codes(territory_code))
+            for ancestor_code in parent_codes.union(['FR', 'GB', 'SH']):
+                self.assertEquals(
+                    is_within(territory_code, ancestor_code),
+                    ancestor_code in parent_codes)
+
+    def test_territory_parents_codes_consistency(self):
+        # Codes must match the ones of the whole hierarchy of objects.
+        def object_code(territory):
+            return getattr(territory, 'code', None) or territory.alpha_2
+
+        for territory_code in supported_territory_codes():
+            for include_country in (True, False):
+                try:
+                    parents = territory_parents(
+                        territory_code, include_country=include_country)
+                except ValueError:
+                    with self.assertRaises(ValueError):
+                        territory_parents_codes(
+                            territory_code, include_country=include_country)
+                    continue
+                codes = territory_parents_codes(
+                    territory_code, include_country=include_country)
+                self.assertIsInstance(codes, tuple)
+                self.assertEqual(codes, tuple(map(object_code, parents)))
+
     def test_alias_normalization(self):
         # Check country alias to a country.
         self.assertEquals(
@@ -205,6 +327,25 @@ class TestTerritory(unittest.TestCase):
 
         self.assertEquals(country_aliases('MC'), {'MC'})
 
+        # Memoized results can't be altered by callers.
+        self.assertIsInstance(country_aliases('UM-67'), frozenset)
+
+        with self.assertRaises(KeyError):
+            country_aliases('MARS')
+
+        # Runtime alias registration invalidates memoized results.
+        try:
+            register_aliases(COUNTRY_ALIASES, {'ZZ': 'MC'})
+            self.assertEquals(country_aliases('ZZ'), {'ZZ', 'MC'})
+            self.assertEquals(country_aliases('MC-CO'), {'MC'})
+            register_aliases(FOREIGN_TERRITORIES_MAPPING, {'MC': 'FR'})
+            self.assertEquals(country_aliases('ZZ'), {'ZZ', 'MC', 'FR'})
+            self.assertEquals(country_aliases('MC-CO'), {'MC', 'FR'})
+        finally:
+            register_aliases(COUNTRY_ALIASES, {'ZZ': None})
+            register_aliases(FOREIGN_TERRITORIES_MAPPING, {'MC': None})
+        self.assertEquals(country_aliases('MC-CO'), {'MC'})
+
     def test_subdivision_type_id_conversion(self):
         # Conversion of subdivision types into IDs must be python friendly
         attribute_regexp = re.compile('[a-z][a-z0-9_]*$')
@@ -279,6 +420,25 @@ class TestTerritory(unittest.TestCase):
 
         self.assertEqual("BQ-BO", normalize_territory_code("NL-BQ1"))
 
+    def test_normalization_table(self):
+        # Flat lookups must produce the same results as the sequential
+        # resolution of each alias mapping, for any supported code.
+        for territory_code in supported_territory_codes():
+            for resolve_aliases in (True, False):
+                for resolve_top_country in (True, False):
+                    code = RESERVED_COUNTRY_CODES.get(
+                        territory_code, territory_code)
+                    code = COUNTRY_ALIASES.get(code, code)
+                    if resolve_aliases:
+                        code = SUBDIVISION_ALIASES.get(code, code)
+                        code = SUBDIVISION_COUNTRIES.get(code, code)
+                    if resolve_top_country:
+                        code = FOREIGN_TERRITORIES_MAPPING.get(code, code)
+                    self.assertEqual(code, normalize_territory_code(
+                        territory_code.lower(),
+                        resolve_aliases=resolve_aliases,
+                        resolve_top_country=resolve_top_country))
+
     def test_normalize_territory_code_with_foreign_territory(self):
         resolved = normalize_territory_code("BQ",
                                             resolve_top_country=True)
@@ -296,3 +456,47 @@ class TestTerritory(unittest.TestCase):
                                             resolve_top_country=True)
 
         self.assertEqual("BQ-BO", resolved)
+
+    def test_normalize_territory_codes(self):
+        values = [' fr', 'EL', 'FR-GP', 'FR', None, 'MARS', 42, [], 'NL-BQ1']
+        codes, mask = normalize_territory_codes(values)
+        self.assertEqual(
+            codes, ['FR', 'GR', 'GP', 'FR', None, None, None, None, 'BQ-BO'])
+        self.assertEqual(
+            mask, [True, True, True, True, False, False, False, False, True])
+
+        codes, mask = normalize_territory_codes(
+            iter(['FR-GP', 'NL-BQ1', 'BQ']), resolve_top_country=True)
+        self.assertEqual(codes, ['FR', 'BQ-BO', 'NL'])
+        self.assertEqual(mask, [True, True, True])
+
+        codes, mask = normalize_territory_codes(
+            ['FR-GP', 'NL-BQ1'], resolve_aliases=False)
+        self.assertEqual(codes, ['FR-GP', 'NL-BQ1'])
+
+        self.assertEqual(normalize_territory_codes([]), ([], []))
+
+        # Batch results must match single normalization.
+        for code in supported_territory_codes():
+            self.assertEqual(
+                normalize_territory_codes([code])[0],
+                [normalize_territory_code(code)])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed.")
+    def test_normalize_territory_codes_numpy(self):
+        codes, mask = normalize_territory_codes(
+            numpy.array(['fr', 'EL', 'MARS'], dtype=object))
+        self.assertIsInstance(codes, numpy.ndarray)
+        self.assertIsInstance(mask, numpy.ndarray)
+        self.assertEqual(codes.tolist(), ['FR', 'GR', None])
+        self.assertEqual(mask.dtype, bool)
+        self.assertEqual(mask.tolist(), [True, True, False])
+
+    @unittest.skipIf(pandas is None, "pandas is not installed.")
+    def test_normalize_territory_codes_pandas(self):
+        series = pandas.Series(['fr', None, 'UK'], index=[3, 5, 7])
+        codes, mask = normalize_territory_codes(series)
+        self.assertIsInstance(codes, pandas.Series)
+        self.assertEqual(codes.tolist(), ['FR', None, 'GB'])
+        self.assertEqual(list(codes.index), [3, 5, 7])
+        self.assertEqual(mask.tolist(), [True, False, True])
@@ -18,16 +18,23 @@ from __future__ import (
 
 import io
 import re
+import sys
 from os import path
 
 from setuptools import find_packages, setup
+from setuptools.command.build_py import build_py
 
 MODULE_NAME = 'postal_address'
 PACKAGE_NAME = MODULE_NAME.replace('_', '-')
 
+# Modules relying on async/await syntax, which older Python versions can't
+# even byte-compile.
+PY35_MODULES = [
+    (MODULE_NAME, 'aio'),
+]
+
 DEPENDENCIES = [
     'boltons',
-    'Faker >= 0.8.4',
     'pycountry >= 18.5.26',
 ]
 
@@ -37,8 +44,11 @@ EXTRA_DEPENDENCIES = {
     'docs': [
         'sphinx >= 1.4',
         'sphinx_rtd_theme'],
+    'faker': [
+        'Faker >= 0.8.4'],
     'tests': [
         'coverage',
+        'Faker >= 0.8.4',
         'nose',
         'pycodestyle >= 2.1.0',
         'pylint'],
@@ -78,6 +88,20 @@ def version():
     return _version
 
 
+class BuildPy(build_py):
+    """ Leave out modules requiring Python 3.5 or newer on older versions.
+    """
+
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 5):
+            modules = [
+                (module_package, module, module_file)
+                for module_package, module, module_file in modules
+                if (module_package, module) not in PY35_MODULES]
+        return modules
+
+
 def latest_changes():
     """ Extract part of changelog pertaining to version. """
     lines = []
@@ -131,6 +155,7 @@ setup(
     dependency_links=[
     ],
     test_suite='{}.tests'.format(MODULE_NAME),
+    cmdclass={'build_py': BuildPy},
 
     classifiers=[
         # See: https://pypi.python.org/pypi?:action=list_classifiers
@@ -160,6 +185,8 @@ setup(
     ],
 
     entry_points={
-        'console_scripts': [],
+        'console_scripts': [
+            '{} = {}.cli:main'.format(PACKAGE_NAME, MODULE_NAME),
+            '{}-server = {}.server:main'.format(PACKAGE_NAME, MODULE_NAME)],
     }
 )